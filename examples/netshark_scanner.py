@@ -77,17 +77,20 @@ class SharkFinderApp(Application):
         """ Takes a shark and filters; returns an array of
             [(job_name, bytes), ...] or None if the shark returned no data
         """
-        out = []
-        for job in shark.get_capture_jobs():
-            columns = [Value(shark.columns.generic.bytes)]
+        columns = [Value(shark.columns.generic.bytes)]
+        specs = [dict(src=job, columns=columns, filters=list(filters))
+                 for job in shark.get_capture_jobs()]
 
-            with shark.create_view(job, columns, filters=filters) as view:
+        out = []
+        # all the jobs are scanned at the same time
+        with shark.create_views(specs, max_inflight=16) as batch:
+            for spec, view in batch:
                 data = view.get_data(aggregated=True)
 
-            if data:
-                job_bytes = data[0]['vals'][0][0]
+                if data:
+                    job_bytes = data[0]['vals'][0][0]
 
-                out.append((job.name, job_bytes))
+                    out.append((spec['src'].name, job_bytes))
         return out
 
     def get_csv_sharks_info(self, filename):
@@ -144,7 +147,7 @@ class SharkFinderApp(Application):
             if not jobs_bytes:
                 print "(No data returned from NetShark {0}.)".format(host)
             else:
-                for job_name, job_bytes in self.get_jobs_bytes(shark, filters):
+                for job_name, job_bytes in jobs_bytes:
                     out_table.append([host, job_name, job_bytes])
 
         if not out_table:
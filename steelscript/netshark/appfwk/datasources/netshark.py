@@ -9,19 +9,24 @@ import pandas
 import logging
 import hashlib
 import threading
+from contextlib import contextmanager
 
 from django import forms
+from django.conf import settings
 
 from steelscript.netshark.core.types import Operation, Value, Key
 from steelscript.netshark.core.filters import NetSharkFilter, TimeFilter, \
     BpfFilter
+from steelscript.netshark.core import viewutils
+from steelscript.netshark.core.viewpool import ViewPool, covers
+from steelscript.netshark.core._interfaces import Job
 from steelscript.netshark.core._class_mapping import path_to_class
 from steelscript.netshark.appfwk.models import NetSharkViews
 
+from steelscript.common.datastructures import DictObject
 from steelscript.common.timeutils import (parse_timedelta,
                                           timedelta_total_seconds,
                                           datetime_to_nanoseconds,
-                                          datetime_to_microseconds,
                                           nsec_string_to_datetime)
 
 from steelscript.appfwk.apps.devices.devicemanager import DeviceManager
@@ -36,7 +41,87 @@ from steelscript.appfwk.apps.jobs import QueryComplete
 from steelscript.appfwk.apps.devices.models import Device
 
 logger = logging.getLogger(__name__)
-lock = threading.Lock()
+
+
+class DeviceLimiter(object):
+    """ Limits the number of concurrent requests to each NetShark.
+
+    Each device gets its own semaphore, with `limits[device]` slots, or
+    `default_limit` slots for the devices not in `limits`, so that the
+    requests to one appliance never wait for the requests to another.
+
+    The time spent waiting for a slot is recorded for each device, see
+    stats().
+    """
+
+    def __init__(self, default_limit=4, limits=None):
+        self.default_limit = default_limit
+        self.limits = dict(limits or {})
+
+        # device -> semaphore
+        self._semaphores = {}
+        # device -> wait time statistics
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get(self, device):
+        with self._lock:
+            try:
+                return self._semaphores[device], self._stats[device]
+            except KeyError:
+                limit = self.limits.get(device, self.default_limit)
+                semaphore = threading.Semaphore(limit)
+                stats = DictObject(dict(limit=limit, requests=0, waiting=0,
+                                        total_wait=0.0, max_wait=0.0))
+                self._semaphores[device] = semaphore
+                self._stats[device] = stats
+                return semaphore, stats
+
+    @contextmanager
+    def slot(self, device):
+        """ Return a context manager that holds one of the slots of
+        `device` """
+        semaphore, stats = self._get(device)
+        with self._lock:
+            stats.waiting += 1
+
+        started = time.time()
+        semaphore.acquire()
+        waited = time.time() - started
+
+        with self._lock:
+            stats.waiting -= 1
+            stats.requests += 1
+            stats.total_wait += waited
+            stats.max_wait = max(stats.max_wait, waited)
+        if waited >= 1:
+            logger.info('waited %.2fs for netshark %s' % (waited, device))
+
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def stats(self):
+        """ Return a dict with, for each device, the `limit` of
+        concurrent requests, the number of `requests` made, the number of
+        requests `waiting` for a slot, and the `total_wait` and
+        `max_wait` in seconds """
+        with self._lock:
+            return dict((device, DictObject(stats))
+                        for device, stats in self._stats.iteritems())
+
+
+# concurrent requests per appliance, NETSHARK_CONCURRENCY_LIMITS may set
+# the limit of each device by id
+limiter = DeviceLimiter(
+    getattr(settings, 'NETSHARK_MAX_CONCURRENT_REQUESTS', 4),
+    getattr(settings, 'NETSHARK_CONCURRENCY_LIMITS', None))
+
+# views on stopped capture jobs, reused by the queries that only differ
+# by their timeframe: idle views are closed after 10 minutes, and at most
+# 4 views are kept open on each appliance
+view_pool = ViewPool(idle_timeout=600, max_views=4)
 
 
 def setup_capture_job(netshark, name, size=None):
@@ -180,6 +265,77 @@ class NetSharkTable(DatasourceTable):
             fields_add_bpf_filterexpr(self)
 
 
+def view_columns(table):
+    """ Return the view columns for the columns of the NetShark `table`,
+    the names of the table columns, and whether the table is a
+    timeseries: a key column called 'time' with the 'sample_time'
+    extractor gets no view column, and holds the sample times. """
+    timeseries = False
+    names = []
+    columns = []
+    for tc in table.get_columns(synthetic=False):
+        tc_options = tc.options
+        if (tc.iskey and tc.name == 'time' and
+                tc_options.extractor == 'sample_time'):
+            # don't create column, use the sample time for timeseries
+            timeseries = True
+            names.append('time')
+            continue
+        elif tc.iskey:
+            c = Key(tc_options.extractor,
+                    description=tc.label,
+                    default_value=tc_options.default_value)
+        else:
+            if tc_options.operation:
+                try:
+                    operation = getattr(Operation, tc_options.operation)
+                except AttributeError:
+                    operation = Operation.sum
+                    print ('ERROR: Unknown operation attribute '
+                           '%s for column %s.' %
+                           (tc_options.operation, tc.name))
+            else:
+                operation = Operation.none
+
+            c = Value(tc_options.extractor,
+                      operation,
+                      description=tc.label,
+                      default_value=tc_options.default_value)
+
+        names.append(tc.name)
+        columns.append(c)
+
+    return columns, names, timeseries
+
+
+def view_filters(job):
+    """ Return the NetShark and BPF filters set by the criteria of `job` """
+    criteria = job.criteria
+
+    filters = []
+
+    if hasattr(criteria, 'netshark_filterexpr'):
+        logger.debug('calculating netshark filter expression ...')
+        filterexpr = job.combine_filterexprs(
+            exprs=criteria.netshark_filterexpr,
+            joinstr="&"
+        )
+        if filterexpr:
+            logger.debug('applying netshark filter expression: %s'
+                         % filterexpr)
+            filters.append(NetSharkFilter(filterexpr))
+
+    if hasattr(criteria, 'netshark_bpf_filterexpr'):
+        # TODO evaluate how to combine multiple BPF filters
+        # this will just apply one at a time
+        filterexpr = criteria.netshark_bpf_filterexpr
+        logger.debug('applying netshark BPF filter expression: %s'
+                     % filterexpr)
+        filters.append(BpfFilter(filterexpr))
+
+    return filters
+
+
 class NetSharkQuery(TableQueryBase):
 
     def run(self):
@@ -187,9 +343,6 @@ class NetSharkQuery(TableQueryBase):
         """
         criteria = self.job.criteria
 
-        self.timeseries = False       # if key column called 'time' is created
-        self.column_names = []
-
         # Resolution comes in as a time_delta
         resolution = timedelta_total_seconds(criteria.resolution)
 
@@ -205,39 +358,8 @@ class NetSharkQuery(TableQueryBase):
 
         logger.debug("Creating columns for NetShark table %d" % self.table.id)
 
-        # Create Key/Value Columns
-        columns = []
-        for tc in self.table.get_columns(synthetic=False):
-            tc_options = tc.options
-            if (tc.iskey and tc.name == 'time' and
-                    tc_options.extractor == 'sample_time'):
-                # don't create column, use the sample time for timeseries
-                self.timeseries = True
-                self.column_names.append('time')
-                continue
-            elif tc.iskey:
-                c = Key(tc_options.extractor,
-                        description=tc.label,
-                        default_value=tc_options.default_value)
-            else:
-                if tc_options.operation:
-                    try:
-                        operation = getattr(Operation, tc_options.operation)
-                    except AttributeError:
-                        operation = Operation.sum
-                        print ('ERROR: Unknown operation attribute '
-                               '%s for column %s.' %
-                               (tc_options.operation, tc.name))
-                else:
-                    operation = Operation.none
-
-                c = Value(tc_options.extractor,
-                          operation,
-                          description=tc.label,
-                          default_value=tc_options.default_value)
-
-            self.column_names.append(tc.name)
-            columns.append(c)
+        columns, self.column_names, self.timeseries = \
+            view_columns(self.table)
 
         # Identify Sort Column
         sortidx = None
@@ -252,27 +374,7 @@ class NetSharkQuery(TableQueryBase):
 
         # Initialize filters
         criteria = self.job.criteria
-
-        filters = []
-
-        if hasattr(criteria, 'netshark_filterexpr'):
-            logger.debug('calculating netshark filter expression ...')
-            filterexpr = self.job.combine_filterexprs(
-                exprs=criteria.netshark_filterexpr,
-                joinstr="&"
-            )
-            if filterexpr:
-                logger.debug('applying netshark filter expression: %s'
-                             % filterexpr)
-                filters.append(NetSharkFilter(filterexpr))
-
-        if hasattr(criteria, 'netshark_bpf_filterexpr'):
-            # TODO evaluate how to combine multiple BPF filters
-            # this will just apply one at a time
-            filterexpr = criteria.netshark_bpf_filterexpr
-            logger.debug('applying netshark BPF filter expression: %s'
-                         % filterexpr)
-            filters.append(BpfFilter(filterexpr))
+        filters = view_filters(self.job)
 
         resolution = criteria.resolution
         if resolution.seconds == 1:
@@ -322,7 +424,13 @@ class NetSharkQuery(TableQueryBase):
 
         timefilter = TimeFilter(start=criteria.starttime, end=criteria.endtime)
 
-        if not view:
+        arrays = None
+        if (not persistent and isinstance(source, Job) and
+                criteria.starttime and criteria.endtime):
+            arrays = self._get_pooled_arrays(shark, source, columns, filters,
+                                             sampling_time_msec, sortidx)
+
+        if not view and arrays is None:
             # Not persistent, or not yet created...
 
             if not live:
@@ -340,75 +448,142 @@ class NetSharkQuery(TableQueryBase):
                                 self.table.id)
 
             # Create it
-            with lock:
-                logger.debug("%s: Creating view for table %s" %
-                             (str(self), str(self.table)))
-                view = shark.create_view(
-                    source, columns, filters=filters, sync=False,
-                    name=title, sampling_time_msec=sampling_time_msec)
-
-            if not live:
-                done = False
-                logger.debug("Waiting for netshark table %d to complete" %
-                             self.table.id)
-                while not done:
-                    time.sleep(0.5)
-                    with lock:
-                        s = view.get_progress()
-                        self.job.mark_progress(s)
-                        self.job.save()
-                        done = view.is_ready()
+            view = self._create_view(shark, source, columns, filters,
+                                     title, sampling_time_msec, live)
 
         logger.debug("Retrieving data for timeframe: %s" % timefilter)
 
-        # Retrieve the data
-        with lock:
-            getdata_kwargs = {}
-            if sortidx:
-                getdata_kwargs['sortby'] = sortidx
-
-            if self.table.options.aggregated:
-                getdata_kwargs['aggregated'] = self.table.options.aggregated
-            else:
-                getdata_kwargs['delta'] = self.delta
-
-            if live:
-                # For live views, attach the time frame to the get_data()
-                getdata_kwargs['start'] = (
-                    datetime_to_nanoseconds(criteria.starttime))
-                getdata_kwargs['end'] = (
-                    datetime_to_nanoseconds(criteria.endtime))
-
-            self.data = view.get_data(**getdata_kwargs)
-
-            if not persistent:
-                view.close()
+        if arrays is None:
+            arrays = self._get_arrays(view, sortidx, timeframe=live,
+                                      close=not persistent)
 
         if self.table.rows > 0:
-            self.data = self.data[:self.table.rows]
+            # keep only the rows of the first samples
+            arrays = arrays.select(arrays.sample < self.table.rows)
 
-        self.parse_data()
+        self.data = self.parse_data(arrays)
 
         logger.info("NetShark Report %s returned %s rows" %
                     (self.job, len(self.data)))
 
         return QueryComplete(self.data)
 
-    def parse_data(self):
-        """Reformat netshark data results to be uniform tabular format."""
-        out = []
-        if self.timeseries:
-            # use sample times for each row
-            for d in self.data:
-                if d['t'] is not None:
-                    t = datetime_to_microseconds(d['t']) / float(10 ** 6)
-                    out.extend([t] + x for x in d['vals'])
+    def _create_view(self, shark, source, columns, filters, title,
+                     sampling_time_msec, live):
+        """ Create the view and, unless it is live, wait until it is
+        computed """
+        with limiter.slot(self.job.criteria.netshark_device):
+            logger.debug("%s: Creating view for table %s" %
+                         (str(self), str(self.table)))
+            view = shark.create_view(
+                source, columns, filters=filters, sync=False,
+                name=title, sampling_time_msec=sampling_time_msec)
+
+        if not live:
+            logger.debug("Waiting for netshark table %d to complete" %
+                         self.table.id)
+
+            # polls and progress updates do not hold a slot
+            reported = []
+
+            def on_progress(view, progress):
+                if reported and reported[-1] == progress:
+                    return
+                reported.append(progress)
+                self.job.mark_progress(progress)
+                self.job.save()
+
+            viewutils.wait(view, on_progress=on_progress)
+
+        return view
+
+    def _get_pooled_arrays(self, shark, job, columns, filters,
+                           sampling_time_msec, sortidx):
+        """ Retrieve the data over the timeframe of the criteria from a
+        pooled view on the capture job `job`, or return None if there is
+        no such view that covers the timeframe.
+
+        Pooled views are created without a time filter, and the timeframe
+        is applied at get_data() time, like for live views.  A view only
+        holds the packets captured before it was created, so views are
+        only added to the pool for stopped jobs.  On a running job, a
+        pooled view serves the timeframes that ended before it was
+        created, and the other ones get their own time-filtered view.
+        On a stopped job, a pooled view covers the timeframes that end
+        after the last packet of the job.
+        """
+        criteria = self.job.criteria
+        key = (criteria.netshark_device, criteria.netshark_source_name,
+               tuple((str(c), c.operation, c.key, c.default_value)
+                     for c in columns),
+               tuple((f.__class__.__name__, f.string) for f in filters),
+               sampling_time_msec)
+        end = datetime_to_nanoseconds(criteria.endtime)
+
+        status = job.get_status()
+        job_end = None
+        create = None
+        if status['state'] != 'RUNNING':
+            job_end = int(status.get('packet_end_time') or 0)
+
+            def create():
+                return self._create_view(shark, job, columns, filters,
+                                         None, sampling_time_msec, False)
+
+        def usable(view):
+            return covers(view, end, job_end)
+
+        with view_pool.view(shark, key, create, usable) as view:
+            if view is None:
+                return None
+            logger.debug("Using pooled view %s for table %s" %
+                         (view.handle, str(self.table)))
+            return self._get_arrays(view, sortidx, timeframe=True)
+
+    def _get_arrays(self, view, sortidx, timeframe=False, close=False):
+        """ Retrieve the data of `view`, only over the timeframe of the
+        criteria if `timeframe` is True, and close the view if `close` is
+        True """
+        criteria = self.job.criteria
+        getdata_kwargs = {}
+        if sortidx:
+            getdata_kwargs['sortby'] = sortidx
 
+        if self.table.options.aggregated:
+            getdata_kwargs['aggregated'] = self.table.options.aggregated
         else:
-            for d in self.data:
-                out.extend(x for x in d['vals'])
+            getdata_kwargs['delta'] = self.delta
+
+        if timeframe:
+            # For live and pooled views, attach the time frame to
+            # the get_data()
+            getdata_kwargs['start'] = (
+                datetime_to_nanoseconds(criteria.starttime))
+            getdata_kwargs['end'] = (
+                datetime_to_nanoseconds(criteria.endtime))
+
+        with limiter.slot(criteria.netshark_device):
+            arrays = view.get_arrays(**getdata_kwargs)
+
+            if close:
+                view.close()
+
+        return arrays
+
+    def parse_data(self, arrays):
+        """Reformat netshark data results to be uniform tabular format."""
+        df = arrays.to_dataframe(include_sample_times=False)
+        # ABSOLUTE_TIME columns hold nanoseconds, report them as datetimes
+        for i, entry in enumerate(arrays.legend):
+            if entry['type'] == 'ABSOLUTE_TIME':
+                name = df.columns[i]
+                df[name] = pandas.to_datetime(df[name], unit='ns', utc=True)
+        if self.timeseries:
+            # sample times are passed on as seconds since the epoch
+            df.insert(0, 'time', arrays.row_times / float(10 ** 9))
 
-        self.data = out
+        df.columns = self.column_names
+        return df
 
 
 class NetSharkJobsTable(DatasourceTable):
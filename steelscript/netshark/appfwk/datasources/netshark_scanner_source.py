@@ -20,15 +20,16 @@ files in this directory named accordingly.
 
 """
 
-import copy
 import logging
-import datetime
 
 import pandas
 
+from steelscript.netshark.core import viewutils
+from steelscript.netshark.core.filters import TimeFilter
+from steelscript.netshark.appfwk.datasources.netshark import \
+    view_columns, view_filters, limiter
 from steelscript.appfwk.apps.datasource.models import Table
-from steelscript.appfwk.apps.jobs import QueryComplete, QueryContinue
-from steelscript.appfwk.apps.jobs.models import Job
+from steelscript.appfwk.apps.jobs import QueryComplete
 from steelscript.appfwk.apps.datasource.modules.analysis import \
     AnalysisTable, AnalysisQuery
 from steelscript.appfwk.apps.devices.devicemanager import DeviceManager
@@ -54,43 +55,56 @@ class SharksQuery(AnalysisQuery):
     def analyze(self, jobs):
         criteria = self.job.criteria
 
-        sharks_query_table = Table.from_ref(
+        basetable = Table.from_ref(
             self.table.options.related_tables['basetable'])
-
-        depjobs = {}
-
-        # For every (shark, job), we spin off a new job to grab the data, then
-        # merge everything into one dataframe at the end.
-        for s in Device.objects.filter(module='netshark', enabled=True):
-            shark = DeviceManager.get_device(s.id)
-
-            for capjob in shark.get_capture_jobs():
-                # Start with criteria from the primary table -- this gives us
-                # endtime, duration and netshark_filterexpr.
-                bytes_criteria = copy.copy(criteria)
-                bytes_criteria.netshark_device = s.id
-                bytes_criteria.netshark_source_name = 'jobs/' + capjob.name
-                bytes_criteria.resolution = datetime.timedelta(0, 1)
-                bytes_criteria.aggregated = True
-
-                job = Job.create(table=sharks_query_table,
-                                 criteria=bytes_criteria)
-
-                depjobs[job.id] = job
-
-        return QueryContinue(self.collect, depjobs)
-
-    def collect(self, jobs=None):
-
-        out = []
-        for jid, job in jobs.iteritems():
-            sharkdata = job.data()
-            if sharkdata is not None:
-                s = Device.objects.get(id=job.criteria.netshark_device)
-                out.append([s.name,
-                            s.host,
-                            job.criteria.netshark_source_name[5:],
-                            sharkdata['generic_bytes']])
+        columns, names, timeseries = view_columns(basetable)
+        if timeseries:
+            names.remove('time')
+        bytes_idx = names.index('generic_bytes')
+
+        # The criteria of the primary table give us endtime, duration,
+        # netshark_filterexpr and netshark_bpf_filterexpr.
+        filters = view_filters(self.job)
+        if criteria.starttime and criteria.endtime:
+            filters.append(TimeFilter(start=criteria.starttime,
+                                      end=criteria.endtime))
+
+        # A view is created on every capture job of every shark, and all
+        # the views are computed at the same time.  Like for NetShark
+        # tables, each request holds a slot of the device, but the polls
+        # while the views are computed do not.
+        views = []
+        try:
+            for s in Device.objects.filter(module='netshark', enabled=True):
+                shark = DeviceManager.get_device(s.id)
+
+                for capjob in shark.get_capture_jobs():
+                    with limiter.slot(s.id):
+                        view = shark.create_view(capjob, columns,
+                                                 filters=list(filters),
+                                                 sync=False)
+                    views.append((s, capjob, view))
+
+            viewutils.wait_all([view for _, _, view in views])
+
+            out = []
+            for s, capjob, view in views:
+                with limiter.slot(s.id):
+                    data = view.get_data(aggregated=True)
+                if data:
+                    out.append([s.name,
+                                s.host,
+                                capjob.name,
+                                data[0]['vals'][0][bytes_idx]])
+        finally:
+            # close all the views, without masking the original error
+            for s, _, view in views:
+                try:
+                    with limiter.slot(s.id):
+                        view.close()
+                except Exception as e:
+                    logger.warning('failed to close view %s on %s: %s' %
+                                   (view.handle, s.name, e))
 
         columns = ['name', 'host', 'capjob', 'bytes']
         df = pandas.DataFrame(out, columns=columns)
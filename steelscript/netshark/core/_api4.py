@@ -7,6 +7,7 @@
 
 
 from steelscript.netshark.core._api_helpers import APIGroup, APITimestampFormat
+from steelscript.netshark.core._utils import iter_json_array
 import urllib
 
 
@@ -40,6 +41,27 @@ class API4Group(APIGroup):
                                                body=data,
                                                params=params, extra_headers=headers)
 
+    def _jstream(self, urlpath, key,
+                 timestamp_format=APITimestampFormat.NANOSECOND,
+                 params=None, chunk_size=65536):
+        """Issue a GET request and return an iterator over the items of
+        the array `key` of the JSON response, decoded incrementally as
+        the response is read from the socket."""
+        self.add_base_header('X-RBT-High-Precision-Timestamp-Format', timestamp_format)
+
+        headers = dict(self.base_headers)
+        headers['Accept'] = 'application/json'
+
+        urlpath = urllib.quote(urlpath)
+        r = self.shark.conn.request("GET", self.uri_prefix + urlpath,
+                                    params=params, extra_headers=headers,
+                                    stream=True)
+        try:
+            for item in iter_json_array(r.iter_content(chunk_size), key):
+                yield item
+        finally:
+            r.close()
+
     def add_base_header(self, key, value=""):
         if isinstance(key, basestring):
             self.base_headers[key] = value
@@ -634,6 +656,16 @@ class Views(API4Group):
         """Return the output for the given view"""
         return self._xjtrans("/views/%s/data/%s" % (handle, output), "GET", None, as_json, timestamp_format, params)
 
+    def get_data_stream(self, handle, output, timestamp_format=APITimestampFormat.NANOSECOND, **params):
+        """Return an iterator over the samples of the output of a view,
+        decoded one at a time while the response is being received
+
+        If the session has expired, the connection reauthenticates and
+        repeats the request without streaming, so that response is read
+        completely before the first sample is decoded
+        """
+        return self._jstream("/views/%s/data/%s" % (handle, output), "samples", timestamp_format, params)
+
     def get_stats(self, handle, as_json=True, timestamp_format=APITimestampFormat.NANOSECOND):
         """Return the statistics for the given view"""
         return self._xjtrans("/views/%s/stats" % handle, "GET", None, as_json, timestamp_format)
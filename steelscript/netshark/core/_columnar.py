@@ -0,0 +1,641 @@
+# Copyright (c) 2015 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+"""
+Columnar (NumPy based) decoding of view output data.
+
+numpy is an optional dependency of this package, it is only needed
+when the columnar methods such as `Output4.get_arrays` are used.
+pyarrow is only needed to convert the data to Arrow tables, and to
+write Parquet and Arrow files.
+"""
+
+from __future__ import absolute_import
+
+import json
+import datetime
+from collections import OrderedDict
+
+from steelscript.common import timeutils
+from steelscript.netshark.core.types import Operation
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# schema metadata entry holding the json encoded legend
+LEGEND_METADATA_KEY = 'netshark.legend'
+
+
+def _ensure_numpy():
+    if numpy is None:
+        raise ImportError('numpy is required for columnar view data, '
+                          'install it with "pip install numpy"')
+
+
+def _ensure_pandas():
+    if pandas is None:
+        raise ImportError('pandas is required for DataFrame view data, '
+                          'install it with "pip install pandas"')
+
+
+def _ensure_pyarrow():
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for Arrow and Parquet view '
+                          'data, install it with "pip install pyarrow"')
+
+
+def column_dtype(legend_entry):
+    """ Return the numpy dtype used for the column described by
+    `legend_entry` """
+    vtype = legend_entry['type']
+    if vtype == 'UINT64':
+        return numpy.dtype(numpy.uint64)
+    if (vtype.startswith('INT') or vtype.startswith('UINT')
+            or vtype in ('TCP_PORT', 'UDP_PORT')):
+        return numpy.dtype(numpy.int64)
+    if vtype in ('DOUBLE', 'RELATIVE_TIME'):
+        return numpy.dtype(numpy.float64)
+    if vtype == 'BOOLEAN':
+        # Booleans that are not keys are a count of successes
+        if legend_entry['calculation'] == 'NONE':
+            return numpy.dtype(numpy.bool_)
+        return numpy.dtype(numpy.int64)
+    if vtype == 'ABSOLUTE_TIME':
+        # nanoseconds since the epoch
+        return numpy.dtype(numpy.int64)
+    return numpy.dtype(object)
+
+
+def _split_avg(strings):
+    """ Split an array of `numerator:denominator` strings in two arrays
+    of strings """
+    parts = numpy.char.partition(strings, ':')
+    return parts[:, 0], parts[:, 2]
+
+
+def is_avg_pair(legend_entry):
+    """ Return True if the values of the column described by
+    `legend_entry` are averages that can be kept as (sum, count)
+    pairs """
+    if (legend_entry['calculation'] != 'AVG' or
+            legend_entry['type'] in ('BOOLEAN', 'ABSOLUTE_TIME')):
+        return False
+    return column_dtype(legend_entry).kind in 'iuf'
+
+
+def decode_avg_pair(strings, legend_entry):
+    """ Decode the sequence of raw AVG encoded `strings` for the column
+    described by `legend_entry` into two arrays: the sums, with the
+    dtype of the column, and the int64 counts """
+    dtype = column_dtype(legend_entry)
+    if len(strings) == 0:
+        return (numpy.empty(0, dtype=dtype),
+                numpy.empty(0, dtype=numpy.int64))
+
+    num, den = _split_avg(numpy.asarray(strings))
+    if dtype.kind in 'iu' and legend_entry.get('base', 'DEC') == 'HEX':
+        sums = numpy.fromiter((int(s, 16) for s in num),
+                              dtype=dtype, count=len(num))
+    else:
+        sums = num.astype(dtype)
+    return sums, den.astype(numpy.int64)
+
+
+def _divide(sums, counts):
+    """ Return the averages for `sums` and `counts`, rounded down for
+    integer columns as by the NetShark """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        if sums.dtype.kind == 'f':
+            return sums / counts
+        return sums // counts.astype(sums.dtype)
+
+
+def group_sum(values, groups, ngroups):
+    """ Return the sum of `values` for each group, where `groups` holds
+    the group of each value, between 0 and `ngroups` - 1.  The sums
+    keep the dtype of `values`, so they are exact for integers. """
+    return _group_reduce(numpy.add, values, groups, ngroups, 0)
+
+
+def _group_reduce(ufunc, values, groups, ngroups, fill):
+    out = numpy.empty(ngroups, dtype=values.dtype)
+    out.fill(fill)
+    if len(values) == 0:
+        return out
+
+    order = numpy.argsort(groups, kind='mergesort')
+    sorted_groups = groups[order]
+    starts = numpy.flatnonzero(numpy.concatenate(
+        ([True], sorted_groups[1:] != sorted_groups[:-1])))
+    out[sorted_groups[starts]] = ufunc.reduceat(values[order], starts)
+    return out
+
+
+def reaggregate_avg(sums, counts, groups, ngroups):
+    """ Combine the (sum, count) pairs of an AVG column in `ngroups`
+    groups, see group_sum(), and return the arrays of the sums and of
+    the counts of each group.  The average of a group is the sum
+    divided by the count, as if the NetShark had computed it. """
+    return (group_sum(sums, groups, ngroups),
+            group_sum(counts, groups, ngroups))
+
+
+def decode_column(strings, legend_entry):
+    """ Decode the sequence of raw `strings` for the column described by
+    `legend_entry` into a typed numpy array.
+
+    Values are decoded the same way as in `Output4.get_iterdata`, but in
+    bulk: AVG encoded values are split and divided for the whole column
+    at once.
+    """
+    dtype = column_dtype(legend_entry)
+    if len(strings) == 0:
+        return numpy.empty(0, dtype=dtype)
+
+    avg = legend_entry['calculation'] == 'AVG'
+    vtype = legend_entry['type']
+    strings = numpy.asarray(strings)
+    den = None
+    if avg:
+        strings, den = _split_avg(strings)
+
+    if dtype == object:
+        return strings.astype(object)
+
+    if vtype == 'BOOLEAN':
+        lowered = numpy.char.lower(strings)
+        strings = numpy.where(lowered == 'true', '1',
+                              numpy.where(lowered == 'false', '0', strings))
+        return strings.astype(numpy.int64).astype(dtype)
+
+    if dtype.kind in 'iu' and legend_entry.get('base', 'DEC') == 'HEX':
+        values = numpy.fromiter((int(s, 16) for s in strings),
+                                dtype=dtype, count=len(strings))
+    else:
+        values = strings.astype(dtype)
+
+    if den is not None and vtype != 'ABSOLUTE_TIME':
+        if dtype.kind == 'f':
+            values = values / den.astype(numpy.float64)
+        else:
+            values = values // den.astype(dtype)
+    return values
+
+
+class ColumnarData(object):
+    """ Output data in columnar form, as returned by
+    :py:meth:`Output4.get_arrays`.
+
+    * `legend`: the legend of the output
+    * `t`: int64 array with the time of each sample, in nanoseconds
+      since the epoch
+    * `sample`: array with the index in `t` of the sample each row
+      belongs to
+    * `columns`: list of arrays, one for each entry in `legend`
+    * `counts`: None, unless the data has been requested with
+      `avg_pairs`: then a list with, for each entry in `legend`, None
+      or, for AVG columns that hold sums, the array of the number of
+      values in each sum
+    * `delta`: the duration of the samples in nanoseconds, if known
+    """
+
+    def __init__(self, legend, t, sample, columns, counts=None, delta=None):
+        self.legend = legend
+        self.t = t
+        self.sample = sample
+        self.columns = columns
+        self.counts = counts
+        self.delta = delta
+
+    def __len__(self):
+        return len(self.sample)
+
+    def __repr__(self):
+        return '<ColumnarData %d samples, %d rows, %d columns>' % (
+            len(self.t), len(self.sample), len(self.columns))
+
+    @property
+    def names(self):
+        """ Column names, from the legend """
+        return [entry['name'] for entry in self.legend]
+
+    @property
+    def row_times(self):
+        """ int64 array with the sample time of each row """
+        return self.t[self.sample]
+
+    def column(self, name):
+        """ Return the array for the first column called `name` """
+        return self.columns[self.names.index(name)]
+
+    def select(self, mask):
+        """ Return a new ColumnarData with only the rows selected by the
+        boolean array `mask` """
+        counts = None
+        if self.counts is not None:
+            counts = [None if c is None else c[mask] for c in self.counts]
+        return ColumnarData(self.legend, self.t, self.sample[mask],
+                            [col[mask] for col in self.columns], counts,
+                            self.delta)
+
+    def averaged(self):
+        """ Return the data with the averages in AVG columns, dividing
+        the sums by the counts if the data holds (sum, count) pairs """
+        if self.counts is None:
+            return self
+        columns = [col if counts is None else _divide(col, counts)
+                   for col, counts in zip(self.columns, self.counts)]
+        return ColumnarData(self.legend, self.t, self.sample, columns,
+                            delta=self.delta)
+
+    def rollup(self, delta, start=None):
+        """ Return the data combined in samples of `delta`, a timedelta
+        or a number of nanoseconds, computed locally as the NetShark
+        would for a request with that `delta`, see rollup(). """
+        return rollup(self, delta, start)
+
+    def to_dataframe(self, include_sample_times=True, time_column='time'):
+        """ Return the data as a pandas DataFrame, with one column per
+        legend entry named after the legend.
+
+        If `include_sample_times` is True, the first column, called
+        `time_column`, holds the sample time of each row as a UTC
+        datetime64[ns] value.  AVG columns hold averages, see averaged().
+        """
+        _ensure_pandas()
+        if self.counts is not None:
+            return self.averaged().to_dataframe(include_sample_times,
+                                                time_column)
+
+        data = OrderedDict()
+        names = self.names
+        if include_sample_times:
+            names = [time_column] + names
+            data[0] = pandas.to_datetime(self.row_times, unit='ns', utc=True)
+        for col in self.columns:
+            data[len(data)] = col
+
+        frame = pandas.DataFrame(data, columns=range(len(data)))
+        frame.columns = names
+        return frame
+
+    def to_arrow(self, include_sample_times=True, time_column='time'):
+        """ Return the data as a pyarrow Table, with the schema described
+        in `arrow_schema`.  Numeric columns are not copied.  AVG columns
+        hold averages, see averaged(). """
+        schema = arrow_schema(self.legend, include_sample_times, time_column)
+        return to_arrow_table(self, schema, include_sample_times)
+
+
+def build_columnar(legend, samples, time_scale=1, avg_pairs=False,
+                   delta=None):
+    """ Build a ColumnarData object out of raw `samples`, as returned by
+    the view get_data api.
+
+    `time_scale` is the factor that converts the sample timestamps to
+    nanoseconds.  If `avg_pairs` is True, AVG columns are kept as sums
+    and counts, see ColumnarData.  `delta` is the duration of the
+    samples, in nanoseconds.
+    """
+    _ensure_numpy()
+
+    times = []
+    counts = []
+    rows = []
+    for sample in samples:
+        vals = sample['vals']
+        times.append(int(sample['t']))
+        counts.append(len(vals))
+        rows.extend(vals)
+
+    t = numpy.array(times, dtype=numpy.int64) * time_scale
+    sample = numpy.repeat(numpy.arange(len(times), dtype=numpy.int64),
+                          counts)
+
+    if rows:
+        raw_columns = zip(*rows)
+    else:
+        raw_columns = [()] * len(legend)
+    # release the row lists as soon as they are transposed
+    del rows
+
+    if not avg_pairs:
+        columns = [decode_column(raw, entry)
+                   for raw, entry in zip(raw_columns, legend)]
+        return ColumnarData(legend, t, sample, columns, delta=delta)
+
+    columns = []
+    counts = []
+    for raw, entry in zip(raw_columns, legend):
+        if is_avg_pair(entry):
+            sums, count = decode_avg_pair(raw, entry)
+            columns.append(sums)
+            counts.append(count)
+        else:
+            columns.append(decode_column(raw, entry))
+            counts.append(None)
+    return ColumnarData(legend, t, sample, columns, counts, delta)
+
+
+def iter_columnar(legend, samples, time_scale=1, batch_rows=65536,
+                  avg_pairs=False, delta=None):
+    """ Return an iterator over ColumnarData objects built out of the raw
+    `samples`, each with the rows of consecutive samples up to about
+    `batch_rows` rows.  See build_columnar() for `time_scale`,
+    `avg_pairs` and `delta`.
+    """
+    _ensure_numpy()
+
+    batch = []
+    rows = 0
+    for sample in samples:
+        batch.append(sample)
+        rows += len(sample['vals'])
+        if rows >= batch_rows:
+            yield build_columnar(legend, batch, time_scale, avg_pairs,
+                                 delta)
+            batch = []
+            rows = 0
+    if batch:
+        yield build_columnar(legend, batch, time_scale, avg_pairs, delta)
+
+
+def _to_nanoseconds(t):
+    """ Return the sample or ABSOLUTE_TIME value `t`, in any of the time
+    formats of `Output4.get_iterdata`, as nanoseconds since the epoch """
+    if isinstance(t, datetime.datetime):
+        return timeutils.datetime_to_nanoseconds(t)
+    return int(t)
+
+
+def _native_column(values, legend_entry):
+    """ Return the array for the already converted `values` of the
+    column described by `legend_entry` """
+    dtype = column_dtype(legend_entry)
+    if legend_entry['type'] == 'ABSOLUTE_TIME':
+        values = [None if v is None else _to_nanoseconds(v) for v in values]
+    try:
+        return numpy.array(values, dtype=dtype)
+    except (TypeError, ValueError, OverflowError):
+        # missing values, as in the samples of an OutputMixer
+        return numpy.array(values, dtype=object)
+
+
+def columnar_from_samples(legend, samples):
+    """ Build a ColumnarData object out of `samples` whose values have
+    already been converted, as returned by `Output4.get_iterdata`.
+    `AvgPair` values are kept as sums and counts. """
+    _ensure_numpy()
+
+    times = []
+    counts = []
+    rows = []
+    for sample in samples:
+        vals = sample['vals'] or ()
+        times.append(_to_nanoseconds(sample['t']))
+        counts.append(len(vals))
+        rows.extend(vals)
+
+    t = numpy.array(times, dtype=numpy.int64)
+    sample = numpy.repeat(numpy.arange(len(times), dtype=numpy.int64),
+                          counts)
+    if rows:
+        raw_columns = zip(*rows)
+    else:
+        raw_columns = [()] * len(legend)
+    del rows
+
+    columns = []
+    counts = []
+    for values, entry in zip(raw_columns, legend):
+        if values and is_avg_pair(entry) and isinstance(values[0], tuple):
+            columns.append(_native_column([v[0] for v in values], entry))
+            counts.append(numpy.array([v[1] for v in values],
+                                      dtype=numpy.int64))
+        else:
+            columns.append(_native_column(values, entry))
+            counts.append(None)
+    if not any(c is not None for c in counts):
+        counts = None
+    return ColumnarData(legend, t, sample, columns, counts)
+
+
+def iter_batches(legend, stream, batch_rows=65536):
+    """ Return an iterator over ColumnarData objects for `stream`, which
+    may be a ColumnarData object, or a sequence of ColumnarData objects
+    (as returned by `Output4.iter_arrays`) and of samples (as returned
+    by `Output4.get_iterdata`).  Samples are grouped in batches of about
+    `batch_rows` rows.
+    """
+    if isinstance(stream, ColumnarData):
+        stream = [stream]
+
+    batch = []
+    rows = 0
+    for item in stream:
+        if isinstance(item, ColumnarData):
+            if batch:
+                yield columnar_from_samples(legend, batch)
+                batch = []
+                rows = 0
+            yield item
+            continue
+
+        batch.append(item)
+        rows += len(item['vals'] or ())
+        if rows >= batch_rows:
+            yield columnar_from_samples(legend, batch)
+            batch = []
+            rows = 0
+    if batch:
+        yield columnar_from_samples(legend, batch)
+
+
+def arrow_type(legend_entry):
+    """ Return the pyarrow type used for the column described by
+    `legend_entry`: ABSOLUTE_TIME values are UTC timestamps with
+    nanosecond precision, the others match the numpy dtype of
+    column_dtype(), with strings for object columns """
+    if legend_entry['type'] == 'ABSOLUTE_TIME':
+        return pyarrow.timestamp('ns', tz='UTC')
+    dtype = column_dtype(legend_entry)
+    if dtype == object:
+        return pyarrow.string()
+    return pyarrow.from_numpy_dtype(dtype)
+
+
+def arrow_schema(legend, include_sample_times=True, time_column='time'):
+    """ Return the pyarrow schema for data with `legend`, with one field
+    per legend entry named after the legend, preceded by a UTC
+    timestamp field called `time_column` if `include_sample_times` is
+    True.  The legend is stored, json encoded, in the schema metadata
+    under LEGEND_METADATA_KEY.
+    """
+    _ensure_pyarrow()
+
+    fields = []
+    if include_sample_times:
+        fields.append(pyarrow.field(time_column,
+                                    pyarrow.timestamp('ns', tz='UTC'),
+                                    nullable=False))
+    for entry in legend:
+        fields.append(pyarrow.field(entry['name'], arrow_type(entry)))
+    metadata = {LEGEND_METADATA_KEY: json.dumps(legend, default=str)}
+    return pyarrow.schema(fields, metadata=metadata)
+
+
+def _to_text(value):
+    if value is None or isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return unicode(value)
+
+
+def _arrow_array(values, atype):
+    """ Return the pyarrow array of type `atype` for the numpy array
+    `values`, without copying numeric values """
+    if values.dtype == object:
+        if atype == pyarrow.string():
+            return pyarrow.array([_to_text(v) for v in values], type=atype)
+        return pyarrow.array(values.tolist(), type=atype)
+    if pyarrow.types.is_timestamp(atype):
+        values = values.view('datetime64[ns]')
+    return pyarrow.array(values, type=atype)
+
+
+def to_arrow_table(data, schema, include_sample_times=True):
+    """ Return the ColumnarData `data` as a pyarrow Table with `schema`,
+    as returned by arrow_schema().  AVG columns hold averages. """
+    _ensure_pyarrow()
+
+    data = data.averaged()
+    arrays = []
+    if include_sample_times:
+        arrays.append(_arrow_array(data.row_times, schema[0].type))
+    types = [field.type for field in schema][len(arrays):]
+    arrays.extend(_arrow_array(column, atype)
+                  for column, atype in zip(data.columns, types))
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+def _to_ns(value):
+    """ Return the duration or time `value` in nanoseconds """
+    if isinstance(value, datetime.timedelta):
+        return ((value.days * 86400 + value.seconds) * 10 ** 9 +
+                value.microseconds * 1000)
+    return _to_nanoseconds(value)
+
+
+def _group_codes(values):
+    """ Return an array with the index of each of `values` in the sorted
+    distinct values, and the number of distinct values """
+    distinct, codes = numpy.unique(values, return_inverse=True)
+    return codes, len(distinct)
+
+
+def rollup(data, delta, start=None):
+    """ Combine the ColumnarData `data` in coarser samples of `delta`, a
+    timedelta or a number of nanoseconds, and return a new ColumnarData.
+
+    Samples are aligned on multiples of `delta` since `start` (a
+    datetime or a number of nanoseconds), or since the epoch if `start`
+    is None, which is how the NetShark aligns them.  Within each new
+    sample, the rows with the same values in the key columns (the ones
+    that are dimensions or have no calculation) are combined, and
+    ordered by key.  Each other column is combined according to the
+    `calculation` of its legend entry, see `types.Operation`:
+
+    * SUM: the sum of the values
+    * MIN and MAX: the smallest and largest value
+    * AVG: the average, which requires the data to have been
+      requested with `avg_pairs`, so that it can be computed exactly
+      from the (sum, count) pairs; the pairs are kept in the result
+    * TIME_AVG: the average over time, which requires `data.delta`
+
+    Raises ValueError for other calculations, or if `delta` is not a
+    multiple of `data.delta`.
+    """
+    _ensure_numpy()
+
+    delta = _to_ns(delta)
+    if delta <= 0:
+        raise ValueError('delta must be positive')
+    if data.delta and delta % data.delta:
+        raise ValueError('delta must be a multiple of %d ns' % data.delta)
+    origin = 0 if start is None else _to_ns(start)
+
+    # the new sample of each old sample, and of each row
+    buckets = (data.t - origin) // delta
+    bucket_codes, _ = _group_codes(buckets)
+    t = numpy.unique(buckets) * delta + origin
+    row_buckets = bucket_codes[data.sample]
+
+    keys = [i for i, entry in enumerate(data.legend)
+            if entry.get('dimension') or
+            entry['calculation'] == Operation.none]
+
+    # the group of each row, ordered by new sample then key values
+    groups = row_buckets
+    for i in keys:
+        codes, ncodes = _group_codes(data.columns[i])
+        groups, _ = _group_codes(groups * ncodes + codes)
+    _, first, groups = numpy.unique(groups, return_index=True,
+                                    return_inverse=True)
+    ngroups = len(first)
+
+    columns = []
+    counts = []
+    for i, entry in enumerate(data.legend):
+        values = data.columns[i]
+        count = None if data.counts is None else data.counts[i]
+        calculation = entry['calculation']
+
+        if i in keys:
+            values = values[first]
+        elif calculation == Operation.sum:
+            values = group_sum(values, groups, ngroups)
+        elif calculation == Operation.max:
+            values = _group_reduce(numpy.maximum, values, groups, ngroups, 0)
+        elif calculation == Operation.min:
+            values = _group_reduce(numpy.minimum, values, groups, ngroups, 0)
+        elif calculation == Operation.avg and count is not None:
+            values, count = reaggregate_avg(values, count, groups, ngroups)
+        elif calculation == Operation.avg:
+            raise ValueError('AVG column %s can only be rolled up when '
+                             'requested with avg_pairs' % entry['name'])
+        elif calculation == Operation.timeavg:
+            if not data.delta:
+                raise ValueError('TIME_AVG column %s can only be rolled up '
+                                 'when the sample duration is known' %
+                                 entry['name'])
+            # missing samples count as zero over the new sample
+            sums = group_sum(values.astype(numpy.float64), groups, ngroups)
+            values = (sums * (float(data.delta) / delta)).astype(values.dtype)
+        else:
+            raise ValueError('cannot roll up column %s with calculation %s' %
+                             (entry['name'], calculation))
+        columns.append(values)
+        counts.append(count)
+
+    if data.counts is None:
+        counts = None
+    return ColumnarData(data.legend, t, row_buckets[first], columns, counts,
+                        delta)
@@ -516,6 +516,12 @@ class _AggregatedFile(File4):
 
         return trace_file_list
 
+    def checksum(self):
+        """ Return the list of the checksums of the linked files that
+        compose the aggregated file
+        """
+        return [linked.checksum() for linked in self.list_linked_files()]
+
     def _load(self):
         self.data = self.shark.api.fs.get_details(self.data['id'], details=True)
 
@@ -125,6 +125,38 @@ class View(object):
 
         return outputs[0].get_data(*args, **kwargs)
 
+    def get_arrays(self, *args, **kwargs):
+        """ Returns the data from the output in this view in columnar
+        form.  Shorthand for `all_outputs()[0].get_arrays()`.
+
+        Raises a LookupError if the view has more than one output.
+
+        For a full description of the function arguments, refer to the
+        method Output.get_arrays().
+        """
+        outputs = self.all_outputs()
+        if len(outputs) != 1:
+            raise LookupError('This view has more than one output. You have to call get_arrays'
+                              'on an Output object directly')
+
+        return outputs[0].get_arrays(*args, **kwargs)
+
+    def get_dataframe(self, *args, **kwargs):
+        """ Returns the data from the output in this view as a pandas
+        DataFrame.  Shorthand for `all_outputs()[0].get_dataframe()`.
+
+        Raises a LookupError if the view has more than one output.
+
+        For a full description of the function arguments, refer to the
+        method Output.get_dataframe().
+        """
+        outputs = self.all_outputs()
+        if len(outputs) != 1:
+            raise LookupError('This view has more than one output. You have to call get_dataframe'
+                              'on an Output object directly')
+
+        return outputs[0].get_dataframe(*args, **kwargs)
+
     def get_legend(self):
         """ Returns the legend from the output in this view.
         Shorthand for `all_outputs()[0].get_legend()`.
@@ -155,7 +187,7 @@ class Output(object):
     def get_data(self, start=None, end=None, delta=None,
                  aggregated=False,
                  sortby=None, sorttype="descending",
-                 fromentry=0, toentry=0,):
+                 fromentry=0, toentry=0, **kwargs):
         """
         Get the data for this view. This function downloads the whole
         dataset before returning it, so it's useful when random access to the
@@ -166,7 +198,8 @@ class Output(object):
         of all arguments and their meanings.
         """
         it = self.get_iterdata(start, end, delta, aggregated,
-                               sortby, sorttype, fromentry, toentry)
+                               sortby, sorttype, fromentry, toentry,
+                               **kwargs)
         data = list()
         for row in it:
             data.append(row)
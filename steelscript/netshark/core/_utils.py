@@ -5,6 +5,11 @@
 # as set forth in the License.
 
 
+import re
+import sys
+import json
+import Queue
+import threading
 
 
 def str_to_filename(s):
@@ -20,27 +25,225 @@ def str_to_filename(s):
     s = s.replace("/", "-")
     return s
 
-def parse_encoded_avg(s, precise=False):
+def split_avg(string):
+    """ Split an AVG encoded `numerator:denominator` string in the
+    numerator string and the integer denominator """
+    num, den = string.split(':', 1)
+    return num, int(den)
 
-    comp = s.split(':')
+def parse_encoded_avg(s, precise=False):
+    num, den = split_avg(s)
 
     if precise:
-        return float(comp[0]) / float(comp[1])
+        return float(num) / den
     else:
-        return int(comp[0]) / int(comp[1])
+        return int(num) / den
 
 def value_to_int(s, precise=False):
-    comp = s.split(':')
-
-    if len(comp) == 1:
+    if ':' not in s:
         if precise:
             return float(s)
         else:
             return int(s)
-    elif len(comp) == 2:
-        if precise:
-            return float(comp[0]) / float(comp[1])
-        else:
-            return int(comp[0]) / int(comp[1])
+    elif s.count(':') == 1:
+        return parse_encoded_avg(s, precise)
     else:
         return 0
+
+
+_PREFETCH_DONE = object()
+
+
+def prefetch(iterable, depth=1):
+    """Return an iterator over the items of `iterable` that are computed
+    by a background thread ahead of the consumer.
+
+    At most `depth` items are queued waiting for the consumer, so memory
+    stays bounded.  Exceptions raised by `iterable` are re-raised in the
+    consumer.  The background thread is started when the first item is
+    requested, and stops as soon as the returned iterator is closed or
+    garbage collected.
+    """
+    items = Queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except Exception:
+            put((False, sys.exc_info()))
+        else:
+            put((True, _PREFETCH_DONE))
+
+    def consume():
+        thread = threading.Thread(target=worker, name='netshark-prefetch')
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                ok, item = items.get()
+                if not ok:
+                    raise item[0], item[1], item[2]
+                if item is _PREFETCH_DONE:
+                    return
+                yield item
+        finally:
+            stop.set()
+
+    return consume()
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRUCTURE = re.compile(r'["{}\[\]]')
+_STRING_END = re.compile(r'["\\]')
+
+
+def _string_end(buf, pos):
+    """ Return the index after the end of the JSON string that starts
+    at `pos` in `buf`, or None if the string is not complete """
+    pos += 1
+    while True:
+        m = _STRING_END.search(buf, pos)
+        if m is None:
+            return None
+        if m.group() == '"':
+            return m.end()
+        # skip the escaped character
+        pos = m.end() + 1
+        if pos > len(buf):
+            return None
+
+
+def iter_json_array(chunks, key):
+    """Incrementally decode the items of the array `key` of a JSON object
+    that is received as a sequence of string `chunks`.
+
+    Items are yielded as soon as they have been received completely, so
+    only the item being decoded and the unparsed tail of the stream are
+    held in memory.  Only the `key` entry of the top level object is
+    used, anything else is skipped, including `key` entries of nested
+    objects.  A null `key`, like an empty response, yields no items.
+    Raises ValueError if the stream is not valid JSON, or if it ends
+    before the array is complete.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    marker = '"%s"' % key
+    buf = ''
+    pos = 0
+
+    def more(buf, pos, size=0):
+        # drop what was consumed, then read until the unparsed part of
+        # the buffer is at least `size` long
+        buf = buf[pos:]
+        for chunk in chunks:
+            buf += chunk
+            if len(buf) > size:
+                return buf, True
+        return buf, False
+
+    # look for the `key` entry of the top level object, skipping the
+    # strings and the nested values
+    depth = 0
+    started = False
+    while True:
+        m = _STRUCTURE.search(buf, pos)
+        if m is None:
+            buf, ok = more(buf, len(buf))
+            pos = 0
+            if not ok:
+                if not started and not buf.strip():
+                    # an empty response
+                    return
+                raise ValueError('no "%s" array found in the response' % key)
+            continue
+
+        started = True
+        pos = m.start()
+        c = m.group()
+        if c in '{[':
+            depth += 1
+            pos += 1
+            continue
+        if c in '}]':
+            depth -= 1
+            pos += 1
+            continue
+
+        # a string, which may be the key: look at what follows it, and
+        # parse it again with more data if it is cut
+        end = _string_end(buf, pos)
+        value = None
+        if end is not None:
+            value = colon = _WHITESPACE.match(buf, end).end()
+            if depth == 1 and buf[pos:end] == marker and colon < len(buf):
+                if buf[colon] == ':':
+                    value = _WHITESPACE.match(buf, colon + 1).end()
+                    if value < len(buf) and buf[value] == '[':
+                        pos = value + 1
+                        break
+                    if buf.startswith('null', value):
+                        return
+                    if 'null'.startswith(buf[value:value + 4]):
+                        value = len(buf)
+        if value is None or value >= len(buf):
+            size = len(buf) - pos
+            buf, ok = more(buf, pos, 2 * size)
+            pos = 0
+            if not ok and len(buf) == size:
+                raise ValueError('truncated response, no "%s" array found'
+                                 % key)
+            continue
+        pos = end
+
+    expect_comma = False
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            buf, ok = more(buf, pos)
+            pos = 0
+            if not ok:
+                raise ValueError('truncated "%s" array' % key)
+            continue
+
+        if buf[pos] == ']':
+            return
+        if expect_comma:
+            if buf[pos] != ',':
+                raise ValueError('expected "," in "%s" array' % key)
+            pos += 1
+            expect_comma = False
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+            complete = end < len(buf)
+        except ValueError:
+            complete = False
+        if not complete:
+            # the item may continue in the next chunks: read at least as
+            # much again as is buffered, so that large items are not
+            # parsed over and over
+            buf, ok = more(buf, pos, 2 * (len(buf) - pos))
+            pos = 0
+            if ok:
+                continue
+            item, end = decoder.raw_decode(buf, pos)
+
+        yield item
+        expect_comma = True
+        pos = end
+        if pos > len(buf) // 2:
+            buf = buf[pos:]
+            pos = 0
@@ -8,61 +8,370 @@
 
 import time
 import json
+import hashlib
 import logging
+import datetime
+import operator
+from itertools import izip
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
 from steelscript.common import timeutils
 from steelscript.common.datastructures import DictObject
-from steelscript.netshark.core import _interfaces
+from steelscript.common.exceptions import RvbdException, RvbdHTTPException
+from steelscript.netshark.core import _interfaces, _columnar, _utils, _waiter
 from steelscript.netshark.core._class_mapping import path_to_class
 from steelscript.netshark.core._api_helpers import APITimestampFormat
 
 logger = logging.getLogger(__name__)
 
 
-__all__ = ['View4', 'Output4']
+__all__ = ['View4', 'Output4', 'Sample', 'Timestamp', 'AvgPair']
 
 
-def _to_native(string, legend_entry):
-    """ convert `string` to an appropriate native type given `legend_entry` """
-    if legend_entry['calculation'] == 'AVG':
-        string, den = string.split(':', 1)
-        denominator = int(den)
-    else:
-        denominator = 1
-
-    if (legend_entry['type'].startswith('INT')
-            or legend_entry['type'].startswith('UINT')
-                or legend_entry['type'] in ('TCP_PORT', 'UDP_PORT')):
+_BOOLEAN_VALUES = {'false': 0, '0': 0, 'true': 1, '1': 1}
+
+# maximum number of legends cached by a NetShark object
+_LEGENDS_CACHE_SIZE = 1024
+
+TIME_FORMATS = ('datetime', 'ns', 'lazy')
+
+_DATETIME_CONVERTERS = {
+    1: timeutils.sec_string_to_datetime,
+    10 ** 3: timeutils.msec_string_to_datetime,
+    10 ** 6: timeutils.usec_string_to_datetime,
+    10 ** 9: timeutils.nsec_string_to_datetime,
+}
+
+
+_split_avg = _utils.split_avg
+
+
+def _passthrough(string):
+    return string
+
+
+def _make_time_converter(time_format, resolution=10 ** 9):
+    """ Return a callable that converts a raw timestamp, in units of
+    1/`resolution` seconds since the epoch, to the representation
+    selected by `time_format`:
+
+    * `datetime`: a timezone aware datetime
+    * `ns`: an integer number of nanoseconds
+    * `lazy`: a `Timestamp`, that only builds the datetime when used
+    """
+    if time_format == 'datetime':
+        return _DATETIME_CONVERTERS[resolution]
+
+    scale = 10 ** 9 // resolution
+    if time_format == 'ns':
+        if scale == 1:
+            return int
+
+        def convert_ns(value):
+            return int(value) * scale
+        return convert_ns
+
+    if time_format == 'lazy':
+        def convert_lazy(value):
+            return Timestamp(int(value) * scale)
+        return convert_lazy
+
+    raise ValueError('invalid time_format %s, must be one of %s' %
+                     (time_format, ', '.join(TIME_FORMATS)))
+
+
+def _make_converter(legend_entry, time_format='datetime', avg_pairs=False):
+    """ Return a callable that converts a raw string value to the
+    appropriate native type given `legend_entry`.
+
+    All the decisions based on the legend (calculation, type and base)
+    are taken here once, so that the returned callable does the minimum
+    amount of work for each value.  ABSOLUTE_TIME values are converted
+    according to `time_format`, see `_make_time_converter`.  If
+    `avg_pairs` is True, averaged numbers are returned as `AvgPair`
+    objects instead of being divided.
+    """
+    avg = legend_entry['calculation'] == 'AVG'
+    vtype = legend_entry['type']
+
+    if (vtype.startswith('INT') or vtype.startswith('UINT')
+            or vtype in ('TCP_PORT', 'UDP_PORT')):
         if legend_entry['base'] == 'DEC':
             baseval = 10
         elif legend_entry['base'] == 'HEX':
             baseval = 16
         else:
-            raise ValueError('do not know how to handle integer base %s' %
-                             legend_entry['base'])
-        return int(string, baseval) / denominator
+            msg = ('do not know how to handle integer base %s' %
+                   legend_entry['base'])
+
+            def convert_unknown_base(string):
+                raise ValueError(msg)
+            return convert_unknown_base
+
+        if avg and avg_pairs:
+            def convert_int_pair(string):
+                num, den = _split_avg(string)
+                return AvgPair(int(num, baseval), den)
+            return convert_int_pair
+
+        if avg:
+            def convert_int_avg(string):
+                num, den = _split_avg(string)
+                return int(num, baseval) / den
+            return convert_int_avg
+
+        if baseval == 16:
+            def convert_hex(string):
+                return int(string, 16)
+            return convert_hex
+
+        return int
+
+    if vtype in ('DOUBLE', 'RELATIVE_TIME'):
+        if avg and avg_pairs:
+            def convert_double_pair(string):
+                num, den = _split_avg(string)
+                return AvgPair(float(num), den)
+            return convert_double_pair
+
+        if avg:
+            def convert_double_avg(string):
+                num, den = _split_avg(string)
+                return float(num) / den
+            return convert_double_avg
+        return float
+
+    if vtype == 'BOOLEAN':
+        def convert_boolean(string):
+            if avg:
+                string = _split_avg(string)[0]
+            try:
+                return _BOOLEAN_VALUES[string.lower()]
+            except KeyError:
+                # Booleans can be a count of successes
+                return int(string)
+        return convert_boolean
+
+    if vtype == 'ABSOLUTE_TIME':
+        convert_time = _make_time_converter(time_format)
+        if avg:
+            def convert_time_avg(string):
+                return convert_time(_split_avg(string)[0])
+            return convert_time_avg
+        return convert_time
 
-    if legend_entry['type'] == 'DOUBLE':
-        return float(string) / denominator
+    # XXX anything with IPv4 or ETHER?
 
-    if legend_entry['type'] == 'BOOLEAN':
-        if string.lower() == 'false' or string.lower() == '0':
-            return 0
-        elif string.lower() == 'true' or string.lower() == '1':
-            return 1
-        else:
-            # Booleans can be a count of successes
-            return int(string)
+    if avg:
+        def convert_other_avg(string):
+            return _split_avg(string)[0]
+        return convert_other_avg
 
-    if legend_entry['type'] == 'ABSOLUTE_TIME':
-        return timeutils.nsec_string_to_datetime(string)
+    return _passthrough
 
-    if legend_entry['type'] == 'RELATIVE_TIME':
-        return float(string) / denominator
 
-    # XXX anything with IPv4 or ETHER?
+def _compile_converters(legend, time_format='datetime', avg_pairs=False):
+    """ Return a tuple with one converter per entry of `legend` """
+    return tuple(_make_converter(entry, time_format, avg_pairs)
+                 for entry in legend)
+
+
+class AvgPair(namedtuple('AvgPair', ['sum', 'count'])):
+    """ The value of an AVG field, kept as the `sum` of the values that
+    were averaged and their `count`, as returned with the `avg_pairs`
+    option of `Output4.get_iterdata`.
+
+    Unlike the averages, pairs can be combined exactly with merge(),
+    for instance to compute the average over a longer interval out of
+    the values of its samples.
+    """
+    __slots__ = ()
+
+    @property
+    def value(self):
+        """ The average, or None if no values were averaged """
+        if not self.count:
+            return None
+        return self.sum / self.count
+
+    def merge(self, other):
+        """ Return the pair for the values of both this pair and `other` """
+        return AvgPair(self.sum + other.sum, self.count + other.count)
+
+    @classmethod
+    def combine(cls, pairs):
+        """ Return the pair for the values of all `pairs` """
+        total = 0
+        count = 0
+        for pair in pairs:
+            total += pair.sum
+            count += pair.count
+        return cls(total, count)
+
+
+def _to_native(string, legend_entry):
+    """ convert `string` to an appropriate native type given `legend_entry` """
+    return _make_converter(legend_entry)(string)
+
+
+class Sample(object):
+    """ Compact representation of a sample of output data, returned by
+    `Output4.get_iterdata` with `compact=True`.
+
+    A Sample uses much less memory than the dictionary returned by
+    default, and supports the same access by key (`sample['t']`,
+    `'gap_start' in sample`, `sample.get('p')`), as well as attribute
+    access.  Fields that are None, such as the gap markers of a sample
+    that is not a gap, behave like missing keys.
+    """
+    __slots__ = ('t', 'p', 'vals', 'gap_start', 'gap_end')
+
+    def __init__(self, t, p=None, vals=None, gap_start=None, gap_end=None):
+        self.t = t
+        self.p = p
+        self.vals = vals
+        self.gap_start = gap_start
+        self.gap_end = gap_end
+
+    def __repr__(self):
+        return '<Sample %s>' % ', '.join('%s=%r' % item
+                                          for item in self.items())
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Sample, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in self.__slots__
+                if getattr(self, key) is not None]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def to_dict(self):
+        """ Return the sample as a dictionary """
+        return dict(self.items())
+
+
+class Timestamp(object):
+    """ A time in nanoseconds since the epoch, returned for sample times
+    and ABSOLUTE_TIME values by `Output4.get_iterdata` with
+    `time_format='lazy'`.
+
+    The number of nanoseconds is available as `ns` (or with int()), the
+    equivalent datetime is only built the first time it is needed, that
+    is when the `datetime` property or any datetime attribute or method
+    (`year`, `strftime()`, ...) is accessed.  Timestamps can be compared
+    with each other, with datetimes and with numbers of nanoseconds, and
+    support arithmetic with timedeltas and datetimes like a datetime.
+    """
+    __slots__ = ('ns', '_datetime')
+
+    def __init__(self, ns):
+        self.ns = ns
+        self._datetime = None
+
+    @property
+    def datetime(self):
+        """ The time as a timezone aware datetime """
+        if self._datetime is None:
+            self._datetime = timeutils.nsec_to_datetime(self.ns)
+        return self._datetime
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.datetime, name)
+
+    def __repr__(self):
+        return '<Timestamp %d>' % self.ns
+
+    def __str__(self):
+        return str(self.datetime)
+
+    def __int__(self):
+        return self.ns
+
+    __long__ = __int__
+
+    def __hash__(self):
+        return hash(self.ns)
+
+    def _compare(self, other, op):
+        if isinstance(other, Timestamp):
+            return op(self.ns, other.ns)
+        if isinstance(other, datetime.datetime):
+            return op(self.datetime, other)
+        if isinstance(other, (int, long)):
+            return op(self.ns, other)
+        return NotImplemented
+
+    def __eq__(self, other):
+        return self._compare(other, operator.eq)
+
+    def __ne__(self, other):
+        return self._compare(other, operator.ne)
+
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
+
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+
+    def __gt__(self, other):
+        return self._compare(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+
+    def __add__(self, other):
+        return self.datetime + other
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Timestamp):
+            other = other.datetime
+        return self.datetime - other
+
+    def __rsub__(self, other):
+        return other - self.datetime
 
-    return string
 
 class View4(_interfaces.View):
     def __init__(self, shark, handle, config=None, source=None):
@@ -70,18 +379,41 @@ class View4(_interfaces.View):
 
         self.shark = shark
         self.handle = handle
-        self.source = source
         self._outputs = {}
+        self._config_hash = None
         self.timestamp_format = APITimestampFormat.NANOSECOND
+        # the last time details retrieved, see _get_timeinfo
+        self._timeinfo = None
+
+        # when not given, the configuration and the source are only
+        # requested from the netshark the first time they are needed
+        self._config = config
+        self._source = source
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = self.shark.api.view.get_config(self.handle, timestamp_format=self.timestamp_format)
+        return self._config
+
+    @config.setter
+    def config(self, config):
+        self._config = config
+        self._config_hash = None
+
+    @property
+    def source(self):
+        if self._source is None:
+            path = self.config['input_source']['path']
+            self._source = path_to_class(self.shark, path)
+        return self._source
 
-        if config is None:
-            self.config = shark.api.view.get_config(handle, timestamp_format=self.timestamp_format)
-        else:
-            self.config = config
+    @source.setter
+    def source(self, source):
+        self._source = source
 
-        if source is None:
-            path = self.config['input_source']['path']
-            self.source = path_to_class(shark, path)
+    def _has_config(self):
+        return self._config is not None
 
     def __repr__(self):
         d = {}
@@ -196,26 +528,44 @@ class View4(_interfaces.View):
     def _get_timeinfo(self):
         """Return the timeinfo exactly as it comes from netshark
         """
-        # check three times before giving up
-        count = 0
+        # the time details may not be available right after the view
+        # is created: check again with growing delays before giving up
         timeinfo = None
-        while count < 3:
+        for delay in (0.1, 0.2, 0.4, 0.8, None):
             res = self.shark.api.view.get_stats(self.handle, timestamp_format=self.timestamp_format)
             timeinfo = res.get('time_details')
             if timeinfo['start'] and timeinfo['end']:
-                return DictObject(timeinfo)
-            else:
-                count += 1
-                time.sleep(0.5)
+                self._timeinfo = DictObject(timeinfo)
+                break
+            if delay is not None:
+                time.sleep(delay)
         return DictObject(timeinfo)
 
     def _poll_completion(self):
-        while True:
-            res = self.shark.api.view.get_stats(self.handle, timestamp_format=self.timestamp_format)
-            status = res.get('state')
-            if status == "DONE":
-                break
-            time.sleep(0.5)
+        _waiter.wait(self)
+
+    def _get_config_hash(self):
+        """ Return a hash of the processors in the view configuration,
+        which determine the legends of the outputs """
+        if self._config_hash is None:
+            processors = json.dumps(self.config['processors'],
+                                    sort_keys=True, default=str)
+            self._config_hash = hashlib.sha1(processors).hexdigest()
+        return self._config_hash
+
+    def get_legends(self, parallel=8):
+        """ Return a dict with the legend of each output of this view,
+        indexed by output id.  The legends that are not known yet are
+        requested over up to `parallel` concurrent connections. """
+        outputs = self.all_outputs()
+        missing = [output for output in outputs if not output._has_legend()]
+        if len(missing) > 1 and parallel > 1:
+            pool = ThreadPool(min(parallel, len(missing)))
+            try:
+                pool.map(lambda output: output._legend, missing)
+            finally:
+                pool.terminate()
+        return dict((output.id, output.get_legend()) for output in outputs)
 
     def _postapply(self):
         for processor in self.config['processors']:
@@ -259,7 +609,39 @@ class Output4(_interfaces.Output):
 
         self.view = view
         self.id = ouid
-        self._legend = self.get_legend()
+        # fetched on first use, see _legend
+        self._cached_legend = None
+        self._converters = {}
+        self.partition_stats = []
+
+    @property
+    def _legend(self):
+        if self._cached_legend is None:
+            self._cached_legend = self._fetch_legend()
+        return self._cached_legend
+
+    def _has_legend(self):
+        return self._cached_legend is not None
+
+    def _fetch_legend(self):
+        """ Return the legend of this output, from the legends cache of
+        the NetShark object if a view with the same configuration has
+        already been seen """
+        shark = self.view.shark
+        cache = getattr(shark, '_legends_cache', None)
+        key = (self.view._get_config_hash(), self.id,
+               self.view.timestamp_format)
+        if cache is not None and key in cache:
+            return cache[key]
+
+        legend = shark.api.view.get_legend(
+            self.view.handle, self.id,
+            timestamp_format=self.view.timestamp_format)
+        if cache is not None:
+            if len(cache) >= _LEGENDS_CACHE_SIZE:
+                cache.clear()
+            cache[key] = legend
+        return legend
 
     def get_legend(self):
         """ Return the legend for this output.  The legend consists of
@@ -279,8 +661,30 @@ class Output4(_interfaces.Output):
         * `id`
         * `base`
         * `dimension`
+
+        The legend is only requested from the NetShark the first time it
+        is needed, and is shared with the outputs of views that have the
+        same configuration.
         """
-        return self.view.shark.api.view.get_legend(self.view.handle, self.id, timestamp_format=self.view.timestamp_format)
+        # the entries are copied, since the legend is shared
+        return [DictObject(entry) for entry in self._legend]
+
+    def _get_converters(self, time_format='datetime', avg_pairs=False):
+        """ Return a tuple with the sample time converter and the value
+        converters for this output, compiling them from the view
+        timestamp format and the legend the first time they are needed
+        for `time_format` and `avg_pairs` """
+        key = (time_format, avg_pairs)
+        try:
+            return self._converters[key]
+        except KeyError:
+            convert_time = _make_time_converter(time_format,
+                                                self._get_time_resolution())
+            converters = (convert_time,
+                          _compile_converters(self._legend, time_format,
+                                              avg_pairs))
+            self._converters[key] = converters
+            return converters
 
     def _get_time_resolution(self):
         if self.view.timestamp_format == APITimestampFormat.SECOND:
@@ -292,19 +696,10 @@ class Output4(_interfaces.Output):
         elif self.view.timestamp_format == APITimestampFormat.NANOSECOND:
             return 10 ** 9
         else:
-            raise ValueError('invalid time format %s' % str(view.timestamp_format))
+            raise ValueError('invalid time format %s' % str(self.view.timestamp_format))
 
     def _convert_sample_time(self, sample_timestamp):
-        if self.view.timestamp_format == APITimestampFormat.SECOND:
-            return timeutils.sec_string_to_datetime(sample_timestamp)
-        elif self.view.timestamp_format == APITimestampFormat.MILLISECOND:
-            return timeutils.msec_string_to_datetime(sample_timestamp)
-        elif self.view.timestamp_format == APITimestampFormat.MICROSECOND:
-            return timeutils.usec_string_to_datetime(sample_timestamp)
-        elif self.view.timestamp_format == APITimestampFormat.NANOSECOND:
-            return timeutils.nsec_string_to_datetime(sample_timestamp)
-        else:
-            raise ValueError('invalid time format %s' % str(view.timestamp_format))
+        return self._get_converters()[0](sample_timestamp)
 
     def _parse_output_params(self, start=None, end=None, delta=None,
                              aggregated=False, sortby=None,
@@ -375,14 +770,125 @@ class Output4(_interfaces.Output):
 
         return params
 
+    def _fetch_samples(self, params, stream=False, use_cache=True):
+        """ Issue one get_data request and return the raw samples.  If
+        `stream` is True, an iterator is returned that decodes the
+        samples one at a time while the response is received.
+
+        If a result cache is attached to the NetShark and `use_cache` is
+        True, cacheable requests are served from and stored into it """
+        cache = None
+        if use_cache:
+            cache = getattr(self.view.shark, 'result_cache', None)
+        key = None
+        if cache is not None:
+            key = cache.make_key(self, params)
+            if key is not None:
+                samples = cache.get(key)
+                if samples is not None:
+                    return samples
+                # the whole response is needed to fill the cache
+                stream = False
+
+        # aggregated debug
+        logger.debug('get_data params: %s' % params)
+
+        if stream:
+            return self.view.shark.api.view.get_data_stream(self.view.handle, self.id, timestamp_format=self.view.timestamp_format, **params)
+
+        res = self.view.shark.api.view.get_data(self.view.handle, self.id, timestamp_format=self.view.timestamp_format, **params)
+        samples = res.get('samples') or []
+        if key is not None:
+            cache.put(key, samples)
+        return samples
+
+    @staticmethod
+    def _data_samples(samples):
+        """ Return an iterator over the raw `samples` that carry data """
+        for sample in samples:
+            if 'vals' not in sample or sample['p'] == 0:
+                continue
+            yield sample
+
+    def _iter_samples(self, params, stream=False):
+        """ Return an iterator over the raw samples that carry data """
+        return self._data_samples(self._fetch_samples(params, stream))
+
+    def _timedelta_to_units(self, td):
+        """ Convert the timedelta `td` to the units of the view
+        timestamp format """
+        resolution = self._get_time_resolution()
+        return ((td.days * 24 * 3600 + td.seconds) * resolution +
+                td.microseconds * resolution // 10 ** 6)
+
+    def _to_units(self, value):
+        """ Convert a datetime `value` to the units of the view timestamp
+        format, numbers are returned unchanged """
+        if isinstance(value, datetime.datetime):
+            ns = timeutils.datetime_to_nanoseconds(value)
+            return ns * self._get_time_resolution() // 10 ** 9
+        if isinstance(value, Timestamp):
+            return value.ns * self._get_time_resolution() // 10 ** 9
+        return value
+
+    def _split_params(self, params, chunk=None, parts=None):
+        """ Split the request described by `params` into a list of
+        requests for consecutive windows of time.
+
+        `chunk` is either a timedelta or a number of samples, and sets the
+        length of each window.  Alternatively, `parts` is the number of
+        windows the whole range is divided into.  Windows are a whole
+        number of `delta` long and start on the same grid as the full
+        request, so the concatenation of all the windows yields the same
+        samples as the full request.
+        """
+        if 'aggregated' in params or 'sortby' in params:
+            raise ValueError('time windows cannot be used with aggregated '
+                             'or sorted requests')
+
+        delta = params['delta']
+        if chunk is not None:
+            if hasattr(chunk, 'seconds'):
+                step = self._timedelta_to_units(chunk) // delta * delta
+            else:
+                step = int(chunk) * delta
+            if step <= 0:
+                raise ValueError('chunk must span at least one sample')
+
+        start = self._to_units(params['start'])
+        end = self._to_units(params['end'])
+        if not start or not end:
+            ti = self.view._get_timeinfo()
+            start = start or ti.start
+            end = end or ti.end
+            if not start or not end:
+                # no data in the view yet, nothing to split
+                return [params]
+
+        if chunk is None:
+            nsamples = (end - start) // delta + 1
+            step = -(-nsamples // parts) * delta
+
+        windows = []
+        while start <= end:
+            window = dict(params)
+            window['start'] = start
+            window['end'] = min(start + step - delta, end)
+            windows.append(window)
+            start += step
+        return windows
+
     def get_iterdata(self, start=None, end=None, delta=None,
                      aggregated=False,
                      sortby=None, sorttype="descending",
-                     fromentry=0, toentry=0):
+                     fromentry=0, toentry=0,
+                     chunk=None, prefetch=0, parallel=None, stream=False,
+                     compact=False, time_format='datetime', avg_pairs=False):
         """
         Returns an iterator to the output data. This function is ideal for
-        sequential parsing of the view data, because it downloads the
-        dataset incrementally as it is accessed.
+        sequential parsing of the view data: samples are converted only
+        as they are accessed and, if `chunk` is specified, the dataset
+        is downloaded incrementally.
 
         `start` and `end` are `datetime.datetime` objects representing
         the earliest and latest packets that should be considered.
@@ -414,27 +920,477 @@ class Output4(_interfaces.Output):
 
         The `toentry` parameter represent the last sorted item we want to
         appear in the output.  0 means all of them.
+
+        `chunk` splits the requested time range into windows that are
+        downloaded one at a time, as the iterator reaches them, so that
+        only one window is held in memory.  It is either a
+        `datetime.timedelta` or a number of samples, and it is rounded
+        down to a multiple of `delta`.  Chunks cannot be used with
+        `aggregated` or `sortby`.
+
+        `prefetch` is the number of windows that are downloaded ahead by
+        a background thread while the caller consumes the current one,
+        so that network transfers overlap with processing.  At most
+        `prefetch` windows are held in memory on top of the current one.
+
+        `parallel` is a number of threads used to download the data
+        concurrently.  The time range is split into that many windows
+        (or into windows of `chunk`, if specified) that are requested at
+        the same time and yielded in time order.  This is most useful
+        with finished sources such as trace files and clips.  The
+        latency of each window is logged and stored in the
+        `partition_stats` attribute of this output, as a list of
+        objects with `start`, `end`, `elapsed` (seconds) and `samples`.
+        It describes the last parallel download only, and is not
+        reliable when the same output is read by several threads at
+        once.
+
+        If `stream` is True, the samples are decoded one at a time as
+        the response is read from the socket, instead of parsing the
+        whole response first: the first sample is available before the
+        download completes, and memory does not grow with the size of
+        the response.  Streaming applies to sequential downloads, it is
+        ignored with `prefetch` and `parallel`, where whole windows are
+        downloaded ahead of the caller.
+
+        By default each sample is the dictionary decoded from the
+        response, with `t` and `vals` converted.  If `compact` is True,
+        samples are returned as `Sample` objects instead, which support
+        the same access by key but take much less memory, which matters
+        when millions of samples are kept around.
+
+        `time_format` selects how sample times and ABSOLUTE_TIME values
+        are returned:
+
+        * `datetime`: timezone aware datetime objects (the default)
+        * `ns`: integer numbers of nanoseconds since the epoch, which
+          avoids building datetimes that are converted back to numbers
+        * `lazy`: `Timestamp` objects, that hold the nanoseconds and
+          build the datetime only when it is used
+
+        The values of numeric fields with the AVG calculation are
+        averages.  If `avg_pairs` is True, they are `AvgPair` objects
+        instead, holding the sum of the values and their count as sent
+        by the NetShark, so that samples can be combined exactly, for
+        instance into coarser samples, without a new request.
         """
         params = self._parse_output_params(start, end, delta, aggregated, sortby, sorttype, fromentry, toentry)
 
-        res = self.view.shark.api.view.get_data(self.view.handle, self.id, timestamp_format=self.view.timestamp_format, **params)
+        samples = self._iter_windows(params, chunk, prefetch, parallel,
+                                     stream)
+        for sample in self._convert_samples(samples, time_format, compact,
+                                            avg_pairs):
+            yield sample
 
-        samples = res.get('samples')
+    def _convert_samples(self, samples, time_format='datetime',
+                         compact=False, avg_pairs=False):
+        """ Return an iterator over the raw `samples` with their time and
+        values converted, as described in get_iterdata() """
+        convert_time, converters = self._get_converters(time_format,
+                                                        avg_pairs)
 
-        # aggregated debug
-        logger.debug('get_data params: %s' % params)
+        for sample in samples:
+            t = convert_time(sample['t'])
+            vals = [[convert(v) for convert, v in izip(converters, vec)]
+                    for vec in sample['vals']]
+            if compact:
+                yield Sample(t, sample['p'], vals,
+                             sample.get('gap_start'), sample.get('gap_end'))
+            else:
+                sample['t'] = t
+                sample['vals'] = vals
+                yield sample
+
+    def _iter_windows(self, params, chunk=None, prefetch=0, parallel=None,
+                      stream=False):
+        """ Return an iterator over the raw samples for `params`,
+        downloaded one `chunk` at a time.  With `prefetch`, up to that
+        many windows are downloaded ahead by a background thread, with
+        `parallel`, windows are downloaded concurrently by that many
+        threads.  Otherwise, with `stream`, samples are decoded as they
+        are received """
+        if parallel > 1:
+            if chunk is None:
+                windows = self._split_params(params, parts=parallel)
+            else:
+                windows = self._split_params(params, chunk)
+            responses = self._fetch_parallel(windows, parallel)
+        elif chunk is None and not prefetch:
+            return self._iter_samples(params, stream)
+        else:
+            if chunk is None:
+                windows = [params]
+            else:
+                windows = self._split_params(params, chunk)
+
+            # the prefetch thread must download whole windows
+            stream = stream and not prefetch
+            responses = (self._fetch_samples(window, stream)
+                         for window in windows)
+            if prefetch:
+                responses = _utils.prefetch(responses, prefetch)
+
+        return (sample
+                for samples in responses
+                for sample in self._data_samples(samples))
+
+    def follow(self, poll=None, max_lag=None, start=None, delta=None,
+               retries=None, max_backoff=60, compact=False,
+               time_format='datetime', avg_pairs=False):
+        """
+        Return an iterator that follows the data of a live view,
+        yielding every sample once it is complete, and each sample
+        exactly once.  For a view that is not live, the iterator ends
+        after the last sample.
+
+        The view is polled every `poll` seconds, by default the duration
+        of a sample.  Each poll costs a single get_stats request, and a
+        single get_data request for all the samples completed since the
+        previous poll, if any.
+
+        `start` is a `datetime.datetime` or a time in the units of the
+        view, the default is the first sample available.  `delta` is the
+        sampling time, as in get_iterdata(), by default the sampling
+        time of the view.  Samples are aligned on multiples of `delta`.
+
+        If the samples fall more than `max_lag` behind the data of the
+        view, because the consumer is slow or the appliance could not be
+        reached for a while, the oldest samples are skipped so that the
+        iterator catches up.  `max_lag` is a `datetime.timedelta` or a
+        number of samples.  It also applies to the first poll, so that a
+        `max_lag` of 0 follows the view from its last complete sample.
+
+        Skipped samples, and samples that the NetShark discarded before
+        they could be read, are reported by a gap marker: a sample with
+        no values, whose `gap_start` and `gap_end` entries delimit the
+        missing time range in the units of the view.  The gap markers
+        sent by the NetShark are passed through as well.
+
+        Errors talking to the NetShark are retried with an exponential
+        backoff of up to `max_backoff` seconds, without losing or
+        repeating samples.  `retries` is the number of consecutive
+        failures after which the error is raised, None to retry forever.
+        A view that does not exist anymore is never retried.
+
+        `compact`, `time_format` and `avg_pairs` are as in get_iterdata().
+        """
+        follower = _Follower(self, start, delta, max_lag)
+        failures = 0
+        while True:
+            polled = time.time()
+            try:
+                samples = follower.poll()
+            except (RvbdException, IOError) as e:
+                if ((isinstance(e, RvbdHTTPException) and e.status == 404)
+                        or (retries is not None and failures >= retries)):
+                    raise
+                failures += 1
+                logger.warning('polling view %s failed (%d): %s' %
+                               (self.view.handle, failures, e))
+            else:
+                failures = 0
+                for sample in self._convert_samples(samples, time_format,
+                                                    compact, avg_pairs):
+                    yield sample
+                if follower.done:
+                    return
+
+            interval = poll
+            if interval is None:
+                resolution = self._get_time_resolution()
+                interval = float(follower.delta or resolution) / resolution
+            if failures:
+                interval = min(interval * 2 ** failures, max_backoff)
+            time.sleep(max(0, polled + interval - time.time()))
+
+    def _fetch_parallel(self, windows, parallel):
+        """ Download `windows` over a pool of `parallel` threads, yielding
+        the responses in time order.  The latency of every window is
+        recorded in `partition_stats` """
+        self.partition_stats = []
+
+        def fetch(window):
+            started = time.time()
+            samples = self._fetch_samples(window)
+            stats = DictObject(dict(start=window['start'],
+                                    end=window['end'],
+                                    elapsed=time.time() - started,
+                                    samples=len(samples)))
+            logger.debug('partition %s-%s: %d samples in %.3fs' %
+                         (stats.start, stats.end, stats.samples,
+                          stats.elapsed))
+            return samples, stats
+
+        pool = ThreadPool(min(parallel, len(windows)))
+        try:
+            for samples, stats in pool.imap(fetch, windows):
+                self.partition_stats.append(stats)
+                yield samples
+        finally:
+            pool.terminate()
+
+    def iter_sorted(self, sortby, page_size=1000, sorttype="descending",
+                    start=None, end=None, prefetch=1,
+                    time_format='datetime', avg_pairs=False):
+        """
+        Returns an iterator over the rows of the output aggregated over
+        the time range, sorted by the field `sortby`.  This is ideal for
+        top-N displays: the sorted result is downloaded in pages of
+        `page_size` rows, using the server side `fromentry` and `toentry`
+        paging, so the first rows are available as soon as the first
+        page is received and nothing is downloaded beyond what the
+        caller consumes.
+
+        `sortby`, `sorttype`, `start` and `end` have the same meanings
+        as in get_iterdata().  `page_size` must be at least 2.
+
+        While the caller consumes a page, up to `prefetch` following
+        pages are downloaded by a background thread.  Use 0 to download
+        the pages only when they are reached.
+
+        Each row is a list of values, converted as in get_iterdata()
+        with the given `time_format` and `avg_pairs`.  Iteration stops
+        after the first page that is not full.
+        """
+        if page_size < 2:
+            # toentry=0 would mean the whole result
+            raise ValueError('page_size must be at least 2')
+
+        params = self._parse_output_params(start, end, None, True,
+                                           sortby, sorttype)
+        converters = self._get_converters(time_format, avg_pairs)[1]
+
+        def pages():
+            offset = 0
+            while True:
+                page = dict(params)
+                page['fromentry'] = offset
+                page['toentry'] = offset + page_size - 1
+                rows = [vec
+                        for sample in self._iter_samples(page)
+                        for vec in sample['vals']]
+                yield rows
+                if len(rows) < page_size:
+                    return
+                offset += page_size
+
+        responses = pages()
+        if prefetch:
+            responses = _utils.prefetch(responses, prefetch)
+
+        for rows in responses:
+            for vec in rows:
+                yield [convert(v) for convert, v in izip(converters, vec)]
+
+    def get_arrays(self, start=None, end=None, delta=None,
+                   aggregated=False,
+                   sortby=None, sorttype="descending",
+                   fromentry=0, toentry=0,
+                   chunk=None, prefetch=0, parallel=None, stream=False,
+                   avg_pairs=False):
+        """
+        Return the output data in columnar form, as a `ColumnarData`
+        object holding one typed numpy array per legend column.  This
+        requires numpy.
+
+        Columns are decoded in bulk, and take much less memory than the
+        nested lists returned by get_data().  The dtype of each column
+        is chosen from the `type` of its legend entry: int64 (uint64
+        for UINT64 fields), float64, bool for boolean keys, int64
+        nanoseconds since the epoch for ABSOLUTE_TIME fields and object
+        only for strings and addresses.
+
+        The returned object has the following attributes:
+
+        * `t`: int64 array with the time of each sample, in nanoseconds
+        * `sample`: for each row, the index in `t` of its sample
+        * `columns`: list of arrays, one for each legend entry
+        * `legend`: the legend of this output
+
+        The arguments have the same meanings as corresponding arguments
+        to get_iterdata(), see its documentation for a full explanation
+        of all arguments and their meanings.  With `chunk`, only the raw
+        data of one window (plus `prefetch` windows downloaded ahead) is
+        held in memory while the arrays are built.  With `stream`, the
+        raw samples are decoded one at a time into the row buffers
+        instead of parsing the whole response first.
+
+        If `avg_pairs` is True, the columns of numeric AVG fields hold
+        the sums of the averaged values, and the matching entries of the
+        `counts` attribute hold the number of values, see
+        `ColumnarData.averaged` and `ColumnarData.counts`.
+
+        The result can be combined locally in coarser samples with its
+        rollup() method, so that data requested once at a fine `delta`
+        can be shown at any coarser resolution.  Request it with
+        `avg_pairs` if the output has AVG fields.
+        """
+        params = self._parse_output_params(start, end, delta, aggregated, sortby, sorttype, fromentry, toentry)
 
-        if samples is None:
-            return
+        time_scale = 10 ** 9 // self._get_time_resolution()
+        return _columnar.build_columnar(self._legend,
+                                        self._iter_windows(params, chunk,
+                                                           prefetch,
+                                                           parallel,
+                                                           stream),
+                                        time_scale, avg_pairs,
+                                        params['delta'] * time_scale)
+
+    def iter_arrays(self, start=None, end=None, delta=None,
+                    aggregated=False,
+                    sortby=None, sorttype="descending",
+                    fromentry=0, toentry=0,
+                    batch_rows=65536, chunk=None, prefetch=0,
+                    parallel=None, stream=False, avg_pairs=False):
+        """
+        Return an iterator over the output data in columnar form, as
+        `ColumnarData` objects with the rows of consecutive samples, up
+        to about `batch_rows` rows each.  This requires numpy.
+
+        Only one batch is decoded at a time, so outputs of any size can
+        be processed, or written with `viewutils.write_parquet` and
+        `viewutils.write_arrow`, in bounded memory.  The columns are
+        described in get_arrays(), as well as `avg_pairs`, and the other
+        arguments have the same meanings as corresponding arguments to
+        get_iterdata().
+        """
+        params = self._parse_output_params(start, end, delta, aggregated, sortby, sorttype, fromentry, toentry)
 
-        for sample in samples:
-            if 'vals' not in sample or sample['p'] == 0:
-                continue
+        time_scale = 10 ** 9 // self._get_time_resolution()
+        return _columnar.iter_columnar(self._legend,
+                                       self._iter_windows(params, chunk,
+                                                          prefetch,
+                                                          parallel,
+                                                          stream),
+                                       time_scale, batch_rows, avg_pairs,
+                                       params['delta'] * time_scale)
+
+    def get_dataframe(self, start=None, end=None, delta=None,
+                      aggregated=False,
+                      sortby=None, sorttype="descending",
+                      fromentry=0, toentry=0,
+                      include_sample_times=True):
+        """
+        Return the output data as a pandas DataFrame.  This requires
+        numpy and pandas.
 
-            sample['t'] = self._convert_sample_time(sample['t'])
+        The frame is built directly from the columnar data returned by
+        get_arrays(), there is one column per legend entry named after
+        the legend `name`, with the dtypes described in get_arrays().
 
-            def convert_one(vec):
-                return [ _to_native(v, self._legend[i])
-                         for i, v in enumerate(vec) ]
-            sample['vals'] = [ convert_one(v) for v in sample['vals']]
-            yield sample
+        If `include_sample_times` is True, the first column of the
+        frame, named `time`, holds the sample time of each row as a
+        UTC datetime64[ns] value.
+
+        The other arguments have the same meanings as corresponding
+        arguments to get_iterdata(), see its documentation for a full
+        explanation of all arguments and their meanings.
+        """
+        arrays = self.get_arrays(start, end, delta, aggregated,
+                                 sortby, sorttype, fromentry, toentry)
+        return arrays.to_dataframe(include_sample_times=include_sample_times)
+
+
+class _Follower(object):
+    """ The state of `Output4.follow`, also used by `viewutils.Cursor`.
+
+    `next_t` is the start of the first sample that has not been
+    returned yet, in the units of the view: poll() only returns samples
+    from there, and moves it past them, so that no sample is returned
+    twice or skipped without a gap marker.
+    """
+
+    def __init__(self, output, start=None, delta=None, max_lag=None):
+        self.output = output
+        self.next_t = None
+        if start is not None:
+            self.next_t = output._to_units(start)
+        self.delta = None
+        if delta is not None:
+            if hasattr(delta, 'seconds'):
+                delta = output._timedelta_to_units(delta)
+            self.delta = delta
+        self.max_lag = max_lag
+        self.done = False
+
+    def _lag(self):
+        """ Return `max_lag` as a whole number of samples """
+        if self.max_lag is None:
+            return None
+        if hasattr(self.max_lag, 'seconds'):
+            return int(self.output._timedelta_to_units(self.max_lag) //
+                       self.delta)
+        return int(self.max_lag)
+
+    def poll(self):
+        """ Return the list of the raw samples completed since the last
+        call, with one get_stats request and at most one get_data
+        request.  The state is only updated once both succeed, so that
+        a failed poll may simply be repeated. """
+        view = self.output.view
+        stats = view.shark.api.view.get_stats(
+            view.handle, timestamp_format=view.timestamp_format)
+        timeinfo = stats.get('time_details') or {}
+        first, last = timeinfo.get('start'), timeinfo.get('end')
+        done = stats['state'] == 'DONE'
+        if not first or not last:
+            # no data yet
+            self.done = done
+            return []
+        view._timeinfo = DictObject(timeinfo)
+
+        # `last` is the start of the last sample of the view, which is
+        # still being filled until the view is done
+        view_delta = (timeinfo.get('delta') or
+                      self.output._get_time_resolution())
+        if self.delta is None:
+            self.delta = view_delta
+        delta = self.delta
+        if done:
+            stop = -(-(last + view_delta) // delta) * delta
+        else:
+            stop = last // delta * delta
+
+        samples = []
+        next_t = self.next_t
+        first = first // delta * delta
+        if next_t is None:
+            next_t = first
+        elif next_t < first:
+            # discarded by the NetShark before they could be read
+            samples.append(_gap_marker(next_t, first))
+            next_t = first
+        else:
+            next_t = next_t // delta * delta
+
+        lag = self._lag()
+        if lag is not None and stop - next_t > lag * delta:
+            skip_to = max(stop - lag * delta, next_t)
+            if self.next_t is not None:
+                samples.append(_gap_marker(next_t, skip_to))
+            next_t = skip_to
+
+        if stop > next_t:
+            params = {'start': next_t, 'end': stop - 1, 'delta': delta}
+            # the last windows of live views must not be cached
+            for sample in self.output._fetch_samples(params,
+                                                     use_cache=done):
+                if not next_t <= int(sample['t']) < stop:
+                    continue
+                if 'gap_start' in sample:
+                    sample.setdefault('vals', [])
+                elif 'vals' not in sample or sample['p'] == 0:
+                    continue
+                samples.append(sample)
+            next_t = stop
+
+        self.next_t = next_t
+        self.done = done and next_t >= stop
+        return samples
+
+
+def _gap_marker(start, end):
+    """ Return a raw sample marking the samples between `start` and `end`
+    as missing """
+    return {'t': start, 'p': 0, 'vals': [],
+            'gap_start': start, 'gap_end': end}
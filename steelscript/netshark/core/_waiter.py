@@ -0,0 +1,165 @@
+# Copyright (c) 2015 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+"""
+Waiting for the completion of views, with adaptive polling.
+"""
+
+from __future__ import absolute_import
+
+import time
+import logging
+
+from steelscript.netshark.core._exceptions import NetSharkException
+
+logger = logging.getLogger(__name__)
+
+
+class ViewTimeout(NetSharkException):
+    """ Raised when views are not computed within the allotted time """
+    pass
+
+
+def _progress(stats):
+    """ Return the percentage of the packet source processed according
+    to the view `stats`, as in `View4.get_progress` """
+    if stats['state'] == 'DONE' or not stats.get('input_size'):
+        return 100
+    return int(float(stats['processed_size']) / stats['input_size'] * 100)
+
+
+class _Tracker(object):
+    """ The polling state of one view """
+    __slots__ = ('view', 'started', 'first', 'delay', 'next_poll',
+                 'stats', 'done')
+
+    def __init__(self, view, now):
+        self.view = view
+        self.started = now
+        # (time, processed_size) of the first poll
+        self.first = None
+        self.delay = 0
+        self.next_poll = now
+        self.stats = None
+        self.done = False
+
+
+class ViewWaiter(object):
+    """ Waits for views to be computed, polling their stats only as
+    often as their progress requires.
+
+    The rate at which the packet source of a view is processed
+    (`processed_size` over `input_size` in the view stats) is used to
+    estimate when the view completes, and the next poll is scheduled
+    around that time.  Until a rate is known, the interval starts at
+    `min_interval` and doubles at each poll, so that short views are
+    seen completing right away.  Intervals never exceed `max_interval`
+    seconds, and are at least `backoff` times the time already spent
+    waiting, so that a long view whose estimate keeps slipping is not
+    polled continuously.
+    """
+
+    def __init__(self, min_interval=0.05, max_interval=5.0, backoff=0.05):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+    def track(self, view):
+        """ Return the polling state for `view`, to be passed to poll() """
+        return _Tracker(view, time.time())
+
+    def poll(self, tracker, on_progress=None):
+        """ Fetch the stats of the view of `tracker` once, and schedule
+        its next poll at `tracker.next_poll`.
+
+        `on_progress`, if given, is called as `on_progress(view, percent)`.
+        Returns True once the view is done.
+        """
+        view = tracker.view
+        stats = view.shark.api.view.get_stats(
+            view.handle, timestamp_format=view.timestamp_format)
+        now = time.time()
+        tracker.stats = stats
+        tracker.done = stats['state'] == 'DONE'
+
+        if on_progress is not None:
+            on_progress(view, _progress(stats))
+        if tracker.done:
+            return True
+
+        processed = stats.get('processed_size') or 0
+        remaining = (stats.get('input_size') or 0) - processed
+        eta = None
+        if tracker.first is None:
+            tracker.first = (now, processed)
+        elif processed > tracker.first[1] and now > tracker.first[0]:
+            rate = (processed - tracker.first[1]) / (now - tracker.first[0])
+            eta = max(remaining, 0) / rate
+
+        if eta is None:
+            delay = tracker.delay * 2
+        else:
+            delay = eta
+        floor = max(self.min_interval, self.backoff * (now - tracker.started))
+        tracker.delay = min(max(delay, floor), self.max_interval)
+        tracker.next_poll = now + tracker.delay
+
+        logger.debug('view %s %d%% done, next poll in %.2fs' %
+                     (view.handle, _progress(stats), tracker.delay))
+        return False
+
+    def wait(self, view, timeout=None, on_progress=None):
+        """ Wait until `view` is computed and return its final stats.
+
+        `timeout` is a number of seconds, ViewTimeout is raised if the
+        view is not done by then.  `on_progress`, if given, is called
+        after every poll as `on_progress(view, percent)`.
+        """
+        return self.wait_all([view], timeout, on_progress)[0]
+
+    def wait_all(self, views, timeout=None, on_progress=None):
+        """ Wait until all `views` are computed, and return the list of
+        their final stats.
+
+        Each view is polled on its own schedule, so the views that are
+        far from completion cost few requests.  `timeout` and
+        `on_progress` are as in wait().
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        trackers = [self.track(view) for view in views]
+
+        pending = list(trackers)
+        while True:
+            now = time.time()
+            expired = deadline is not None and now >= deadline
+            for tracker in pending:
+                if expired or tracker.next_poll <= now:
+                    self.poll(tracker, on_progress)
+            pending = [t for t in pending if not t.done]
+            if not pending:
+                return [t.stats for t in trackers]
+            if expired:
+                raise ViewTimeout('%d views not done after %s seconds' %
+                                  (len(pending), timeout))
+
+            wake = min(t.next_poll for t in pending)
+            if deadline is not None:
+                wake = min(wake, deadline)
+            time.sleep(max(0, wake - time.time()))
+
+
+_default_waiter = ViewWaiter()
+
+
+def wait(view, timeout=None, on_progress=None):
+    """ Wait until `view` is computed, see `ViewWaiter.wait` """
+    return _default_waiter.wait(view, timeout, on_progress)
+
+
+def wait_all(views, timeout=None, on_progress=None):
+    """ Wait until all `views` are computed, see `ViewWaiter.wait_all` """
+    return _default_waiter.wait_all(views, timeout, on_progress)
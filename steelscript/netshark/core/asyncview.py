@@ -0,0 +1,464 @@
+# Copyright (c) 2015 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+"""
+Concurrent view lifecycle.
+
+:py:class:`AsyncNetShark` wraps a NetShark object and runs the view
+lifecycle (creation, wait for completion, legend, data, close) in the
+background, returning a :py:class:`Future` for each operation, so that
+many views can be handled at the same time from a single thread::
+
+    ashark = AsyncNetShark(shark)
+    views = gather([ashark.create_view(src, columns) for src in sources])
+    data = gather([ashark.get_data(v.all_outputs()[0]) for v in views])
+    gather([ashark.close(v) for v in views])
+    ashark.shutdown()
+
+:py:class:`ViewBatch`, returned by `NetShark.create_views`, builds on it
+to compute a list of views with a bounded number of them in progress,
+and to handle each view as soon as it is available::
+
+    specs = [dict(src=job, columns=columns) for job in jobs]
+    with shark.create_views(specs, max_inflight=10) as batch:
+        for spec, view in batch:
+            print spec['src'].name, view.get_data(aggregated=True)
+
+Requests are issued by a pool of worker threads, while the completion of
+all the views being computed is checked by a single poller thread, so
+waiting for many views does not tie up one thread per view.  Each view
+is polled on an adaptive schedule, see
+:py:class:`ViewWaiter <steelscript.netshark.core.viewutils.ViewWaiter>`.
+"""
+
+from __future__ import absolute_import
+
+import sys
+import time
+import Queue
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from steelscript.netshark.core._waiter import ViewWaiter, ViewTimeout
+
+logger = logging.getLogger(__name__)
+
+
+__all__ = ['AsyncNetShark', 'ViewBatch', 'Future', 'gather']
+
+
+class Future(object):
+    """ The result of an operation that runs in the background """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        if not self.done():
+            state = 'pending'
+        elif self._exc_info is not None:
+            state = 'raised %s' % self._exc_info[0].__name__
+        else:
+            state = 'done'
+        return '<Future %s>' % state
+
+    def done(self):
+        """ Return True if the operation has completed """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Wait for the operation to complete and return its result, or
+        raise its exception.  Raises RuntimeError if the operation has
+        not completed after `timeout` seconds """
+        if not self._done.wait(timeout):
+            raise RuntimeError('operation did not complete in %s seconds' %
+                               timeout)
+        if self._exc_info is not None:
+            t, v, tb = self._exc_info
+            raise t, v, tb
+        return self._result
+
+    def exception(self, timeout=None):
+        """ Wait for the operation to complete and return the exception
+        it raised, or None """
+        if not self._done.wait(timeout):
+            raise RuntimeError('operation did not complete in %s seconds' %
+                               timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        """ Call `fn(future)` when the operation completes, or right away
+        if it has already completed """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._complete()
+
+    def set_exception(self, exc_info):
+        """ Complete the operation with the exception described by the
+        `sys.exc_info()` tuple `exc_info` """
+        self._exc_info = exc_info
+        self._complete()
+
+    def _complete(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                logger.exception('exception in future callback')
+
+
+def gather(futures, timeout=None, return_exceptions=False):
+    """ Wait for all of `futures` and return the list of their results,
+    in the same order.
+
+    If an operation failed, its exception is raised, unless
+    `return_exceptions` is True, in which case the exception is returned
+    in place of the result.  `timeout` is the number of seconds to wait
+    for each future.
+    """
+    results = []
+    for future in futures:
+        if return_exceptions:
+            exc = future.exception(timeout)
+            if exc is not None:
+                results.append(exc)
+                continue
+        results.append(future.result(timeout))
+    return results
+
+
+class _Poller(object):
+    """ A thread that waits for the completion of many views, checking
+    each of them when scheduled by `waiter` """
+
+    def __init__(self, waiter):
+        self.waiter = waiter
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def watch(self, view, future, close_on_error=False):
+        """ Set the result of `future` to `view` once the view has been
+        computed """
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError('the poller has been stopped')
+            self._pending.append((self.waiter.track(view), future,
+                                  close_on_error))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='netshark-poller')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _check(self, tracker, future, close_on_error):
+        """ Return True if the view of `tracker` is no longer pending """
+        view = tracker.view
+        try:
+            if not self.waiter.poll(tracker):
+                return False
+            view._postapply()
+        except Exception:
+            exc_info = sys.exc_info()
+            if close_on_error:
+                try:
+                    view.close()
+                except Exception:
+                    logger.exception('cannot close view %s' % view.handle)
+            future.set_exception(exc_info)
+            return True
+
+        future.set_result(view)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    pending, self._pending = self._pending, []
+                    break
+                pending = list(self._pending)
+
+            now = time.time()
+            finished = [entry for entry in pending
+                        if entry[0].next_poll <= now and self._check(*entry)]
+
+            with self._cond:
+                for entry in finished:
+                    self._pending.remove(entry)
+                if self._pending and not self._stopped:
+                    # new views wake the thread up right away
+                    wake = min(entry[0].next_poll for entry in self._pending)
+                    self._cond.wait(max(0, wake - time.time()))
+
+        for tracker, future, _ in pending:
+            try:
+                raise RuntimeError('stopped waiting for view %s' %
+                                   tracker.view.handle)
+            except RuntimeError:
+                future.set_exception(sys.exc_info())
+
+
+class AsyncNetShark(object):
+    """ Runs the view lifecycle of the NetShark object `shark` in the
+    background.
+
+    Every method returns a :py:class:`Future` immediately.  `workers`
+    is the number of requests that are sent to the appliance at the same
+    time, and `waiter` an optional `ViewWaiter` that schedules the
+    checks of the views being computed.
+
+    The object can be used as a context manager, that calls shutdown()
+    on exit.
+    """
+
+    def __init__(self, shark, workers=8, waiter=None):
+        self.shark = shark
+        self._pool = ThreadPool(workers)
+        self._poller = _Poller(waiter or ViewWaiter())
+
+    def __repr__(self):
+        return '<AsyncNetShark %r>' % self.shark
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def submit(self, fn, *args, **kwargs):
+        """ Run `fn(*args, **kwargs)` on a worker thread and return a
+        Future for its result """
+        future = Future()
+
+        def run():
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                future.set_exception(sys.exc_info())
+            else:
+                future.set_result(result)
+
+        self._pool.apply_async(run)
+        return future
+
+    def _create(self, create, args, kwargs, close_on_error=True):
+        future = Future()
+
+        def run():
+            try:
+                view = create(*args, sync=False, **kwargs)
+                if view.source is not None and view.source.is_live():
+                    # data from live sources is available right away
+                    view._postapply()
+                    future.set_result(view)
+                else:
+                    self._poller.watch(view, future, close_on_error)
+            except Exception:
+                future.set_exception(sys.exc_info())
+
+        self._pool.apply_async(run)
+        return future
+
+    def create_view(self, src, columns, filters=None, **kwargs):
+        """ Create a view, see `NetShark.create_view` for the arguments.
+
+        Returns a Future for the View object, which completes once the
+        view data is available.  If the view fails, it is closed.
+        """
+        return self._create(self.shark.create_view, (src, columns, filters),
+                            kwargs)
+
+    def create_view_from_template(self, src, template, name=None):
+        """ Create a view from `template`, see
+        `NetShark.create_view_from_template`.  Returns a Future for the
+        View object, which completes once the view data is available """
+        return self._create(self.shark.create_view_from_template,
+                            (src, template, name), {})
+
+    def wait(self, view):
+        """ Return a Future for `view`, which completes once the view
+        data is available """
+        future = Future()
+        self._poller.watch(view, future)
+        return future
+
+    def get_legend(self, output):
+        """ Return a Future for the legend of `output` """
+        return self.submit(output.get_legend)
+
+    def get_data(self, output, *args, **kwargs):
+        """ Return a Future for the data of `output`, see
+        `Output4.get_data` for the arguments """
+        return self.submit(output.get_data, *args, **kwargs)
+
+    def get_arrays(self, output, *args, **kwargs):
+        """ Return a Future for the data of `output` in columnar form,
+        see `Output4.get_arrays` for the arguments """
+        return self.submit(output.get_arrays, *args, **kwargs)
+
+    def close(self, view):
+        """ Close `view`, and return a Future that completes once the
+        view has been closed """
+        def close():
+            view.close()
+            self.shark._del_view(view)
+        return self.submit(close)
+
+    def shutdown(self):
+        """ Stop the background threads.  Operations that are still
+        running are completed, but pending waits for views fail """
+        self._poller.stop()
+        self._pool.close()
+        self._pool.join()
+
+
+class ViewBatch(object):
+    """ A set of views on the NetShark object `shark`, computed together.
+
+    `specs` is a list with the description of each view: either a dict
+    of keyword arguments for `NetShark.create_view` (or for
+    `NetShark.create_view_from_template` if it has a `template` entry),
+    or a tuple of positional arguments for `NetShark.create_view`.
+
+    At most `max_inflight` views are being created or computed at the
+    same time, the next ones are created as the views are consumed.
+    Iterating over the batch yields `(spec, view)` pairs in the order
+    in which the views become available, and raises the exception of
+    any view that fails.  ViewTimeout is raised if the views are not
+    all available `timeout` seconds after the batch has been created.
+
+    The views are closed by close(), which is called on exit when the
+    batch is used as a context manager.
+    """
+
+    def __init__(self, shark, specs, max_inflight=8, waiter=None,
+                 timeout=None):
+        if max_inflight < 1:
+            raise ValueError('max_inflight must be at least 1')
+
+        self.shark = shark
+        self.specs = list(specs)
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self.views = []
+
+        self._deadline = None if timeout is None else time.time() + timeout
+        self._ashark = AsyncNetShark(shark, workers=min(max_inflight, 8),
+                                     waiter=waiter)
+        self._lock = threading.Lock()
+        # (index of the spec, future of the view) as they complete
+        self._completed = Queue.Queue()
+        self._next = 0
+        self._inflight = 0
+        self._closed = False
+
+        while self._next < len(self.specs) and self._next < max_inflight:
+            self._submit()
+
+    def __repr__(self):
+        return '<ViewBatch %d views on %r>' % (len(self.specs), self.shark)
+
+    def __len__(self):
+        return len(self.specs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _submit(self):
+        index = self._next
+        spec = self.specs[index]
+        self._next += 1
+
+        if isinstance(spec, dict):
+            kwargs = dict(spec)
+            if 'template' in kwargs:
+                create = self.shark.create_view_from_template
+            else:
+                create = self.shark.create_view
+            args = ()
+        else:
+            create = self.shark.create_view
+            args, kwargs = tuple(spec), {}
+
+        def create_view(*args, **kwargs):
+            view = create(*args, **kwargs)
+            with self._lock:
+                self.views.append(view)
+            return view
+
+        # failed views are closed with the others by close()
+        future = self._ashark._create(create_view, args, kwargs,
+                                      close_on_error=False)
+        future.add_done_callback(lambda f: self._completed.put((index, f)))
+        self._inflight += 1
+
+    def __iter__(self):
+        while self._inflight:
+            if self._closed:
+                raise RuntimeError('the batch has been closed')
+            # wake up regularly, a blocking get cannot be interrupted
+            wait = 1.0
+            if self._deadline is not None:
+                wait = min(wait, max(0, self._deadline - time.time()))
+            try:
+                index, future = self._completed.get(True, wait)
+            except Queue.Empty:
+                if (self._deadline is not None and
+                        time.time() >= self._deadline):
+                    raise ViewTimeout('%d views not done after %s seconds' %
+                                      (len(self.specs) - self._next +
+                                       self._inflight, self.timeout))
+                continue
+
+            self._inflight -= 1
+            if self._next < len(self.specs):
+                self._submit()
+            yield self.specs[index], future.result()
+
+    def close(self):
+        """ Stop computing the views and close all of them """
+        if self._closed:
+            return
+        self._closed = True
+
+        # wait for the views being created, so that they are closed too
+        self._ashark.shutdown()
+        for view in self.views:
+            try:
+                view.close()
+            except Exception:
+                logger.exception('cannot close view %s' % view.handle)
+            self.shark._del_view(view)
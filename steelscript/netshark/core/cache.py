@@ -0,0 +1,391 @@
+# Copyright (c) 2015 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+"""
+Client side caching of view output data.
+
+A cache is enabled by attaching it to a NetShark object::
+
+    shark = NetShark(host, auth=auth, result_cache=ResultCache())
+
+The data downloaded from the views of that appliance is then cached,
+and requests for the same data from a view with the same configuration
+(packet source, columns, filters and sampling time) are answered from
+the cache.
+
+:py:class:`ResultCache` keeps data in memory.  Only data that cannot
+change is cached: any request on a trace file or other offline source.
+Views on live sources and capture jobs cover the packets of their own
+lifetime, so their data is only cached per view, and only for windows
+of time that the view was last seen to have fully processed.
+
+:py:class:`DiskResultCache` keeps data in a directory, so that it
+survives the process.  It only caches views on trace files, merged and
+multisegment files, and identifies them by their checksum.
+"""
+
+from __future__ import absolute_import
+
+import os
+import json
+import time
+import zlib
+import errno
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from steelscript.common.datastructures import DictObject
+from steelscript.netshark.core import _fs, _interfaces
+
+logger = logging.getLogger(__name__)
+
+
+__all__ = ['ResultCache', 'DiskResultCache']
+
+
+# the parts of a view configuration that determine its data
+_CONFIG_KEYS = ('input_source', 'processors', 'parameters')
+
+
+def _json_default(obj):
+    """ Serialize the filters of the view configuration, which are only
+    converted to json when the view is created """
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError('%r is not JSON serializable' % (obj,))
+    return to_dict()
+
+
+def _request_key(output, params, *extra):
+    """ Return a hash of the parts of the view configuration that
+    determine the data of `output`, of the request `params` and of
+    any `extra` values """
+    view = output.view
+    config = view.config
+    if isinstance(config, dict):
+        config = dict((k, config.get(k)) for k in _CONFIG_KEYS)
+
+    description = json.dumps([getattr(view.shark, 'host', None),
+                              config, output.id,
+                              view.timestamp_format, params] + list(extra),
+                             sort_keys=True, default=_json_default)
+    return hashlib.sha1(description).hexdigest()
+
+
+def _window_complete(output, params):
+    """ Return True if the time window requested by `params` ends before
+    the last sample produced by the view of `output` when its time
+    details were last retrieved.  No request is made: without known time
+    details, the window is not considered complete. """
+    if not params.get('start') or not params.get('end'):
+        # unbounded requests grow with the source
+        return False
+    ti = getattr(output.view, '_timeinfo', None)
+    if not ti or not ti.get('end'):
+        return False
+    return output._to_units(params['end']) + params['delta'] <= ti['end']
+
+
+def _is_mutable(source):
+    """ Return True if the views on `source` hold different packets
+    depending on when they are created """
+    return (source is None or source.is_live() or
+            isinstance(source, _interfaces.Job))
+
+
+class ResultCache(object):
+    """ In-memory LRU cache of the raw data returned by view outputs.
+
+    `max_entries` is the number of get_data responses that are kept,
+    and `max_rows` the total number of rows they may hold (None for no
+    limit).  The least recently used responses are evicted first.
+
+    `ttl` is the number of seconds after which an entry expires, None
+    means entries never expire.  Since only data that cannot change is
+    cached, `ttl` only bounds how long memory is held.
+
+    The `hits`, `misses` and `evictions` counters are updated as the
+    cache is used, see also stats().  A cache may be shared by several
+    NetShark objects and threads.
+    """
+
+    def __init__(self, max_entries=256, max_rows=1000000, ttl=None):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rows = 0
+
+        # key -> (expiration time, number of rows, samples)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<ResultCache %d entries, %d rows>' % (len(self), self.rows)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def make_key(self, output, params):
+        """ Return the key for the get_data request described by `params`
+        (as built by `Output4._parse_output_params`) on `output`, or None
+        if its result may still change and must not be cached """
+        if _is_mutable(output.view.source):
+            if not _window_complete(output, params):
+                return None
+            # other views on the source may hold other packets
+            return _request_key(output, params, output.view.handle)
+        return _request_key(output, params)
+
+    def get(self, key):
+        """ Return a copy of the samples stored for `key`, or None """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if (entry is not None and entry[0] is not None
+                    and entry[0] < time.time()):
+                self.rows -= entry[1]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # move to the most recently used end
+            self._entries[key] = entry
+            self.hits += 1
+
+        logger.debug('result cache hit for %s' % key)
+        # the caller may replace the fields of the samples
+        return [dict(sample) for sample in entry[2]]
+
+    def put(self, key, samples):
+        """ Store a copy of the raw `samples` for `key` """
+        samples = tuple(dict(sample) for sample in samples)
+        rows = sum(len(sample.get('vals') or ()) for sample in samples)
+        if self.max_rows is not None and rows > self.max_rows:
+            return
+
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.rows -= old[1]
+
+            self._entries[key] = (expires, rows, samples)
+            self.rows += rows
+
+            while (len(self._entries) > self.max_entries or
+                   (self.max_rows is not None and self.rows > self.max_rows)):
+                _, (_, evicted_rows, _) = self._entries.popitem(last=False)
+                self.rows -= evicted_rows
+                self.evictions += 1
+
+    def clear(self):
+        """ Remove all the entries, the counters are not reset """
+        with self._lock:
+            self._entries.clear()
+            self.rows = 0
+
+    def stats(self):
+        """ Return an object with the `hits`, `misses` and `evictions`
+        counters, and the current number of `entries` and `rows` """
+        return DictObject(dict(hits=self.hits, misses=self.misses,
+                               evictions=self.evictions,
+                               entries=len(self), rows=self.rows))
+
+
+class DiskResultCache(object):
+    """ Persistent cache of the raw data returned by views on trace
+    files, merged files and multisegment files.
+
+    Each get_data response is stored as a zlib compressed json file in
+    `directory`, which is created if needed and may be shared by
+    several processes.  Entries are keyed on the appliance, the file
+    path and checksum, the view configuration and the request, so they
+    are only used while the file is unchanged.
+
+    `max_bytes` is the total size of the files in the cache, the least
+    recently used entries are removed when it is exceeded.  The
+    `hits`, `misses` and `evictions` counters are updated as the cache
+    is used, see also stats().
+    """
+
+    suffix = '.json.z'
+
+    def __init__(self, directory, max_bytes=1024 ** 3, compression=6):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compression = compression
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # (host, path, file details) -> checksum
+        self._checksums = {}
+        self._lock = threading.Lock()
+
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def __repr__(self):
+        return '<DiskResultCache %s>' % self.directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _entries(self):
+        """ Return a list of (last use, size, path) of the entries """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _checksum(self, source, refresh=True):
+        """ Return the checksum of the file `source`, only asking the
+        appliance once for the same version of the file.  The details of
+        `source` are reloaded first if `refresh` is True, since the file
+        may have changed since they were retrieved. """
+        if isinstance(source, _fs._AggregatedFile):
+            if refresh:
+                source.get_info()
+            # the linked files are loaded with their current details
+            return [self._checksum(linked, refresh=False)
+                    for linked in source.list_linked_files()]
+
+        data = source.get_info() if refresh else source.data
+        memo = (getattr(source.shark, 'host', None), data['id'],
+                data.get('modified'), data.get('size'))
+        try:
+            return self._checksums[memo]
+        except KeyError:
+            checksum = source.checksum()
+            self._checksums[memo] = checksum
+            return checksum
+
+    def make_key(self, output, params):
+        """ Return the key for the get_data request described by `params`
+        (as built by `Output4._parse_output_params`) on `output`, or None
+        if the view is not on a trace, merged or multisegment file """
+        source = output.view.source
+        if not isinstance(source, (_fs.TraceFile4, _fs._AggregatedFile)):
+            return None
+        try:
+            checksum = self._checksum(source)
+        except KeyError:
+            # not enough details about the file to identify it
+            return None
+        return _request_key(output, params, source.source_path, checksum)
+
+    def get(self, key):
+        """ Return the samples stored for `key`, or None """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            samples = json.loads(zlib.decompress(data))
+        except (IOError, OSError):
+            samples = None
+        except (zlib.error, ValueError):
+            logger.warning('removing corrupted cache entry %s' % path)
+            self._remove(path)
+            samples = None
+
+        with self._lock:
+            if samples is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        logger.debug('disk cache hit for %s' % key)
+        try:
+            # the modification time tracks the last use
+            os.utime(path, None)
+        except OSError:
+            pass
+        return samples
+
+    def put(self, key, samples):
+        """ Store the raw `samples` for `key` """
+        data = zlib.compress(json.dumps(list(samples), separators=(',', ':')),
+                             self.compression)
+        if len(data) > self.max_bytes:
+            return
+
+        # write to a temporary file and rename it, so that readers
+        # never see a partial entry
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            path = self._path(key)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # windows does not replace existing files
+                self._remove(path)
+                os.rename(tmp, path)
+        except:
+            self._remove(tmp)
+            raise
+
+        self._evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        """ Remove all the entries, the counters are not reset """
+        for _, _, path in self._entries():
+            self._remove(path)
+
+    def stats(self):
+        """ Return an object with the `hits`, `misses` and `evictions`
+        counters, and the current number of `entries` and `bytes` """
+        entries = self._entries()
+        return DictObject(dict(hits=self.hits, misses=self.misses,
+                               evictions=self.evictions,
+                               entries=len(entries),
+                               bytes=sum(size for _, size, _ in entries)))
@@ -14,7 +14,9 @@ like creating clips or starting/stopping capture jobs.
 """
 
 from __future__ import absolute_import
+import time
 import traceback
+from multiprocessing.pool import ThreadPool
 
 from steelscript.common.api_helpers import APIVersion
 from steelscript.common.service import Service
@@ -23,6 +25,7 @@ from steelscript.netshark.core._exceptions import NetSharkException
 from steelscript.netshark.core._api_helpers import NetSharkAPIVersions
 from steelscript.netshark.core._api4 import API4_0
 from steelscript.netshark.core._api5 import API5_0
+from steelscript.netshark.core.asyncview import ViewBatch
 from steelscript.common.datastructures import ColumnProxy
 from steelscript.netshark.core._class_mapping import Classesv4, Classes, Classesv5
 
@@ -52,8 +55,15 @@ class NetShark(Service):
     Among other things, it makes it possible to manage views, jobs, files and
     trace clips, and to query and modify the appliance settings.
     """
+
+    #: seconds during which the list of open views is not fetched again
+    views_ttl = 5
+
+    #: maximum number of view configurations requested at the same time
+    max_config_requests = 8
+
     def __init__(self, host, port=None, auth=None,
-                 force_version=None):
+                 force_version=None, result_cache=None):
         """Establishes a connection to a NetShark appliance.
 
         :param str host: the name or IP address of the NetShark to connect to
@@ -73,6 +83,14 @@ class NetShark(Service):
             version supported by both this implementation and the
             NetShark appliance.
 
+        :param result_cache: an optional
+            :class:`ResultCache <steelscript.netshark.core.cache.ResultCache>`
+            or :class:`DiskResultCache
+            <steelscript.netshark.core.cache.DiskResultCache>` used to keep
+            the data downloaded from views, so that the same requests are
+            not sent to the appliance again.
+            It can also be set later with the `result_cache` attribute.
+
         See the base :class:`Service <steelscript.common.service.Service>`
         class for more information about additional functionality supported.
         """
@@ -85,6 +103,8 @@ class NetShark(Service):
             versions = [APIVersion(NetSharkAPIVersions.CURRENT)] + \
                        [APIVersion(v) for v in NetSharkAPIVersions.LEGACY]
 
+        self.result_cache = result_cache
+
         super(NetShark, self).__init__("shark", host, port=port, auth=auth,
                                        versions=versions)
 
@@ -100,6 +120,8 @@ class NetShark(Service):
         self.serverinfo = self.get_serverinfo()
 
         self.views = {}
+        # when the list of open views was last fetched
+        self._views_refreshed = None
         self._interfaces = None
         self.xtfields = {}
 
@@ -113,6 +135,8 @@ class NetShark(Service):
         self._capture_jobs_cache = None
         self._traceclips_cache = None
         self._tracefiles_cache = None
+        # (view configuration hash, output id, timestamp format) -> legend
+        self._legends_cache = {}
 
     def __repr__(self):
         if self.port is not None:
@@ -170,12 +194,14 @@ class NetShark(Service):
         """Get a list of View objects, one for each open view on the NetShark appliance.
         """
         self._refresh_views()
-        return self.views.values()
+        views = self.views.values()
+        self._load_view_configs(views)
+        return views
 
     def get_open_view_by_handle(self, handle):
         """Look up the view ``handle`` and return its View object"""
         if handle not in self.views:
-            self._refresh_views()
+            self._refresh_views(force=True)
 
         return self.views[handle]
 
@@ -193,9 +219,15 @@ class NetShark(Service):
         except KeyError:
             pass
 
-    def _refresh_views(self):
-        oldviews = self.views
-        self.views = {}
+    def _refresh_views(self, force=False):
+        """Update the view objects from the list of open views on the
+        NetShark, unless it has been fetched less than `views_ttl`
+        seconds ago and `force` is False.  The objects of the new views
+        load their configuration when it is first needed."""
+        now = time.time()
+        if (not force and self._views_refreshed is not None and
+                now - self._views_refreshed < self.views_ttl):
+            return
 
         try:
             handles = self.classes.View._get_all(self)
@@ -209,20 +241,52 @@ class NetShark(Service):
             # route and keep them.
             return
 
+        oldviews = self.views
+        self.views = {}
+        self._views_refreshed = now
+
         for handle in handles:
             # don't create a new object for the view if we already have one
             if handle in oldviews:
                 self.views[handle] = oldviews[handle]
             else:
-                try:
-                    self.views[handle] = self.classes.View(self, handle)
-                except:
-                    # XXX make the except clause narrower
-                    traceback.print_exc()
+                self.views[handle] = self.classes.View(self, handle)
+
+    def _load_view_configs(self, views):
+        """Fetch the configuration of the `views` that do not have it yet,
+        with up to `max_config_requests` requests at the same time.  The
+        views whose configuration cannot be fetched are dropped from the
+        view objects."""
+        missing = [view for view in views if not view._has_config()]
+        if not missing:
+            return
 
-                    # XXX should put some sort of "orphaned view"
-                    # object here so we know it exists but is unusable
-                    pass
+        def load(view):
+            try:
+                view.config
+                view.source
+                return None
+            except:
+                # XXX make the except clause narrower
+                traceback.print_exc()
+
+                # XXX should put some sort of "orphaned view"
+                # object here so we know it exists but is unusable
+                return view
+
+        if len(missing) == 1 or self.max_config_requests <= 1:
+            failed = map(load, missing)
+        else:
+            pool = ThreadPool(min(self.max_config_requests, len(missing)))
+            try:
+                failed = pool.map(load, missing)
+            finally:
+                pool.terminate()
+
+        for view in failed:
+            if view is not None:
+                views.remove(view)
+                self._del_view(view)
 
     def create_view_from_template(self, source, template,
                                   name=None, sync=True):
@@ -279,6 +343,35 @@ class NetShark(Service):
         self._add_view(view)
         return view
 
+    def create_views(self, specs, max_inflight=8, timeout=None):
+        """ Create a view for each entry of `specs` and compute them
+        concurrently.
+
+        :param specs: a list with the arguments of each view, either
+            a dict of keyword arguments for `create_view` (or for
+            `create_view_from_template` if it has a `template` entry),
+            or a tuple of positional arguments for `create_view`.
+
+        :param max_inflight: the maximum number of views being
+            computed at the same time.
+
+        :param timeout: if not None, the number of seconds after which
+            the views that are not available raise ViewTimeout.
+
+        Iterating over the returned batch yields `(spec, view)` pairs
+        as soon as each view is available, and the views are closed
+        when the batch is used as a context manager::
+
+            with shark.create_views(specs) as batch:
+                for spec, view in batch:
+                    data = view.get_data(aggregated=True)
+
+        :returns: :class:`ViewBatch
+            <steelscript.netshark.core.asyncview.ViewBatch>`
+
+        """
+        return ViewBatch(self, specs, max_inflight, timeout=timeout)
+
     def create_job(self, interface, name,
              packet_retention_size_limit,
              packet_retention_packet_limit=None,
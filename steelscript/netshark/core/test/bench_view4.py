@@ -0,0 +1,189 @@
+# Copyright (c) 2015 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+"""
+Micro-benchmarks for the decoding of view output data.
+
+These do not need a NetShark appliance, they run against a synthetic
+payload that mimics the json returned by `api.view.get_data`:
+
+    python bench_view4.py [rows]
+"""
+
+import sys
+import json
+import time
+import random
+from itertools import izip
+
+from steelscript.common import timeutils
+from steelscript.common.datastructures import DictObject
+from steelscript.netshark.core import _view4, _utils
+
+
+def legend_entry(name, vtype, calculation, base='DEC'):
+    return DictObject(dict(name=name, type=vtype, base=base,
+                           calculation=calculation))
+
+
+LEGEND = [
+    legend_entry('ip.src', 'IPv4', 'NONE'),
+    legend_entry('tcp.src_port', 'TCP_PORT', 'NONE'),
+    legend_entry('generic.bytes', 'UINT64', 'SUM'),
+    legend_entry('generic.packets', 'UINT64', 'SUM'),
+    legend_entry('tcp.flags', 'UINT8', 'MAX', base='HEX'),
+    legend_entry('http.duration', 'RELATIVE_TIME', 'MAX'),
+    legend_entry('http.duration', 'RELATIVE_TIME', 'AVG'),
+    legend_entry('tcp.rtt', 'DOUBLE', 'AVG'),
+    legend_entry('tcp.retransmission', 'BOOLEAN', 'SUM'),
+    legend_entry('tcp.syn_time', 'ABSOLUTE_TIME', 'MIN'),
+]
+
+
+def make_row(rnd):
+    return ['10.0.%d.%d' % (rnd.randint(0, 255), rnd.randint(0, 255)),
+            str(rnd.randint(1, 65535)),
+            str(rnd.randint(0, 10 ** 9)),
+            str(rnd.randint(0, 10 ** 6)),
+            '%x' % rnd.randint(0, 255),
+            '%.6f' % rnd.random(),
+            '%.6f:%d' % (rnd.random() * 100, rnd.randint(1, 100)),
+            '%.6f:%d' % (rnd.random() * 100, rnd.randint(1, 100)),
+            str(rnd.randint(0, 10)),
+            str(1400000000000000000 + rnd.randint(0, 10 ** 12))]
+
+
+def make_samples(rows, rows_per_sample=100):
+    rnd = random.Random(42)
+    samples = []
+    t = 1400000000000000000
+    for i in xrange(0, rows, rows_per_sample):
+        samples.append({'t': t, 'p': 1,
+                        'vals': [make_row(rnd)
+                                 for _ in xrange(rows_per_sample)]})
+        t += 10 ** 9
+    return samples
+
+
+def legacy_to_native(string, legend_entry):
+    """ the per-value decoder used before converters were compiled """
+    if legend_entry['calculation'] == 'AVG':
+        string, den = string.split(':', 1)
+        denominator = int(den)
+    else:
+        denominator = 1
+
+    if (legend_entry['type'].startswith('INT')
+            or legend_entry['type'].startswith('UINT')
+            or legend_entry['type'] in ('TCP_PORT', 'UDP_PORT')):
+        if legend_entry['base'] == 'DEC':
+            baseval = 10
+        elif legend_entry['base'] == 'HEX':
+            baseval = 16
+        return int(string, baseval) / denominator
+
+    if legend_entry['type'] == 'DOUBLE':
+        return float(string) / denominator
+
+    if legend_entry['type'] == 'BOOLEAN':
+        if string.lower() == 'false' or string.lower() == '0':
+            return 0
+        elif string.lower() == 'true' or string.lower() == '1':
+            return 1
+        else:
+            return int(string)
+
+    if legend_entry['type'] == 'ABSOLUTE_TIME':
+        return timeutils.nsec_string_to_datetime(string)
+
+    if legend_entry['type'] == 'RELATIVE_TIME':
+        return float(string) / denominator
+
+    return string
+
+
+def decode_legacy(samples, legend):
+    out = []
+    for sample in samples:
+        def convert_one(vec):
+            return [legacy_to_native(v, legend[i])
+                    for i, v in enumerate(vec)]
+        out.append([convert_one(v) for v in sample['vals']])
+    return out
+
+
+def decode_compiled(samples, legend):
+    converters = _view4._compile_converters(legend)
+    return [[[convert(v) for convert, v in izip(converters, vec)]
+             for vec in sample['vals']]
+            for sample in samples]
+
+
+def bench(name, func, *args):
+    start = time.time()
+    result = func(*args)
+    elapsed = time.time() - start
+    print '%-24s %8.3fs' % (name, elapsed)
+    return result, elapsed
+
+
+def bench_converters(rows):
+    samples = make_samples(rows)
+    print 'decoding %d rows x %d columns (%d cells)' % (
+        rows, len(LEGEND), rows * len(LEGEND))
+
+    legacy, t_legacy = bench('per-value _to_native', decode_legacy,
+                             samples, LEGEND)
+    compiled, t_compiled = bench('compiled converters', decode_compiled,
+                                 samples, LEGEND)
+    assert legacy == compiled
+    print 'speedup: %.2fx' % (t_legacy / t_compiled)
+
+
+def parse_whole(chunks):
+    return len(json.loads(''.join(chunks))['samples'])
+
+
+def parse_stream(chunks):
+    return sum(1 for _ in _utils.iter_json_array(iter(chunks), 'samples'))
+
+
+def first_sample(chunks):
+    return next(_utils.iter_json_array(iter(chunks), 'samples'))
+
+
+def bench_stream(rows):
+    body = json.dumps({'samples': make_samples(rows)})
+    chunks = [body[i:i + 65536] for i in xrange(0, len(body), 65536)]
+    print 'parsing a %d bytes response in %d chunks' % (len(body),
+                                                        len(chunks))
+
+    whole, _ = bench('json.loads', parse_whole, chunks)
+    streamed, _ = bench('iter_json_array', parse_stream, chunks)
+    assert whole == streamed
+    bench('first streamed sample', first_sample, chunks)
+
+
+def bench_memory(rows):
+    # one row per sample, as in a long time series; only the containers
+    # are measured, the values are shared by both representations
+    raw = make_samples(rows, rows_per_sample=1)
+    compact = [_view4.Sample(s['t'], s['p'], s['vals']) for s in raw]
+    print 'memory of %d samples of 1 row' % len(raw)
+
+    dict_bytes = sum(sys.getsizeof(s) for s in raw)
+    compact_bytes = sum(sys.getsizeof(s) for s in compact)
+    print '%-24s %8.1f MB' % ('dict samples', dict_bytes / 2.0 ** 20)
+    print '%-24s %8.1f MB' % ('compact samples', compact_bytes / 2.0 ** 20)
+    print 'ratio: %.2fx' % (float(dict_bytes) / compact_bytes)
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    bench_converters(rows)
+    bench_stream(rows)
+    bench_memory(rows)
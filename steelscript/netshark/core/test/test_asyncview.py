@@ -0,0 +1,240 @@
+# Copyright (c) 2015 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import time
+import threading
+import unittest
+
+from steelscript.common.datastructures import DictObject
+from steelscript.netshark.core.asyncview import (AsyncNetShark, ViewBatch,
+                                                 Future, gather)
+from steelscript.netshark.core.viewutils import ViewWaiter
+
+
+class FakeSource(object):
+    def __init__(self, live=False):
+        self.live = live
+
+    def is_live(self):
+        return self.live
+
+
+class FakeViewAPI(object):
+    def __init__(self):
+        self.views = {}
+
+    def get_stats(self, handle, timestamp_format=None):
+        view = self.views[handle]
+        if view.fail:
+            raise IOError('view %s failed' % handle)
+        view.polls -= 1
+        return {'state': 'DONE' if view.polls <= 0 else 'RUNNING',
+                'input_size': 0, 'processed_size': 0}
+
+
+class FakeView(object):
+    timestamp_format = None
+
+    def __init__(self, shark, handle, source, polls, fail=False):
+        self.shark = shark
+        self.handle = handle
+        self.source = source
+        self.polls = polls
+        self.fail = fail
+        self.applied = False
+        self.closed = False
+        shark.api.view.views[handle] = self
+
+    def _postapply(self):
+        self.applied = True
+
+    def close(self):
+        self.closed = True
+
+    def get_data(self, **kwargs):
+        return [self.handle, kwargs]
+
+
+class FakeShark(object):
+    def __init__(self):
+        self.views = []
+        self.api = DictObject(dict(view=FakeViewAPI()))
+
+    def create_view(self, src, columns, filters=None, sync=True, polls=3,
+                    fail=False):
+        assert not sync
+        self.inflight = max(getattr(self, 'inflight', 0),
+                            len([v for v in self.views if v.polls > 0]) + 1)
+        view = FakeView(self, 'v%d' % len(self.views), src, polls, fail)
+        self.views.append(view)
+        return view
+
+    def _del_view(self, view):
+        self.views.remove(view)
+
+
+class AsyncNetSharkTests(unittest.TestCase):
+    def setUp(self):
+        self.shark = FakeShark()
+        waiter = ViewWaiter(min_interval=0.001, max_interval=0.01)
+        self.ashark = AsyncNetShark(self.shark, workers=4, waiter=waiter)
+
+    def tearDown(self):
+        self.ashark.shutdown()
+
+    def test_lifecycle(self):
+        futures = [self.ashark.create_view(FakeSource(), [], polls=i)
+                   for i in range(10)]
+        views = gather(futures, timeout=5)
+        self.assertEqual(len(views), 10)
+        self.assertTrue(all(v.applied and v.polls <= 0 for v in views))
+
+        data = gather([self.ashark.get_data(v, delta=1) for v in views],
+                      timeout=5)
+        self.assertEqual(data[3], ['v3', {'delta': 1}])
+
+        gather([self.ashark.close(v) for v in views], timeout=5)
+        self.assertTrue(all(v.closed for v in views))
+        self.assertEqual(self.shark.views, [])
+
+    def test_live(self):
+        view = self.ashark.create_view(FakeSource(live=True), [],
+                                       polls=1000).result(5)
+        self.assertTrue(view.applied)
+
+    def test_failure(self):
+        good = self.ashark.create_view(FakeSource(), [])
+        bad = self.ashark.create_view(FakeSource(), [], fail=True)
+        self.assertRaises(IOError, bad.result, 5)
+        self.assertTrue([v for v in self.shark.views if v.fail][0].closed)
+
+        results = gather([good, bad], timeout=5, return_exceptions=True)
+        self.assertTrue(isinstance(results[1], IOError))
+        self.assertFalse(results[0].closed)
+
+    def test_shutdown(self):
+        future = self.ashark.wait(FakeView(self.shark, 'v', FakeSource(),
+                                           polls=10 ** 6))
+        self.ashark.shutdown()
+        self.assertRaises(RuntimeError, future.result, 5)
+
+
+class ViewBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.shark = FakeShark()
+        self.waiter = ViewWaiter(min_interval=0.001, max_interval=0.01)
+
+    def test_batch(self):
+        specs = [dict(src=FakeSource(), columns=[], polls=20 - i)
+                 for i in range(20)]
+        with ViewBatch(self.shark, specs, max_inflight=5,
+                       waiter=self.waiter) as batch:
+            results = list(batch)
+            views = list(self.shark.views)
+
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(view.applied for _, view in results))
+        self.assertEqual(sorted(spec['polls'] for spec, _ in results),
+                         range(1, 21))
+        self.assertTrue(self.shark.inflight <= 5)
+        # all the views are closed on exit
+        self.assertEqual(len(views), 20)
+        self.assertTrue(all(view.closed for view in views))
+        self.assertEqual(self.shark.views, [])
+
+    def test_completion_order(self):
+        specs = [(FakeSource(), []),
+                 dict(src=FakeSource(), columns=[], polls=1)]
+        with ViewBatch(self.shark, specs, waiter=self.waiter) as batch:
+            spec, view = iter(batch).next()
+            self.assertEqual(spec['polls'], 1)
+
+    def test_failure(self):
+        specs = [dict(src=FakeSource(), columns=[], fail=True),
+                 dict(src=FakeSource(), columns=[], polls=10 ** 6)]
+        views = []
+        with ViewBatch(self.shark, specs, waiter=self.waiter) as batch:
+            views.extend(self.shark.views)
+            self.assertRaises(IOError, list, batch)
+        self.assertTrue(all(view.closed for view in views))
+        self.assertEqual(self.shark.views, [])
+
+    def test_timeout(self):
+        from steelscript.netshark.core.viewutils import ViewTimeout
+        specs = [dict(src=FakeSource(), columns=[], polls=10 ** 6)]
+        with ViewBatch(self.shark, specs, waiter=self.waiter,
+                       timeout=0.05) as batch:
+            self.assertRaises(ViewTimeout, list, batch)
+
+    def test_max_inflight(self):
+        self.assertRaises(ValueError, ViewBatch, self.shark, [],
+                          max_inflight=0)
+
+
+class FutureTests(unittest.TestCase):
+    def test_callbacks(self):
+        future = Future()
+        called = []
+        future.add_done_callback(lambda f: called.append(f.result()))
+        self.assertFalse(future.done())
+        self.assertRaises(RuntimeError, future.result, 0.01)
+
+        threading.Timer(0.01, future.set_result, [42]).start()
+        self.assertEqual(future.result(5), 42)
+        time.sleep(0.01)
+        future.add_done_callback(lambda f: called.append(f.result()))
+        self.assertEqual(called, [42, 42])
+
+
+class ViewWaiterTests(unittest.TestCase):
+    def make_view(self, sizes):
+        """ A view that reports the processed sizes in `sizes` at every
+        poll, and is done after the last one """
+        class StatsAPI(object):
+            def __init__(self):
+                self.polls = []
+
+            def get_stats(self, handle, timestamp_format=None):
+                self.polls.append(time.time())
+                processed = sizes.pop(0)
+                return {'state': 'DONE' if not sizes else 'RUNNING',
+                        'input_size': 1000, 'processed_size': processed}
+
+        api = StatsAPI()
+        shark = DictObject(dict(api=DictObject(dict(view=api))))
+        return DictObject(dict(shark=shark, handle='v',
+                               timestamp_format=None)), api
+
+    def test_wait(self):
+        view, api = self.make_view([0, 100, 200, 1000])
+        progress = []
+        waiter = ViewWaiter(min_interval=0.01, max_interval=1)
+        stats = waiter.wait(view, on_progress=lambda v, p: progress.append(p))
+        self.assertEqual(stats['state'], 'DONE')
+        self.assertEqual(progress, [0, 10, 20, 100])
+        self.assertEqual(len(api.polls), 4)
+
+    def test_adaptive(self):
+        waiter = ViewWaiter(min_interval=0.01, max_interval=100, backoff=0)
+        view, api = self.make_view([0, 0, 10, 20, 1000])
+        tracker = waiter.track(view)
+        delays = []
+        while not waiter.poll(tracker):
+            delays.append(tracker.delay)
+            time.sleep(0.01)
+        # the interval doubles until the view makes progress, and is then
+        # set from the estimated completion time
+        self.assertEqual(delays[:2], [0.01, 0.02])
+        self.assertTrue(delays[3] > 10 * delays[1])
+
+    def test_timeout(self):
+        from steelscript.netshark.core.viewutils import ViewTimeout
+        view, api = self.make_view([0] * 1000)
+        waiter = ViewWaiter(min_interval=0.01, max_interval=0.05)
+        started = time.time()
+        self.assertRaises(ViewTimeout, waiter.wait_all, [view], 0.1)
+        self.assertTrue(time.time() - started < 0.5)
@@ -0,0 +1,1220 @@
+# Copyright (c) 2015 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import os
+import copy
+import json
+import time
+import shutil
+import tempfile
+import threading
+import datetime
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from steelscript.common import timeutils
+from steelscript.common.datastructures import DictObject
+from steelscript.netshark.core import (_view4, _utils, _fs, _interfaces,
+                                      viewutils)
+from steelscript.netshark.core.cache import ResultCache, DiskResultCache
+from steelscript.netshark.core._filters4 import BpfFilter
+
+
+def legend_entry(vtype, calculation='SUM', base='DEC', name='x'):
+    return DictObject(dict(name=name, type=vtype, base=base,
+                           calculation=calculation, dimension=False))
+
+
+class FakeViewAPI(object):
+    """ Stands in for `shark.api.view`, serving canned samples """
+    def __init__(self, legend, samples):
+        self.legend = legend
+        self.samples = samples
+        self.requests = []
+        self.legend_requests = []
+
+    def get_legend(self, handle, output, timestamp_format=None):
+        self.legend_requests.append((handle, output))
+        return self.legend
+
+    def get_config(self, handle, timestamp_format=None):
+        self.requests.append('config')
+        return self.config
+
+    def get_stats(self, handle, timestamp_format=None):
+        times = [s['t'] for s in self.samples]
+        return {'state': 'DONE',
+                'time_details': {'start': min(times) if times else 0,
+                                 'end': max(times) if times else 0,
+                                 'delta': SEC}}
+
+    def get_data(self, handle, output, timestamp_format=None, **params):
+        self.requests.append(params)
+        start, end = params['start'], params['end']
+        if params.get('aggregated'):
+            end = start + params['delta'] - 1
+        samples = [copy.deepcopy(s) for s in self.samples
+                   if (start == 0 or s['t'] >= start) and
+                   (end == 0 or s['t'] <= end)]
+        if params.get('aggregated'):
+            vals = [vec for s in samples for vec in s.get('vals', [])]
+            samples = [{'t': start, 'p': 1, 'vals': vals}] if vals else []
+        if 'sortby' in params:
+            column = int(params['sortby'][1:])
+            last = params['toentry'] + 1 if params['toentry'] else None
+            for s in samples:
+                s['vals'].sort(key=lambda vec: float(vec[column]),
+                               reverse=params['sorttype'] == 'descending')
+                s['vals'] = s['vals'][params['fromentry']:last]
+        return {'samples': samples}
+
+    def get_data_stream(self, handle, output, timestamp_format=None,
+                        **params):
+        # serve the response json in small pieces, as read from a socket
+        body = json.dumps(self.get_data(handle, output, **params))
+        chunks = (body[i:i + 7] for i in range(0, len(body), 7))
+        return _utils.iter_json_array(chunks, 'samples')
+
+
+class FakeSource(object):
+    def __init__(self, live=False):
+        self.live = live
+
+    def is_live(self):
+        return self.live
+
+
+class FakeJob(_interfaces.Job):
+    def __init__(self):
+        pass
+
+    def is_live(self):
+        return False
+
+
+def make_output(legend, samples, live=False):
+    api = FakeViewAPI(legend, samples)
+    shark = DictObject(dict(api=DictObject(dict(view=api))))
+    config = {'input_source': {'path': 'fs/admin/test.pcap'},
+              'processors': [{'outputs': [{'id': 'o1'}]}]}
+    view = _view4.View4(shark, 'v1', config, FakeSource(live))
+    return _view4.Output4(view, 'o1')
+
+
+SEC = 10 ** 9
+T0 = 1400000000 * SEC
+
+LEGEND = [legend_entry('IPv4', 'NONE', name='ip'),
+          legend_entry('UINT64', name='bytes'),
+          legend_entry('DOUBLE', 'AVG', name='rtt'),
+          legend_entry('BOOLEAN', 'NONE', name='syn')]
+
+SAMPLES = [
+    {'t': T0, 'p': 3, 'vals': [['10.0.0.1', '100', '3.0:2', 'true'],
+                               ['10.0.0.2', '50', '1.0:1', 'false']]},
+    {'t': T0 + SEC, 'p': 0},
+    {'t': T0 + 2 * SEC, 'p': 1, 'vals': [['10.0.0.1', '7', '9.0:3', '1']]},
+]
+
+
+class ConverterTests(unittest.TestCase):
+    def convert(self, string, *args, **kwargs):
+        return _view4._make_converter(legend_entry(*args, **kwargs))(string)
+
+    def test_integers(self):
+        self.assertEqual(self.convert('42', 'UINT64'), 42)
+        self.assertEqual(self.convert('ff', 'UINT8', base='HEX'), 255)
+        self.assertEqual(self.convert('80', 'TCP_PORT', 'NONE'), 80)
+        self.assertEqual(self.convert('10:4', 'INT32', 'AVG'), 2)
+        self.assertRaises(ValueError, self.convert, '1', 'INT32', base='OCT')
+
+    def test_doubles(self):
+        self.assertEqual(self.convert('1.5', 'DOUBLE'), 1.5)
+        self.assertEqual(self.convert('3.0:2', 'DOUBLE', 'AVG'), 1.5)
+        self.assertEqual(self.convert('0.25', 'RELATIVE_TIME', 'MAX'), 0.25)
+
+    def test_booleans(self):
+        self.assertEqual(self.convert('true', 'BOOLEAN', 'NONE'), 1)
+        self.assertEqual(self.convert('FALSE', 'BOOLEAN', 'NONE'), 0)
+        self.assertEqual(self.convert('7', 'BOOLEAN'), 7)
+
+    def test_absolute_time(self):
+        ns = '1400000000123456789'
+        self.assertEqual(self.convert(ns, 'ABSOLUTE_TIME', 'MIN'),
+                         timeutils.nsec_string_to_datetime(ns))
+
+    def test_passthrough(self):
+        self.assertEqual(self.convert('10.0.0.1', 'IPv4', 'NONE'), '10.0.0.1')
+        self.assertEqual(self.convert('a:3', 'STRING', 'AVG'), 'a')
+
+    def test_to_native_compat(self):
+        entry = legend_entry('UINT32', 'AVG')
+        self.assertEqual(_view4._to_native('9:3', entry), 3)
+
+    def test_avg_pairs(self):
+        pair = _view4._make_converter(legend_entry('INT32', 'AVG'),
+                                      avg_pairs=True)('10:4')
+        self.assertEqual(pair, (10, 4))
+        self.assertEqual(pair.value, 2)
+        pair = _view4._make_converter(legend_entry('DOUBLE', 'AVG'),
+                                      avg_pairs=True)('3.0:2')
+        self.assertEqual((pair.sum, pair.count, pair.value), (3.0, 2, 1.5))
+        self.assertEqual(pair.merge(_view4.AvgPair(6.0, 1)).value, 3.0)
+        self.assertEqual(_view4.AvgPair.combine([pair, pair]), (6.0, 4))
+        self.assertEqual(_view4.AvgPair(0, 0).value, None)
+        # only numbers are divided
+        self.assertEqual(_view4._make_converter(legend_entry('BOOLEAN', 'AVG'),
+                                                avg_pairs=True)('3:4'), 3)
+
+    def test_utils_avg(self):
+        self.assertEqual(_utils.value_to_int('7'), 7)
+        self.assertEqual(_utils.value_to_int('7:2'), 3)
+        self.assertEqual(_utils.value_to_int('7:2', precise=True), 3.5)
+        self.assertEqual(_utils.value_to_int('1:2:3'), 0)
+        self.assertEqual(_utils.parse_encoded_avg('9:3'), 3)
+
+    def test_compile_converters(self):
+        legend = [legend_entry('IPv4', 'NONE'), legend_entry('UINT64')]
+        converters = _view4._compile_converters(legend)
+        self.assertEqual([c(v) for c, v in zip(converters, ['1.2.3.4', '5'])],
+                         ['1.2.3.4', 5])
+
+
+class OutputTests(unittest.TestCase):
+    def test_get_iterdata(self):
+        output = make_output(LEGEND, SAMPLES)
+        data = list(output.get_iterdata())
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0]['t'], timeutils.nsec_to_datetime(T0))
+        self.assertEqual(data[0]['vals'],
+                         [['10.0.0.1', 100, 1.5, 1],
+                          ['10.0.0.2', 50, 1.0, 0]])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_arrays(self):
+        output = make_output(LEGEND, SAMPLES)
+        arrays = output.get_arrays()
+        self.assertEqual(len(arrays), 3)
+        self.assertEqual(list(arrays.t), [T0, T0 + 2 * SEC])
+        self.assertEqual(list(arrays.sample), [0, 0, 1])
+        self.assertEqual(list(arrays.row_times), [T0, T0, T0 + 2 * SEC])
+
+        ip, nbytes, rtt, syn = arrays.columns
+        self.assertEqual(ip.dtype, object)
+        self.assertEqual(nbytes.dtype, numpy.uint64)
+        self.assertEqual(rtt.dtype, numpy.float64)
+        self.assertEqual(syn.dtype, numpy.bool_)
+        self.assertEqual(list(nbytes), [100, 50, 7])
+        self.assertEqual(list(rtt), [1.5, 1.0, 3.0])
+        self.assertEqual(list(syn), [True, False, True])
+        self.assertEqual(list(arrays.column('ip')),
+                         ['10.0.0.1', '10.0.0.2', '10.0.0.1'])
+
+    def test_get_iterdata_avg_pairs(self):
+        output = make_output(LEGEND, SAMPLES)
+        data = list(output.get_iterdata(avg_pairs=True))
+        self.assertEqual([vec[2] for s in data for vec in s['vals']],
+                         [(3.0, 2), (1.0, 1), (9.0, 3)])
+        # the average over the whole output, from the 1 second samples
+        rtt = _view4.AvgPair.combine(vec[2] for s in data
+                                     for vec in s['vals'])
+        self.assertEqual(rtt.value, 13.0 / 6)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_arrays_avg_pairs(self):
+        from steelscript.netshark.core._columnar import reaggregate_avg
+        output = make_output(LEGEND, SAMPLES)
+        arrays = output.get_arrays(avg_pairs=True)
+        self.assertEqual(list(arrays.columns[2]), [3.0, 1.0, 9.0])
+        self.assertEqual(list(arrays.counts[2]), [2, 1, 3])
+        self.assertEqual([c is None for c in arrays.counts],
+                         [True, True, False, True])
+        self.assertEqual(list(arrays.averaged().columns[2]),
+                         list(output.get_arrays().columns[2]))
+        self.assertEqual(list(arrays.to_dataframe()['rtt']), [1.5, 1.0, 3.0])
+        self.assertEqual(list(arrays.select(arrays.sample == 1).counts[2]),
+                         [3])
+
+        # one group per ip address
+        sums, counts = reaggregate_avg(arrays.columns[2], arrays.counts[2],
+                                       numpy.array([0, 1, 0]), 2)
+        self.assertEqual(list(sums), [12.0, 1.0])
+        self.assertEqual(list(counts), [5, 1])
+
+        # pairs from get_iterdata samples give the same arrays
+        from steelscript.netshark.core._columnar import columnar_from_samples
+        converted = columnar_from_samples(
+            LEGEND, output.get_iterdata(avg_pairs=True))
+        self.assertEqual(list(converted.columns[2]), [3.0, 1.0, 9.0])
+        self.assertEqual(list(converted.counts[2]), [2, 1, 3])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_rollup_keys(self):
+        output = make_output(LEGEND, SAMPLES)
+        arrays = output.get_arrays(avg_pairs=True)
+        self.assertEqual(arrays.delta, SEC)
+
+        coarse = arrays.rollup(datetime.timedelta(seconds=3), start=T0)
+        self.assertEqual(list(coarse.t), [T0])
+        self.assertEqual(coarse.delta, 3 * SEC)
+        ip, nbytes, rtt, syn = coarse.columns
+        self.assertEqual(list(ip), ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(list(nbytes), [107, 50])
+        self.assertEqual(nbytes.dtype, numpy.uint64)
+        self.assertEqual(list(coarse.counts[2]), [5, 1])
+        self.assertEqual(list(coarse.averaged().columns[2]), [2.4, 1.0])
+
+        # aligned on the epoch, the samples fall in two buckets
+        coarse = arrays.rollup(3 * SEC)
+        self.assertEqual(list(coarse.t), [T0 - 2 * SEC, T0 + SEC])
+        self.assertEqual(list(coarse.sample), [0, 0, 1])
+
+        # averages cannot be combined
+        self.assertRaises(ValueError, output.get_arrays().rollup, 3 * SEC)
+        self.assertRaises(ValueError, arrays.rollup, SEC / 2)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_rollup_calculations(self):
+        legend = [legend_entry('UINT64', 'MAX', name='max'),
+                  legend_entry('INT32', 'MIN', name='min'),
+                  legend_entry('DOUBLE', 'TIME_AVG', name='rate')]
+        samples = [{'t': T0 + i * SEC, 'p': 1,
+                    'vals': [[str(i), str(10 - i), '%d.0' % (i + 1)]]}
+                   for i in range(3)]
+        arrays = make_output(legend, samples).get_arrays()
+        coarse = arrays.rollup(2 * SEC, start=T0)
+        self.assertEqual(list(coarse.t), [T0, T0 + 2 * SEC])
+        self.assertEqual([list(c) for c in coarse.columns],
+                         [[1, 2], [9, 8], [1.5, 1.5]])
+        self.assertEqual(coarse.counts, None)
+
+        empty = make_output(legend, []).get_arrays().rollup(2 * SEC)
+        self.assertEqual(len(empty), 0)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_arrays_empty(self):
+        output = make_output(LEGEND, [])
+        arrays = output.get_arrays()
+        self.assertEqual(len(arrays), 0)
+        self.assertEqual(arrays.columns[1].dtype, numpy.uint64)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_decode_column(self):
+        from steelscript.netshark.core._columnar import decode_column
+        col = decode_column(['ff', '10'], legend_entry('UINT8', base='HEX'))
+        self.assertEqual(list(col), [255, 16])
+        col = decode_column(['7:2', '9:3'], legend_entry('INT32', 'AVG'))
+        self.assertEqual(col.dtype, numpy.int64)
+        self.assertEqual(list(col), [3, 3])
+        col = decode_column(['3', 'true'], legend_entry('BOOLEAN'))
+        self.assertEqual(list(col), [3, 1])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_dataframe(self):
+        output = make_output(LEGEND, SAMPLES)
+        df = output.get_dataframe()
+        self.assertEqual(list(df.columns), ['time', 'ip', 'bytes', 'rtt', 'syn'])
+        self.assertEqual(len(df), 3)
+        self.assertEqual(df['time'][2].value, T0 + 2 * SEC)
+        self.assertEqual(list(df['bytes']), [100, 50, 7])
+
+        df = output.get_dataframe(include_sample_times=False)
+        self.assertEqual(list(df.columns), ['ip', 'bytes', 'rtt', 'syn'])
+
+    def test_get_iterdata_chunked(self):
+        samples = [{'t': T0 + i * SEC, 'p': 1, 'vals': [['10.0.0.1', str(i),
+                                                         '1.0:1', '1']]}
+                   for i in range(10)]
+        output = make_output(LEGEND, samples)
+        api = output.view.shark.api.view
+
+        full = list(output.get_iterdata())
+        self.assertEqual(len(api.requests), 1)
+
+        del api.requests[:]
+        chunked = list(output.get_iterdata(chunk=3))
+        self.assertEqual(chunked, full)
+        self.assertEqual([(r['start'], r['end']) for r in api.requests],
+                         [(T0, T0 + 2 * SEC), (T0 + 3 * SEC, T0 + 5 * SEC),
+                          (T0 + 6 * SEC, T0 + 8 * SEC),
+                          (T0 + 9 * SEC, T0 + 9 * SEC)])
+
+        del api.requests[:]
+        chunked = list(output.get_iterdata(start=T0 + 2 * SEC,
+                                           end=T0 + 6 * SEC,
+                                           chunk=datetime.timedelta(seconds=2)))
+        self.assertEqual([s['vals'][0][1] for s in chunked], [2, 3, 4, 5])
+        self.assertEqual(len(api.requests), 2)
+
+    def test_chunk_validation(self):
+        output = make_output(LEGEND, SAMPLES)
+        self.assertRaises(ValueError, list,
+                          output.get_iterdata(aggregated=True, chunk=10))
+        self.assertRaises(ValueError, list,
+                          output.get_iterdata(chunk=datetime.timedelta(0)))
+
+    def test_get_iterdata_prefetch(self):
+        samples = [{'t': T0 + i * SEC, 'p': 1, 'vals': [['10.0.0.1', str(i),
+                                                         '1.0:1', '1']]}
+                   for i in range(10)]
+        output = make_output(LEGEND, samples)
+        full = list(output.get_iterdata())
+        self.assertEqual(list(output.get_iterdata(chunk=2, prefetch=2)), full)
+        self.assertEqual(list(output.get_iterdata(prefetch=1)), full)
+
+    def test_get_iterdata_stream(self):
+        output = make_output(LEGEND, SAMPLES)
+        api = output.view.shark.api.view
+        full = list(output.get_iterdata())
+        self.assertEqual(list(output.get_iterdata(stream=True)), full)
+        self.assertEqual(list(output.get_iterdata(stream=True, chunk=1)), full)
+        self.assertEqual(len(api.requests), 5)
+
+    def test_get_iterdata_compact(self):
+        output = make_output(LEGEND, SAMPLES)
+        full = list(output.get_iterdata())
+        compact = list(output.get_iterdata(compact=True))
+        self.assertEqual(compact, full)
+        self.assertTrue(isinstance(compact[0], _view4.Sample))
+        self.assertEqual(compact[1].t, full[1]['t'])
+
+    def test_time_formats(self):
+        legend = LEGEND + [legend_entry('ABSOLUTE_TIME', 'MIN', name='syn_time')]
+        samples = [{'t': T0, 'p': 1,
+                    'vals': [['10.0.0.1', '1', '1.0:1', '1', str(T0 + 5)]]}]
+        output = make_output(legend, samples)
+
+        ns = list(output.get_iterdata(time_format='ns'))
+        self.assertEqual(ns[0]['t'], T0)
+        self.assertEqual(ns[0]['vals'][0][4], T0 + 5)
+
+        dt = list(output.get_iterdata())
+        lazy = list(output.get_iterdata(time_format='lazy'))
+        t = lazy[0]['t']
+        self.assertTrue(isinstance(t, _view4.Timestamp))
+        self.assertEqual(t.ns, T0)
+        self.assertTrue(t._datetime is None)
+        self.assertEqual(t, dt[0]['t'])
+        self.assertEqual(t.year, dt[0]['t'].year)
+        self.assertEqual(lazy[0]['vals'][0][4], dt[0]['vals'][0][4])
+
+        self.assertRaises(ValueError, list,
+                          output.get_iterdata(time_format='epoch'))
+
+    def test_timestamp(self):
+        t = _view4.Timestamp(T0)
+        later = _view4.Timestamp(T0 + SEC)
+        self.assertTrue(t < later)
+        self.assertTrue(later > t.datetime)
+        self.assertTrue(t.datetime < later)
+        self.assertEqual(t, T0)
+        self.assertNotEqual(t, later)
+        self.assertEqual(later - t, datetime.timedelta(seconds=1))
+        self.assertEqual(t + datetime.timedelta(seconds=1), later.datetime)
+        self.assertEqual(int(later), T0 + SEC)
+        self.assertEqual(t.strftime('%Y'), '2014')
+        self.assertEqual(str(t), str(timeutils.nsec_to_datetime(T0)))
+
+    def test_iter_sorted(self):
+        legend = [legend_entry('IPv4', 'NONE', name='ip'),
+                  legend_entry('UINT64', name='bytes')]
+        samples = [{'t': T0 + i * SEC, 'p': 1,
+                    'vals': [['10.0.%d.%d' % (i, j), str(i * 10 + j)]
+                             for j in range(10)]}
+                   for i in range(5)]
+        output = make_output(legend, samples)
+        api = output.view.shark.api.view
+
+        rows = list(output.iter_sorted(1, page_size=7))
+        self.assertEqual([r[1] for r in rows], range(49, -1, -1))
+        self.assertEqual(len(api.requests), 8)
+        self.assertEqual([(r['fromentry'], r['toentry'])
+                          for r in api.requests[:2]], [(0, 6), (7, 13)])
+
+        del api.requests[:]
+        it = output.iter_sorted(1, page_size=10, sorttype='ascending',
+                                prefetch=0)
+        self.assertEqual([next(it)[1] for _ in range(3)], [0, 1, 2])
+        it.close()
+        self.assertEqual(len(api.requests), 1)
+
+        self.assertRaises(ValueError, list, output.iter_sorted(1, page_size=1))
+
+    def test_get_data_parallel(self):
+        samples = [{'t': T0 + i * SEC, 'p': 1, 'vals': [['10.0.0.1', str(i),
+                                                         '1.0:1', '1']]}
+                   for i in range(10)]
+        output = make_output(LEGEND, samples)
+        api = output.view.shark.api.view
+        full = output.get_data()
+
+        del api.requests[:]
+        self.assertEqual(output.get_data(parallel=3), full)
+        self.assertEqual(sorted((r['start'], r['end']) for r in api.requests),
+                         [(T0, T0 + 3 * SEC), (T0 + 4 * SEC, T0 + 7 * SEC),
+                          (T0 + 8 * SEC, T0 + 9 * SEC)])
+        self.assertEqual([p.samples for p in output.partition_stats],
+                         [4, 4, 2])
+
+        self.assertEqual(output.get_data(parallel=4, chunk=1), full)
+        self.assertEqual(len(output.partition_stats), 10)
+
+
+class ExportTests(unittest.TestCase):
+    def setUp(self):
+        self.output = make_output(LEGEND, SAMPLES)
+        self.legend = self.output.get_legend()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_csv_output(self):
+        expected = os.path.join(self.tmpdir, 'expected.csv')
+        viewutils.write_csv(expected, self.legend, self.output.get_iterdata())
+
+        # the output is read in windows, one of them ahead
+        api = self.output.view.shark.api.view
+        del api.requests[:]
+        filename = os.path.join(self.tmpdir, 'out.csv')
+        viewutils.write_csv(filename, self.legend, self.output,
+                            prefetch=1, chunk=1)
+        with open(expected) as f1, open(filename) as f2:
+            self.assertEqual(f1.read(), f2.read())
+        self.assertEqual(len(api.requests), 3)
+
+        self.assertRaises(ValueError, viewutils.write_csv, filename,
+                          self.legend, self.output.get_iterdata(), prefetch=1)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_iter_arrays(self):
+        batches = list(self.output.iter_arrays(batch_rows=1))
+        self.assertEqual([len(b) for b in batches], [2, 1])
+        self.assertEqual(list(batches[1].row_times), [T0 + 2 * SEC])
+        self.assertEqual(batches[1].columns[1].dtype, numpy.uint64)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_batches_from_samples(self):
+        from steelscript.netshark.core._columnar import iter_batches
+        arrays = self.output.get_arrays()
+        for time_format in _view4.TIME_FORMATS:
+            samples = self.output.get_iterdata(time_format=time_format)
+            batches = list(iter_batches(self.legend, samples, batch_rows=2))
+            self.assertEqual([len(b) for b in batches], [2, 1])
+            self.assertEqual(list(batches[1].t), [T0 + 2 * SEC])
+            for i, column in enumerate(arrays.columns):
+                self.assertEqual(batches[0].columns[i].dtype, column.dtype)
+                self.assertEqual(list(batches[0].columns[i]),
+                                 list(column[:2]))
+
+        batches = list(iter_batches(self.legend, arrays))
+        self.assertEqual(len(batches), 1)
+        self.assertTrue(batches[0] is arrays)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_write_parquet(self):
+        import pyarrow.parquet
+        filename = os.path.join(self.tmpdir, 'out.parquet')
+        viewutils.write_parquet(filename, self.legend,
+                                self.output.get_iterdata(), batch_rows=2)
+        table = pyarrow.parquet.read_table(filename)
+        self.assertEqual(table.column_names,
+                         ['time', 'ip', 'bytes', 'rtt', 'syn'])
+        self.assertEqual(table.num_rows, 3)
+        df = table.to_pandas()
+        self.assertEqual(list(df['bytes']), [100, 50, 7])
+        self.assertEqual(df['time'][2].value, T0 + 2 * SEC)
+        legend = json.loads(table.schema.metadata['netshark.legend'])
+        self.assertEqual([e['name'] for e in legend],
+                         ['ip', 'bytes', 'rtt', 'syn'])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_write_arrow(self):
+        filename = os.path.join(self.tmpdir, 'out.arrow')
+        viewutils.write_arrow(filename, self.legend,
+                              self.output.iter_arrays(batch_rows=1),
+                              include_sample_times=False)
+        reader = pyarrow.ipc.open_file(pyarrow.memory_map(filename))
+        self.assertEqual(reader.num_record_batches, 2)
+        table = reader.read_all()
+        self.assertEqual(table.column_names, ['ip', 'bytes', 'rtt', 'syn'])
+        self.assertEqual(table.schema.field('bytes').type, pyarrow.uint64())
+        self.assertEqual(table.to_pandas()['ip'].tolist(),
+                         ['10.0.0.1', '10.0.0.2', '10.0.0.1'])
+
+
+class LegendTests(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeViewAPI(LEGEND, SAMPLES)
+        self.shark = DictObject(dict(api=DictObject(dict(view=self.api)),
+                                     _legends_cache={}))
+        self.config = {'input_source': {'path': 'fs/admin/test.pcap'},
+                       'processors': [{'outputs': [{'id': 'o1'}]},
+                                      {'outputs': [{'id': 'o2'}]}]}
+
+    def make_view(self, handle, config=None):
+        return _view4.View4(self.shark, handle, config or self.config,
+                            FakeSource())
+
+    def test_lazy(self):
+        view = self.make_view('v1')
+        view.all_outputs()
+        self.assertEqual(self.api.legend_requests, [])
+        self.assertEqual(view.get_output('o1').get_legend(), LEGEND)
+        self.assertEqual(self.api.legend_requests, [('v1', 'o1')])
+        view.get_output('o1').get_data()
+        self.assertEqual(len(self.api.legend_requests), 1)
+
+        # the legend returned can be modified by the caller
+        view.get_output('o1').get_legend()[0].name = 'changed'
+        self.assertEqual(view.get_output('o1').get_legend()[0].name, 'ip')
+
+    def test_get_legends(self):
+        view = self.make_view('v1')
+        legends = view.get_legends()
+        self.assertEqual(sorted(legends.keys()), ['o1', 'o2'])
+        self.assertEqual(legends['o2'], LEGEND)
+        self.assertEqual(sorted(self.api.legend_requests),
+                         [('v1', 'o1'), ('v1', 'o2')])
+
+    def test_lazy_config(self):
+        self.api.config = self.config
+        view = _view4.View4(self.shark, 'v1')
+        self.assertEqual(self.api.requests, [])
+        self.assertEqual(view.config, self.config)
+        self.assertEqual(view.get_legends()['o2'], LEGEND)
+        self.assertEqual(self.api.requests, ['config'])
+
+    def test_shared(self):
+        self.make_view('v1').get_legends()
+        self.assertEqual(len(self.api.legend_requests), 2)
+
+        # views with the same configuration do not request the legends
+        self.make_view('v2', copy.deepcopy(self.config)).get_legends()
+        self.assertEqual(len(self.api.legend_requests), 2)
+
+        config = copy.deepcopy(self.config)
+        config['processors'][0]['keys'] = ['ip']
+        self.make_view('v3', config).get_legends()
+        self.assertEqual(len(self.api.legend_requests), 4)
+
+
+class ResultCacheTests(unittest.TestCase):
+    def make_output(self, live=False, cache=None):
+        samples = [{'t': T0 + i * SEC, 'p': 1, 'vals': [['10.0.0.1', str(i),
+                                                         '1.0:1', '1']]}
+                   for i in range(10)]
+        output = make_output(LEGEND, samples, live)
+        if cache is None:
+            cache = ResultCache()
+        output.view.shark.result_cache = cache
+        return output, output.view.shark.api.view
+
+    def test_offline(self):
+        output, api = self.make_output()
+        cache = output.view.shark.result_cache
+        first = list(output.get_iterdata())
+        self.assertEqual(list(output.get_iterdata()), first)
+        self.assertEqual(list(output.get_iterdata(stream=True)), first)
+        self.assertEqual(len(api.requests), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        # a different request, and the same request on another view
+        list(output.get_iterdata(start=T0 + SEC))
+        other, other_api = self.make_output(cache=cache)
+        self.assertEqual(list(other.get_iterdata()), first)
+        self.assertEqual(len(api.requests), 2)
+        self.assertEqual(len(other_api.requests), 0)
+        self.assertEqual(cache.stats().entries, 2)
+
+    def test_filters(self):
+        cache = ResultCache()
+        outputs = []
+        for port in (80, 443, 80):
+            output, api = self.make_output(cache=cache)
+            output.view.config['input_source']['filters'] = [
+                BpfFilter('port %d' % port)]
+            list(output.get_iterdata())
+            outputs.append((output, api))
+
+        # views with other filters on the same file hold other data
+        self.assertEqual([len(api.requests) for _, api in outputs],
+                         [1, 1, 0])
+        self.assertEqual(cache.stats().entries, 2)
+
+    def test_live(self):
+        output, api = self.make_output(live=True)
+        list(output.get_iterdata())
+        list(output.get_iterdata())
+        self.assertEqual(len(api.requests), 2)
+
+        # the last sample of the view may still be in progress
+        list(output.get_iterdata(start=T0, end=T0 + 10 * SEC))
+        list(output.get_iterdata(start=T0, end=T0 + 10 * SEC))
+        self.assertEqual(len(api.requests), 4)
+
+        # complete windows are only known once the view was polled
+        list(output.get_iterdata(start=T0, end=T0 + 9 * SEC))
+        self.assertEqual(len(api.requests), 5)
+        output.view.get_timeinfo()
+        list(output.get_iterdata(start=T0, end=T0 + 9 * SEC))
+        list(output.get_iterdata(start=T0, end=T0 + 9 * SEC))
+        self.assertEqual(len(api.requests), 6)
+
+        # other views on the source hold other packets
+        other, other_api = self.make_output(
+            live=True, cache=output.view.shark.result_cache)
+        other.view.handle = 'v2'
+        other.view.get_timeinfo()
+        list(other.get_iterdata(start=T0, end=T0 + 9 * SEC))
+        self.assertEqual(len(other_api.requests), 1)
+
+    def test_job(self):
+        output, api = self.make_output()
+        output.view.source = FakeJob()
+        cache = output.view.shark.result_cache
+        first = list(output.get_iterdata())
+
+        # a later view on the growing job
+        other, other_api = self.make_output(cache=cache)
+        other.view.source = FakeJob()
+        other_api.samples.append({'t': T0 + 10 * SEC, 'p': 1,
+                                  'vals': [['10.0.0.1', '10', '1.0:1', '1']]})
+        other.view.handle = 'v2'
+        self.assertEqual(len(list(other.get_iterdata())), len(first) + 1)
+        self.assertEqual(cache.stats().entries, 0)
+
+    def test_limits(self):
+        cache = ResultCache(max_entries=2, max_rows=3)
+        sample = {'t': 1, 'p': 1, 'vals': [[1]]}
+        cache.put('a', [sample])
+        cache.put('b', [sample])
+        cache.get('a')
+        cache.put('c', [sample])
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), [sample])
+        self.assertEqual(cache.evictions, 1)
+
+        cache.put('d', [sample, sample, sample])
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.rows, 3)
+        cache.put('e', [sample] * 4)
+        self.assertEqual(cache.get('e'), None)
+
+        cache = ResultCache(ttl=-1)
+        cache.put('a', [sample])
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.rows, 0)
+
+
+
+class FakeFSAPI(object):
+    def __init__(self, modified=1):
+        self.modified = modified
+        self.checksums = 0
+
+    def get_details(self, path, details=False):
+        return {'id': path, 'created': 1, 'modified': self.modified}
+
+    def checksum(self, path):
+        self.checksums += 1
+        return {'checksum': 'abc'}
+
+
+class DiskResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_output(self, cache, path='/admin/test.pcap', modified=1,
+                    filters=None):
+        api = FakeViewAPI(LEGEND, SAMPLES)
+        fs = FakeFSAPI(modified)
+        shark = DictObject(dict(api=DictObject(dict(view=api, fs=fs)),
+                                host='shark1', _file_separator='/',
+                                result_cache=cache))
+        source = _fs.TraceFile4(shark, {'id': path, 'created': 1,
+                                        'modified': modified})
+        config = {'input_source': {'path': source.source_path},
+                  'processors': [{'outputs': [{'id': 'o1'}]}]}
+        if filters is not None:
+            config['input_source']['filters'] = filters
+        view = _view4.View4(shark, 'v1', config, source)
+        return _view4.Output4(view, 'o1'), api, fs
+
+    def test_persistence(self):
+        cache = DiskResultCache(self.directory)
+        output, api, fs = self.make_output(cache)
+        first = list(output.get_iterdata())
+        self.assertEqual(list(output.get_iterdata()), first)
+        self.assertEqual(len(api.requests), 1)
+        self.assertEqual(fs.checksums, 1)
+
+        # a new cache on the same directory, as after a restart
+        cache = DiskResultCache(self.directory)
+        output, api, fs = self.make_output(cache)
+        self.assertEqual(list(output.get_iterdata()), first)
+        self.assertEqual(len(api.requests), 0)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual(cache.stats().entries, 1)
+
+        # another file, or a modified file, is fetched again
+        output, api, fs = self.make_output(cache, path='/admin/other.pcap')
+        list(output.get_iterdata())
+        output, api, fs = self.make_output(cache, modified=2)
+        list(output.get_iterdata())
+        self.assertEqual(fs.checksums, 1)
+        self.assertEqual(cache.stats().entries, 2)
+
+    def test_modified(self):
+        cache = DiskResultCache(self.directory)
+        output, api, fs = self.make_output(cache)
+        list(output.get_iterdata())
+
+        # the file is modified on the appliance while the object is
+        # reused: its checksum is computed again, once
+        fs.modified = 2
+        list(output.get_iterdata())
+        list(output.get_iterdata())
+        self.assertEqual(fs.checksums, 2)
+        self.assertEqual(len(api.requests), 1)
+
+    def test_filters(self):
+        cache = DiskResultCache(self.directory)
+        output, api, fs = self.make_output(cache,
+                                           filters=[BpfFilter('port 80')])
+        list(output.get_iterdata())
+
+        # views with other filters on the same file hold other data
+        output, api, fs = self.make_output(cache,
+                                           filters=[BpfFilter('port 443')])
+        list(output.get_iterdata())
+        self.assertEqual(len(api.requests), 1)
+
+        output, api, fs = self.make_output(cache,
+                                           filters=[BpfFilter('port 80')])
+        list(output.get_iterdata())
+        self.assertEqual(len(api.requests), 0)
+        self.assertEqual(cache.stats().entries, 2)
+
+    def test_eviction(self):
+        cache = DiskResultCache(self.directory, max_bytes=300)
+        sample = {'t': 1, 'p': 1, 'vals': [['x' * 10]]}
+        cache.put('a', [sample])
+        cache.put('b', [sample])
+        os.utime(cache._path('a'), (1, 1))
+        os.utime(cache._path('b'), (2, 2))
+        cache.get('a')
+        size = cache.stats().bytes // 2
+        cache.max_bytes = 2 * size
+        cache.put('c', [sample])
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), [sample])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_corrupted(self):
+        cache = DiskResultCache(self.directory)
+        with open(cache._path('a'), 'wb') as f:
+            f.write('garbage')
+        self.assertEqual(cache.get('a'), None)
+        self.assertFalse(os.path.exists(cache._path('a')))
+
+
+class SampleTests(unittest.TestCase):
+    def test_dict_access(self):
+        s = _view4.Sample(T0, 3, [[1, 2]])
+        self.assertEqual(s['t'], T0)
+        self.assertEqual(s.get('p'), 3)
+        self.assertTrue('vals' in s)
+        self.assertFalse('gap_start' in s)
+        self.assertEqual(s.get('gap_end', 'none'), 'none')
+        self.assertRaises(KeyError, lambda: s['gap_start'])
+        self.assertRaises(KeyError, lambda: s['foo'])
+        self.assertEqual(sorted(s), ['p', 't', 'vals'])
+        self.assertEqual(s, {'t': T0, 'p': 3, 'vals': [[1, 2]]})
+
+        s['gap_start'] = T0
+        self.assertTrue('gap_start' in s)
+        self.assertEqual(s.to_dict()['gap_start'], T0)
+        self.assertRaises(KeyError, s.__setitem__, 'foo', 1)
+        self.assertFalse(hasattr(s, '__dict__'))
+
+    def test_mixer(self):
+        bytes_output = make_output([legend_entry('UINT64', name='bytes')],
+                                   [{'t': T0 + i * SEC, 'p': 1,
+                                     'vals': [[str(i)]]} for i in range(3)])
+        pkts_output = make_output([legend_entry('UINT64', name='pkts')],
+                                  [{'t': T0 + i * SEC, 'p': 1,
+                                    'vals': [[str(10 * i)]]}
+                                   for i in range(3)])
+        mixer = viewutils.OutputMixer()
+        mixer.add_source(bytes_output, 'b.')
+        mixer.add_source(pkts_output, 'p.')
+
+        for compact in (False, True):
+            data = list(mixer.get_iterdata(compact=compact))
+            self.assertEqual([s['vals'] for s in data],
+                             [[[0, 0]], [[1, 10]], [[2, 20]]])
+            self.assertEqual(data[2].t, timeutils.nsec_to_datetime(T0 + 2 * SEC))
+        self.assertTrue(isinstance(data[0], _view4.Sample))
+
+
+class MixerTests(unittest.TestCase):
+    def key_entry(self):
+        entry = legend_entry('IPv4', 'NONE', name='ip')
+        entry.update(dimension=True, field='ip.address')
+        return entry
+
+    def test_merge_order(self):
+        # sources with different sampling times and lengths
+        outputs = [make_output([legend_entry('UINT64', name='v')],
+                               [{'t': T0 + i * step * SEC, 'p': 1,
+                                 'vals': [[str(n * 100 + i)]]}
+                                for i in range(count)])
+                   for n, (step, count) in enumerate([(1, 6), (2, 3),
+                                                      (3, 1)])]
+        mixer = viewutils.OutputMixer()
+        for output in outputs:
+            mixer.add_source(output)
+
+        data = list(mixer.get_iterdata(time_format='ns'))
+        self.assertEqual([s.t for s in data], [T0 + i * SEC for i in range(6)])
+        self.assertEqual([s.vals for s in data],
+                         [[[0, 100, 200]], [[1, None, None]],
+                          [[2, 101, None]], [[3, None, None]],
+                          [[4, 102, None]], [[5, None, None]]])
+
+        # samples closer than the threshold are combined
+        data = list(mixer.get_iterdata(time_format='ns',
+                                       time_thresh=datetime.timedelta(0, 2)))
+        self.assertEqual([s.vals for s in data],
+                         [[[1, 100, 200]], [[3, 101, None]],
+                          [[5, 102, None]]])
+        data = list(mixer.get_iterdata(time_thresh=3 * SEC))
+        self.assertEqual(len(data), 2)
+
+    def test_keyed(self):
+        bytes_output = make_output(
+            [self.key_entry(), legend_entry('UINT64', name='bytes')],
+            [{'t': T0, 'p': 2, 'vals': [['10.0.0.1', '100'],
+                                        ['10.0.0.2', '50']]},
+             {'t': T0 + SEC, 'p': 1, 'vals': [['10.0.0.2', '7']]}])
+        pkts_output = make_output(
+            [self.key_entry(), legend_entry('UINT64', name='pkts')],
+            [{'t': T0, 'p': 2, 'vals': [['10.0.0.3', '1'],
+                                        ['10.0.0.1', '2']]}])
+        mixer = viewutils.OutputMixer()
+        mixer.add_source(bytes_output, 'b.')
+        mixer.add_source(pkts_output, 'p.')
+        self.assertEqual([e.name for e in mixer.get_legend()],
+                         ['ip', 'b.bytes', 'p.pkts'])
+
+        data = list(mixer.get_iterdata(compact=True))
+        self.assertEqual(data[0]['vals'], [['10.0.0.1', 100, 2],
+                                           ['10.0.0.2', 50, None],
+                                           ['10.0.0.3', None, 1]])
+        self.assertEqual(data[1]['vals'], [['10.0.0.2', 7, None]])
+
+        unkeyed = make_output([legend_entry('UINT64', name='pkts')], [])
+        self.assertRaises(NotImplementedError, mixer.add_source, unkeyed)
+
+    def test_empty(self):
+        mixer = viewutils.OutputMixer()
+        mixer.add_source(make_output([legend_entry('UINT64')], []))
+        self.assertEqual(list(mixer.get_iterdata()), [])
+
+
+class LiveViewAPI(FakeViewAPI):
+    """ A live view whose last sample, still being filled, starts at
+    `end`, and whose samples before `start` have been discarded """
+    def __init__(self, legend):
+        FakeViewAPI.__init__(self, legend, [])
+        self.start = T0
+        self.end = T0
+        self.state = 'RUNNING'
+        self.stats_requests = 0
+        self.failures = 0
+
+    def advance(self, seconds):
+        for _ in range(seconds):
+            self.samples.append({'t': self.end, 'p': 1,
+                                 'vals': [[str(self.end // SEC)]]})
+            self.end += SEC
+
+    def get_stats(self, handle, timestamp_format=None):
+        self.stats_requests += 1
+        if self.failures:
+            self.failures -= 1
+            raise IOError('connection reset')
+        return {'state': self.state,
+                'time_details': {'start': self.start, 'end': self.end,
+                                 'delta': SEC}}
+
+    def get_data(self, handle, output, timestamp_format=None, **params):
+        res = FakeViewAPI.get_data(self, handle, output, **params)
+        samples = res['samples']
+        # include the incomplete last sample, as the appliance does
+        if params['end'] >= self.end:
+            samples.append({'t': self.end, 'p': 1, 'vals': [['0']]})
+
+        # samples of `delta`, aligned on its multiples, add up the values
+        # of the samples of the view they cover
+        delta = params['delta']
+        totals = {}
+        for sample in samples:
+            t = sample['t'] // delta * delta
+            totals[t] = totals.get(t, 0) + int(sample['vals'][0][0])
+        res['samples'] = [{'t': t, 'p': 1, 'vals': [[str(totals[t])]]}
+                          for t in sorted(totals)]
+        return res
+
+
+class FollowTests(unittest.TestCase):
+    def setUp(self):
+        self.output = make_output([legend_entry('UINT64', name='v')], [],
+                                  live=True)
+        self.api = LiveViewAPI(self.output._legend)
+        self.output.view.shark.api.view = self.api
+
+    def times(self, samples):
+        return [(s['t'] - T0) // SEC for s in samples]
+
+    def test_cursor(self):
+        cursor = viewutils.Cursor(self.output)
+        self.assertEqual(cursor.get_data(), [])
+        self.api.advance(3)
+        data = cursor.get_data(time_format='ns')
+        # the sample that is still being filled is not returned
+        self.assertEqual(self.times(data), [0, 1, 2])
+        self.assertEqual(data[1]['vals'], [[1400000001]])
+        self.assertEqual(cursor.get_data(), [])
+        self.api.advance(2)
+        self.assertEqual(self.times(cursor.get_data(time_format='ns')),
+                         [3, 4])
+        # one get_stats and at most one get_data request per call
+        self.assertEqual(self.api.stats_requests, 4)
+        self.assertEqual(len(self.api.requests), 2)
+
+    def test_gaps(self):
+        cursor = viewutils.Cursor(self.output, max_lag=3)
+        self.api.advance(10)
+        # the first poll starts max_lag samples from the end
+        self.assertEqual(self.times(cursor.get_data(time_format='ns')),
+                         [7, 8, 9])
+
+        # samples discarded by the appliance
+        self.api.advance(5)
+        self.api.start = T0 + 11 * SEC
+        data = cursor.get_data(time_format='ns', compact=True)
+        self.assertEqual(data[0].vals, [])
+        self.assertEqual((data[0].gap_start - T0, data[0].gap_end - T0),
+                         (10 * SEC, 11 * SEC))
+        self.assertEqual(self.times(data[1:]), [11, 12, 13, 14])
+
+        # samples skipped to catch up
+        self.api.advance(10)
+        data = cursor.get_data(time_format='ns')
+        self.assertEqual((data[0]['gap_start'] - T0) // SEC, 15)
+        self.assertEqual((data[0]['gap_end'] - T0) // SEC, 22)
+        self.assertEqual(self.times(data[1:]), [22, 23, 24])
+
+    def test_follow(self):
+        self.api.advance(3)
+        self.api.failures = 2
+        samples = self.output.follow(poll=0.001, time_format='ns')
+        data = [samples.next(), samples.next()]
+        self.assertEqual(self.times(data), [0, 1])
+
+        # the view completes while it is followed
+        self.api.advance(2)
+        self.api.state = 'DONE'
+        data = list(samples)
+        # the last sample is complete once the view is done
+        self.assertEqual(self.times(data), [2, 3, 4, 5])
+
+        self.api.failures = 3
+        self.assertRaises(IOError, list,
+                          self.output.follow(poll=0.001, retries=2))
+
+    def test_delta(self):
+        self.api.advance(7)
+        self.api.state = 'DONE'
+        data = list(self.output.follow(poll=0.001, time_format='ns',
+                                       delta=datetime.timedelta(0, 2)))
+        self.assertEqual(self.api.requests,
+                         [{'start': T0, 'end': T0 + 8 * SEC - 1,
+                           'delta': 2 * SEC}])
+        # each sample covers two seconds of the view
+        self.assertEqual(self.times(data), [0, 2, 4, 6])
+        second = T0 // SEC
+        self.assertEqual([s['vals'] for s in data],
+                         [[[2 * second + 1]], [[2 * second + 5]],
+                          [[2 * second + 9]], [[second + 6]]])
+
+        # a start time is aligned on the previous multiple of delta
+        del self.api.requests[:]
+        data = list(self.output.follow(poll=0.001, time_format='ns',
+                                       start=T0 + 3 * SEC, delta=2 * SEC))
+        self.assertEqual(self.api.requests,
+                         [{'start': T0 + 2 * SEC, 'end': T0 + 8 * SEC - 1,
+                           'delta': 2 * SEC}])
+        self.assertEqual(self.times(data), [2, 4, 6])
+
+
+class RunningAggregatorTests(unittest.TestCase):
+    def make_aggregator(self, **kwargs):
+        legend = [legend_entry('IPv4', 'NONE', name='ip'),
+                  legend_entry('UINT64', name='bytes'),
+                  legend_entry('UINT64', 'MAX', name='peak'),
+                  legend_entry('DOUBLE', 'AVG', name='rtt')]
+        return viewutils.RunningAggregator(legend, **kwargs)
+
+    def sample(self, second, *rows):
+        return {'t': T0 + second * SEC, 'p': 1,
+                'vals': [[ip, nbytes, peak, _view4.AvgPair(rtt, 1)]
+                         for ip, nbytes, peak, rtt in rows]}
+
+    def test_totals(self):
+        aggregator = self.make_aggregator(windows=[])
+        aggregator.update([self.sample(0, ('a', 10, 5, 1.0),
+                                       ('b', 1, 1, 3.0)),
+                           self.sample(1, ('a', 5, 7, 3.0)),
+                           {'t': T0 + 2 * SEC, 'p': 0, 'vals': [],
+                            'gap_start': T0 + 2 * SEC,
+                            'gap_end': T0 + 3 * SEC}])
+        self.assertEqual(sorted(aggregator.get_rows()),
+                         [['a', 15, 7, 2.0], ['b', 1, 1, 3.0]])
+        self.assertEqual(aggregator.top(1, 'bytes'), [['a', 15, 7, 2.0]])
+        self.assertEqual(aggregator.top(1, 3), [['b', 1, 1, 3.0]])
+        self.assertEqual(aggregator.top(5, 'peak', smallest=True),
+                         [['b', 1, 1, 3.0], ['a', 15, 7, 2.0]])
+
+    def test_windows(self):
+        window = datetime.timedelta(0, 4)
+        aggregator = self.make_aggregator(windows=[window], buckets=2)
+        for second in range(10):
+            aggregator.add(self.sample(second, ('a', second, 10 - second,
+                                                float(second))))
+        aggregator.add(self.sample(9, ('b', 100, 1, 0.0)))
+        # the last two buckets of 2s
+        self.assertEqual(sorted(aggregator.get_rows(window)),
+                         [['a', 6 + 7 + 8 + 9, 4, 7.5],
+                          ['b', 100, 1, 0.0]])
+        self.assertEqual(sorted(aggregator.get_rows()),
+                         [['a', 45, 10, 4.5], ['b', 100, 1, 0.0]])
+
+        # keys leave the window with their last bucket
+        for second in range(10, 14):
+            aggregator.add(self.sample(second, ('a', 1, 1, 1.0)))
+        self.assertEqual(aggregator.get_rows(window), [['a', 4, 1, 1.0]])
+        self.assertEqual(len(aggregator.totals), 2)
+        self.assertRaises(ValueError, aggregator.get_rows,
+                          datetime.timedelta(0, 5))
+
+    def test_validation(self):
+        aggregator = self.make_aggregator()
+        self.assertRaises(ValueError, aggregator.add,
+                          {'t': T0, 'p': 1, 'vals': [['a', 1, 1, 1.0]]})
+        self.assertRaises(ValueError, viewutils.RunningAggregator,
+                          [legend_entry('UINT64', 'TIME_AVG')])
+
+        aggregator = viewutils.RunningAggregator(
+            [legend_entry('UINT64', 'TIME_AVG')], delta=SEC)
+        aggregator.update([{'t': T0, 'p': 1, 'vals': [[4]]},
+                           {'t': T0 + 3 * SEC, 'p': 1, 'vals': [[8]]}])
+        # idle samples count as zero
+        self.assertEqual(aggregator.get_rows(), [[3.0]])
+
+
+class JsonArrayTests(unittest.TestCase):
+    def decode(self, body, size):
+        chunks = (body[i:i + size] for i in range(0, len(body), size))
+        return list(_utils.iter_json_array(chunks, 'samples'))
+
+    def test_chunk_boundaries(self):
+        doc = {'info': '"samples" inside a string',
+               'samples': [{'t': i, 'vals': [[u'caf\xe9', str(i)]] * i}
+                           for i in range(20)] + [12345, []]}
+        body = json.dumps(doc, indent=1)
+        for size in (1, 2, 5, 64, len(body)):
+            self.assertEqual(self.decode(body, size), doc['samples'])
+
+    def test_empty(self):
+        self.assertEqual(self.decode('{"samples": [ ]}', 3), [])
+        self.assertEqual(self.decode('', 3), [])
+
+    def test_null(self):
+        # like `res.get('samples') or []` without streaming
+        for size in (1, 2, 3, 100):
+            self.assertEqual(self.decode('{"samples": null, "x": 1}', size),
+                             [])
+
+    def test_nested(self):
+        body = ('{"a": {"samples": [9], "b": ["samples", {"samples": 8}]},'
+                ' "c": "samples\\\\", "samples": [1, 2]}')
+        for size in (1, 2, 7, 100):
+            self.assertEqual(self.decode(body, size), [1, 2])
+        self.assertRaises(ValueError, self.decode,
+                          '{"a": {"samples": [9]}}', 4)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, self.decode, '{"samples": [1, {"a"', 4)
+        self.assertRaises(ValueError, self.decode, '{"samples": [1 2]}', 4)
+        self.assertRaises(ValueError, self.decode, '{"other": []}', 4)
+
+
+class PrefetchTests(unittest.TestCase):
+    def test_order(self):
+        self.assertEqual(list(_utils.prefetch(iter(range(100)), 3)),
+                         range(100))
+
+    def test_exception(self):
+        def failing():
+            yield 1
+            raise KeyError('boom')
+
+        it = _utils.prefetch(failing(), 1)
+        self.assertEqual(next(it), 1)
+        self.assertRaises(KeyError, next, it)
+
+    def test_lazy_start(self):
+        produced = []
+
+        def numbers():
+            produced.append(0)
+            yield 0
+
+        threads = threading.active_count()
+        it = _utils.prefetch(numbers(), 1)
+        time.sleep(0.1)
+        self.assertEqual((produced, threading.active_count()), ([], threads))
+        self.assertEqual(list(it), [0])
+
+    def test_early_close(self):
+        produced = []
+
+        def numbers():
+            for i in range(1000):
+                produced.append(i)
+                yield i
+
+        it = _utils.prefetch(numbers(), 2)
+        self.assertEqual(next(it), 0)
+        it.close()
+        time.sleep(0.3)
+        self.assertTrue(len(produced) < 10)
@@ -0,0 +1,157 @@
+# Copyright (c) 2015 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import time
+import unittest
+
+from steelscript.common.datastructures import DictObject
+from steelscript.netshark.core.viewpool import ViewPool, covers
+
+
+SEC = 10 ** 9
+T0 = 1400000000 * SEC
+
+
+class FakeView(object):
+    def __init__(self, handle, start=T0, end=T0 + 9 * SEC):
+        self.handle = handle
+        self.closed = False
+        self.timeinfo = DictObject(dict(start=start, end=end, delta=SEC))
+
+    def _get_timeinfo(self):
+        return DictObject(self.timeinfo)
+
+    def close(self):
+        self.closed = True
+
+
+class ViewPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.shark = DictObject(dict(host='shark1'))
+        self.created = []
+
+    def create(self):
+        view = FakeView('v%d' % len(self.created))
+        self.created.append(view)
+        return view
+
+    def use(self, pool, key, shark=None, usable=None):
+        with pool.view(shark or self.shark, key, self.create,
+                       usable) as view:
+            return view
+
+    def test_reuse(self):
+        pool = ViewPool()
+        view = self.use(pool, 'a')
+        self.assertTrue(self.use(pool, 'a') is view)
+        self.assertFalse(view.closed)
+        self.assertTrue(self.use(pool, 'b') is not view)
+        # the same key on another appliance
+        self.use(pool, 'a', DictObject(dict(host='shark2')))
+        self.assertEqual((pool.hits, pool.misses, len(pool)), (1, 3, 3))
+
+        pool.close()
+        self.assertTrue(all(v.closed for v in self.created))
+        self.assertEqual(len(pool), 0)
+
+    def test_usable(self):
+        pool = ViewPool()
+        old = self.use(pool, 'a')
+        new = self.use(pool, 'a', usable=lambda view: False)
+        self.assertTrue(old.closed)
+        self.assertTrue(self.use(pool, 'a') is new)
+
+    def test_idle_timeout(self):
+        pool = ViewPool(idle_timeout=0.01)
+        view = self.use(pool, 'a')
+        time.sleep(0.02)
+        self.assertTrue(self.use(pool, 'a') is not view)
+        self.assertTrue(view.closed)
+        self.assertEqual(pool.evictions, 1)
+
+    def test_max_views(self):
+        pool = ViewPool(max_views=2)
+        a = self.use(pool, 'a')
+        self.use(pool, 'b')
+        self.use(pool, 'a')
+        # the least recently used view makes room
+        self.use(pool, 'c')
+        self.assertEqual(len(pool), 2)
+        self.assertEqual([v.closed for v in self.created],
+                         [False, True, False])
+        self.assertTrue(self.use(pool, 'a') is a)
+
+        # views in use are not evicted, the extra view is not pooled
+        with pool.view(self.shark, 'a', self.create):
+            with pool.view(self.shark, 'c', self.create):
+                extra = self.use(pool, 'd')
+        self.assertTrue(extra.closed)
+        self.assertEqual(len(pool), 2)
+
+    def test_error(self):
+        pool = ViewPool()
+        try:
+            with pool.view(self.shark, 'a', self.create) as view:
+                raise IOError('view deleted')
+        except IOError:
+            pass
+        self.assertTrue(view.closed)
+        self.assertEqual(len(pool), 0)
+
+    def test_usable_error(self):
+        pool = ViewPool()
+        old = self.use(pool, 'a')
+
+        def deleted(view):
+            raise IOError('view %s not found' % view.handle)
+
+        new = self.use(pool, 'a', usable=deleted)
+        self.assertTrue(new is not old)
+        self.assertTrue(old.closed)
+        self.assertTrue(self.use(pool, 'a') is new)
+        self.assertEqual(pool._creating, {})
+
+    def test_lookup_only(self):
+        pool = ViewPool()
+        with pool.view(self.shark, 'a', None) as view:
+            self.assertEqual(view, None)
+        view = self.use(pool, 'a')
+        with pool.view(self.shark, 'a', None) as pooled:
+            self.assertTrue(pooled is view)
+        with pool.view(self.shark, 'a', None,
+                       lambda view: False) as pooled:
+            self.assertEqual(pooled, None)
+        self.assertTrue(view.closed)
+        self.assertEqual(len(pool), 0)
+
+    def test_stopped_job(self):
+        # "last 10 minutes" requests on a job stopped 5 minutes ago
+        pool = ViewPool()
+        job_end = T0 + 9 * SEC
+        for minutes in range(3):
+            end = job_end + (5 + minutes) * 60 * SEC
+            view = self.use(pool, 'a',
+                            usable=lambda view: covers(view, end, job_end))
+        self.assertEqual((pool.hits, pool.misses), (2, 1))
+        self.assertFalse(view.closed)
+
+
+class CoversTests(unittest.TestCase):
+    def test_growing(self):
+        view = FakeView('v1')
+        self.assertTrue(covers(view, T0 + 10 * SEC))
+        self.assertFalse(covers(view, T0 + 11 * SEC))
+
+    def test_stopped(self):
+        view = FakeView('v1')
+        self.assertTrue(covers(view, T0 + 60 * SEC, T0 + 9 * SEC))
+        self.assertFalse(covers(view, T0 + 60 * SEC, T0 + 20 * SEC))
+
+    def test_empty(self):
+        view = FakeView('v1', start=None, end=None)
+        self.assertFalse(covers(view, T0))
+        self.assertTrue(covers(view, T0, 0))
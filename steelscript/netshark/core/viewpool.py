@@ -0,0 +1,275 @@
+# Copyright (c) 2015 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+"""
+Reuse of appliance views across requests.
+
+Creating a view makes the NetShark process the packets of its source,
+which is by far the slowest part of a request.  Requests that only
+differ by the time range they need can share a view created without a
+time filter, and pass the time range to get_data() instead.  A
+:py:class:`ViewPool` keeps such views open between requests::
+
+    pool = ViewPool(idle_timeout=600, max_views=4)
+
+    def create():
+        return shark.create_view(job, columns, filters)
+
+    with pool.view(shark, key, create) as view:
+        data = view.get_data(start=start, end=end)
+
+Views that are not used for `idle_timeout` seconds are closed, and at
+most `max_views` views are kept open on each appliance.
+"""
+
+from __future__ import absolute_import
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+__all__ = ['ViewPool', 'covers']
+
+
+def covers(view, end, source_end=None):
+    """ Return True if `view`, created without a time filter, holds the
+    data of its source up to `end`, in nanoseconds since the epoch.
+
+    `source_end` is the time of the last packet of a source that does
+    not grow anymore, such as a stopped capture job: the view then
+    covers any `end` after that packet, and a view without data covers
+    any `end`.
+    """
+    if source_end is not None:
+        end = min(end, source_end)
+    ti = view._get_timeinfo()
+    if not ti.end:
+        return source_end is not None
+    return ti.end + ti.delta >= end
+
+
+class _Entry(object):
+    """ A view of the pool """
+    __slots__ = ('view', 'host', 'users', 'last_used')
+
+    def __init__(self, view, host, now):
+        self.view = view
+        self.host = host
+        self.users = 0
+        self.last_used = now
+
+
+class ViewPool(object):
+    """ Keeps views open on the appliances, so that later requests for
+    the same data reuse them instead of creating new views.
+
+    Views are identified by the appliance and a `key` chosen by the
+    caller, which must describe everything that determines the data of
+    the view: the packet source, the columns, the filters and the
+    sampling time.
+
+    Views that have not been used for `idle_timeout` seconds are closed
+    when the pool is next used.  At most `max_views` views are kept for
+    each appliance: the least recently used idle view is closed to make
+    room for a new one, and if all of them are in use, the new view is
+    not pooled and is closed after the request.
+
+    The `hits`, `misses` and `evictions` counters are updated as the
+    pool is used.  A pool may be shared by several threads, and a view
+    of the pool by several requests at the same time.
+    """
+
+    def __init__(self, idle_timeout=600, max_views=4):
+        self.idle_timeout = idle_timeout
+        self.max_views = max_views
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # (host, key) -> _Entry
+        self._entries = {}
+        # (host, key) -> [lock held while the view for the key is looked
+        # up or created, number of requests using the lock]
+        self._creating = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<ViewPool %d views>' % len(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @contextmanager
+    def view(self, shark, key, create, usable=None):
+        """ Return a context manager that provides the pooled view for
+        `key` on `shark`, calling `create()` to create it if needed.
+
+        `usable`, if given, is called as `usable(view)` before a pooled
+        view is reused, and the view is replaced by a new one if it
+        returns False, for instance if it does not cover the time range
+        of the request, or if it raises an exception.
+
+        If `create` is None, no view is created: the context manager
+        provides None when there is no usable view in the pool.
+
+        If an exception is raised while the view is used, the view is
+        removed from the pool and closed, since it may not exist
+        anymore on the appliance.
+        """
+        host = getattr(shark, 'host', None)
+        self._expire()
+
+        entry = self._acquire(host, key, create, usable)
+        if entry is None:
+            yield None
+            return
+        try:
+            yield entry.view
+        except:
+            self._discard(host, key, entry)
+            raise
+        else:
+            self._release(host, key, entry)
+
+    def _acquire(self, host, key, create, usable):
+        """ Return the entry for `key`, in use by the caller, or None if
+        there is no usable entry and `create` is None """
+        with self._lock:
+            creating = self._creating.setdefault((host, key),
+                                                 [threading.Lock(), 0])
+            creating[1] += 1
+
+        try:
+            # concurrent requests for the same key wait for a single view
+            with creating[0]:
+                return self._lookup(host, key, create, usable)
+        finally:
+            with self._lock:
+                creating[1] -= 1
+                if not creating[1]:
+                    del self._creating[(host, key)]
+
+    def _lookup(self, host, key, create, usable):
+        """ Implement _acquire(), with the creation lock of `key` held """
+        with self._lock:
+            entry = self._entries.get((host, key))
+            if entry is not None:
+                entry.users += 1
+
+        if entry is not None:
+            try:
+                ok = usable is None or usable(entry.view)
+            except Exception as e:
+                logger.debug('view %s is not usable: %s' %
+                             (entry.view.handle, e))
+                ok = False
+            if ok:
+                with self._lock:
+                    self.hits += 1
+                logger.debug('reusing view %s' % entry.view.handle)
+                return entry
+            logger.debug('replacing view %s' % entry.view.handle)
+            self._discard(host, key, entry)
+
+        if create is None:
+            return None
+
+        view = create()
+        entry = _Entry(view, host, time.time())
+        entry.users = 1
+        evicted = []
+        with self._lock:
+            self.misses += 1
+            if self._make_room(host, evicted):
+                self._entries[(host, key)] = entry
+            else:
+                logger.debug('view pool full for %s' % host)
+                # the view is closed by _release
+                entry.host = None
+        for old in evicted:
+            self._close(old)
+        return entry
+
+    def _make_room(self, host, evicted):
+        """ Evict the least recently used idle view of `host` if it has
+        `max_views` views, and return False if there is still no room.
+        Must be called with the lock held. """
+        entries = [(e.last_used, k) for k, e in self._entries.iteritems()
+                   if e.host == host]
+        if len(entries) < self.max_views:
+            return True
+
+        idle = sorted(item for item in entries
+                      if self._entries[item[1]].users == 0)
+        if not idle:
+            return False
+        evicted.append(self._evict(idle[0][1]))
+        return True
+
+    def _evict(self, k):
+        """ Remove the view for `k` from the pool and return it, to be
+        closed once the lock is released.  Must be called with the lock
+        held. """
+        self.evictions += 1
+        return self._entries.pop(k).view
+
+    def _close(self, view):
+        try:
+            logger.debug('closing pooled view %s' % view.handle)
+            view.close()
+        except Exception as e:
+            logger.warning('failed to close view %s: %s' % (view.handle, e))
+
+    def _release(self, host, key, entry):
+        """ Mark `entry` as no longer used by the caller """
+        with self._lock:
+            entry.users -= 1
+            entry.last_used = time.time()
+            # views that are not pooled are closed by their last user
+            close = entry.host is None and entry.users == 0
+        if close:
+            self._close(entry.view)
+
+    def _discard(self, host, key, entry):
+        """ Remove `entry` from the pool, and close its view once it is
+        not used anymore """
+        with self._lock:
+            if self._entries.get((host, key)) is entry:
+                del self._entries[(host, key)]
+                self.evictions += 1
+            entry.host = None
+        self._release(host, key, entry)
+
+    def _expire(self):
+        """ Close the views that have been idle for `idle_timeout` """
+        if self.idle_timeout is None:
+            return
+        limit = time.time() - self.idle_timeout
+        with self._lock:
+            expired = [self._evict(k)
+                       for k, entry in self._entries.items()
+                       if entry.users == 0 and entry.last_used < limit]
+        for view in expired:
+            self._close(view)
+
+    def close(self):
+        """ Close all the idle views of the pool, views in use are closed
+        once they are released """
+        with self._lock:
+            idle = []
+            for entry in self._entries.itervalues():
+                entry.host = None
+                if entry.users == 0:
+                    idle.append(entry.view)
+            self._entries.clear()
+        for view in idle:
+            self._close(view)
@@ -14,12 +14,19 @@ This is a set of utility functions for working with views.
 from __future__ import absolute_import
 
 import csv
+import heapq
 import logging
-from datetime import datetime, timedelta
-from collections import namedtuple
+from datetime import timedelta
+from itertools import izip
+from collections import namedtuple, OrderedDict, deque
 
 from steelscript.common.datastructures import DictObject
-from steelscript.common.timeutils import tzutc, max_width
+from steelscript.common.timeutils import max_width
+from steelscript.netshark.core import _columnar
+from steelscript.netshark.core.types import Operation
+from steelscript.netshark.core._view4 import Sample, AvgPair, _Follower
+from steelscript.netshark.core._waiter import (ViewWaiter, ViewTimeout,
+                                               wait, wait_all)
 
 
 class OutputMixer(object):
@@ -30,41 +37,63 @@ class OutputMixer(object):
     outputs for bytes and packets, this class can be used to create
     a single output stream with bytes and packets columns.
 
-    Mixing is only supported on simple time-based views that do
-    not include any keys (e.g., bandwidth over time, etc.)
+    Outputs with keys (e.g., bytes and packets by IP address) can be
+    mixed as long as all of them have the same key columns: the rows
+    of the outputs are joined on their keys, and a key that is missing
+    from some output has None in the columns of that output.
 
     See examples/netshark/readview.py for typical usage.
     """
 
-    sourceobj = namedtuple('sourceobj', ['output', 'prefix', 'offset'])
+    sourceobj = namedtuple('sourceobj', ['output', 'prefix', 'offset',
+                                         'keys', 'values'])
 
     def __init__(self):
         """
         """
         self._sources = []
         self._legend = []
+        # the key columns shared by all the sources
+        self._keys = None
 
     def add_source(self, src, prefix=None):
         """ Add new source to mixer
 
-            `src` is time-based view object
+            `src` is time-based view object.  Raises NotImplementedError
+            if its key columns are not the same as the ones of the
+            sources already added.
         """
         if prefix is None:
             prefix = 'o%d' % len(self._sources)
 
-        obj = self.sourceobj(output=src, prefix=prefix, offset=len(self._legend))
+        legend = src.get_legend()
+        keys = [i for i, field in enumerate(legend) if field.dimension]
+        values = [i for i, field in enumerate(legend) if not field.dimension]
+
+        key_fields = [legend[i].get('field') for i in keys]
+        if self._keys is None:
+            self._keys = key_fields
+            for i in keys:
+                self._add_entry(legend[i], '')
+        elif key_fields != self._keys:
+            raise NotImplementedError('cannot mix outputs with keys %s and %s'
+                                      % (self._keys, key_fields))
+
+        obj = self.sourceobj(output=src, prefix=prefix,
+                             offset=len(self._legend),
+                             keys=keys, values=values)
         self._sources.append(obj)
 
-        for field in src.get_legend():
-            if field.dimension:
-                raise NotImplementedError()
+        for i in values:
+            self._add_entry(legend[i], prefix)
 
-            # create a new record overriding some fields
-            entry = DictObject(field)
-            entry.id = 'x%d' % len(self._legend)
-            entry.name = prefix + entry.name
+    def _add_entry(self, field, prefix):
+        # create a new record overriding some fields
+        entry = DictObject(field)
+        entry.id = 'x%d' % len(self._legend)
+        entry.name = prefix + entry.name
 
-            self._legend.append(entry)
+        self._legend.append(entry)
 
     def get_legend(self):
         """ Return the legend for each of the source objects
@@ -73,62 +102,121 @@ class OutputMixer(object):
 
     def get_iterdata(self, *args, **kwargs):
         """ Return a generator for the combined stream of outputs from each source object
+
+        The samples of the sources are merged in time order, and the
+        samples less than `time_thresh` apart (one second by default)
+        are combined in a single sample.  `time_thresh` is a timedelta,
+        or a number of nanoseconds.
+
+        The sources are read as streams, one sample at a time, so the
+        memory used does not depend on the size of the outputs.
+
+        With `compact=True`, the sources are read with compact samples and
+        the combined samples are returned as `Sample` objects instead of
+        DictObjects.
         """
         threshold = timedelta(seconds=1)
         if 'time_thresh' in kwargs:
             threshold = kwargs['time_thresh']
             del kwargs['time_thresh']
+        compact = kwargs.get('compact', False)
+        keyed = bool(self._keys)
+
+        def make_sample(t, rows):
+            vals = rows.values()
+            if compact:
+                return Sample(t, None, vals)
+            return DictObject.create_from_dict(dict(t=t,
+                                                    vals=vals,
+                                                    processed_pkts=None,
+                                                    unprocessed_pkts=None))
 
         template = [None] * len(self._legend)
-        iters = [s.output.get_iterdata(*args, **kwargs) for s in self._sources]
-        inputs = [next(i, None) for i in iters]
-
-        # XXX
-        infinity = datetime(year=9999, month=12, day=31, tzinfo=tzutc())
-
-        def get_sample_time(s):
-            if s is None:
-                return infinity
-            return s.t
-
-        def min_sample():
-            return min(inputs, key=get_sample_time)
-
-        ms = min_sample()
-        sample_time = ms.t
-        vals = list(template)
-        while ms is not None:
-            i = inputs.index(ms)
-            inputs[i] = next(iters[i], None)
 
-            delta = ms.t - sample_time
-            if delta >= threshold:
-                yield DictObject.create_from_dict(dict(t=sample_time,
-                                                       vals=[vals],
-                                                       processed_pkts=None,
-                                                       unprocessed_pkts=None))
+        def new_rows():
+            # rows of the combined sample, by key
+            rows = OrderedDict()
+            if not keyed:
+                rows[()] = list(template)
+            return rows
 
-                sample_time = ms.t
-                vals = list(template)
-
-            assert len(ms.vals) == 1
-
-            V = ms.vals[0]
-            off = self._sources[i].offset
-            for j in range(len(V)):
-                vals[off + j] = V[j]
-
-            ms = min_sample()
+        iters = [s.output.get_iterdata(*args, **kwargs) for s in self._sources]
 
-        yield DictObject.create_from_dict(dict(t=sample_time,
-                                               processed_pkts=None,
-                                               unprocessed_pkts=None,
-                                               vals=[vals]))
+        # the next sample of each source, ordered by time and source
+        heap = []
+        for i, it in enumerate(iters):
+            sample = next(it, None)
+            if sample is not None:
+                heap.append((sample['t'], i, sample))
+        heapq.heapify(heap)
+
+        sample_time = None
+        rows = None
+        while heap:
+            t, i, ms = heap[0]
+            nextsample = next(iters[i], None)
+            if nextsample is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (nextsample['t'], i, nextsample))
+
+            if sample_time is None:
+                threshold = _time_threshold(threshold, t)
+                sample_time = t
+                rows = new_rows()
+            elif t - sample_time >= threshold:
+                yield make_sample(sample_time, rows)
+
+                sample_time = t
+                rows = new_rows()
+
+            src = self._sources[i]
+            for V in ms.get('vals') or ():
+                key = tuple(V[k] for k in src.keys)
+                try:
+                    row = rows[key]
+                except KeyError:
+                    row = list(template)
+                    row[:len(key)] = key
+                    rows[key] = row
+
+                off = src.offset
+                for j in src.values:
+                    row[off] = V[j]
+                    off += 1
+
+        if sample_time is not None:
+            yield make_sample(sample_time, rows)
+
+
+def _time_threshold(threshold, t):
+    """ Return `threshold` as a timedelta or as a number of nanoseconds,
+    so that it can be compared to the difference between sample times
+    like `t` """
+    if isinstance(t, (int, long)):
+        if isinstance(threshold, timedelta):
+            return ((threshold.days * 86400 + threshold.seconds) * 10 ** 9 +
+                    threshold.microseconds * 1000)
+    elif not isinstance(threshold, timedelta):
+        return timedelta(microseconds=threshold / 1000.0)
+    return threshold
+
+
+def _iter_samples(stream, chunk, prefetch):
+    """ Return the samples of `stream`, read with get_iterdata() if it is
+    a view output """
+    if hasattr(stream, 'get_iterdata'):
+        return stream.get_iterdata(chunk=chunk, prefetch=prefetch)
+    if chunk is not None or prefetch:
+        raise ValueError('chunk and prefetch require a view output '
+                         'as stream')
+    return stream
 
 
 def print_data(legend, stream, timeformat='%Y/%m/%d %H:%M:%S.%f',
                include_sample_times=True,
-               widths=None, limit=None, line_prefix=''):
+               widths=None, limit=None, line_prefix='', prefetch=0,
+               chunk=None):
     """
     Print the data of a given view output to stdout.
 
@@ -139,6 +227,11 @@ def print_data(legend, stream, timeformat='%Y/%m/%d %H:%M:%S.%f',
     If `limit` is specified, only the first `limit` rows are printed.
 
     `line_prefix` is a string that is printed at the start of every line.
+
+    `stream` may also be a view output, whose data is then read with
+    `output.get_iterdata(chunk=chunk, prefetch=prefetch)`: its time
+    range is downloaded in windows of `chunk`, and `prefetch` windows
+    are read ahead while rows are being printed.
     """
 
     labels = []
@@ -179,6 +272,8 @@ def print_data(legend, stream, timeformat='%Y/%m/%d %H:%M:%S.%f',
     justified = [label.ljust(widths[i]) for i, label in enumerate(labels)]
     print line_prefix + '  '.join(justified)
 
+    stream = _iter_samples(stream, chunk, prefetch)
+
     total = 0
     for s in stream:
         if 'gap_start' in s or 'gap_end' in s:
@@ -195,7 +290,8 @@ def print_data(legend, stream, timeformat='%Y/%m/%d %H:%M:%S.%f',
             return
 
 
-def write_csv(filename, legend, stream, include_column_names=True, include_sample_times=True):
+def write_csv(filename, legend, stream, include_column_names=True, include_sample_times=True,
+              prefetch=0, chunk=None):
     """
     Saves the data of a view output to a comma separated values (csv) file.
 
@@ -210,7 +306,12 @@ def write_csv(filename, legend, stream, include_column_names=True, include_sampl
 
     If `include_sample_times` is True, the first column will be a
     timestamp.
+
+    `stream` may also be a view output, whose data is then read as in
+    print_data(), so that with `prefetch` the next windows are
+    downloaded and decoded while rows are being written.
     """
+    stream = _iter_samples(stream, chunk, prefetch)
 
     ofile = open(filename, "wb")
     writer = csv.writer(ofile)
@@ -236,24 +337,409 @@ def write_csv(filename, legend, stream, include_column_names=True, include_sampl
     ofile.close()
 
 
-class Cursor(object):
-    """Given a live view returns only new samples for each get_data call
+def _iter_arrow_tables(legend, stream, include_sample_times, batch_rows,
+                       prefetch, chunk):
+    """ Return the arrow schema for `legend`, and an iterator over the
+    arrow tables of the batches of `stream` """
+    schema = _columnar.arrow_schema(legend, include_sample_times)
+    if hasattr(stream, 'iter_arrays'):
+        stream = stream.iter_arrays(batch_rows=batch_rows, chunk=chunk,
+                                    prefetch=prefetch)
+    elif chunk is not None or prefetch:
+        raise ValueError('chunk and prefetch require a view output '
+                         'as stream')
+    tables = (_columnar.to_arrow_table(data, schema, include_sample_times)
+              for data in _columnar.iter_batches(legend, stream, batch_rows))
+    return schema, tables
+
+
+def write_parquet(filename, legend, stream, include_sample_times=True,
+                  batch_rows=65536, compression='snappy', prefetch=0,
+                  chunk=None):
     """
-    def __init__(self, output):
-        self.output = output
-        self._last_end = 0
+    Saves the data of a view output to a Parquet file.  This requires
+    numpy and pyarrow.
 
-    def get_data(self):
+    `legend` is an output legend, typically just the result
+    of `output.get_legend()`
 
-        source = self.output.view.source
-        view = self.output.view
+    `stream` is the data of the output: a series of data samples,
+    typically the result of `output.get_iterdata()`, or of columnar
+    data, the result of `output.iter_arrays()` or `output.get_arrays()`,
+    or the output itself, read with `output.iter_arrays()`.
+    Samples are converted to columns `batch_rows` rows at a time, and
+    each batch is written as a row group, so the whole output is never
+    held in memory.
+
+    Columns keep the types described in `output.get_arrays()`, with
+    ABSOLUTE_TIME fields as UTC nanosecond timestamps.  If
+    `include_sample_times` is True, the first column, called `time`,
+    holds the sample time of each row.  The legend is stored, json
+    encoded, in the schema metadata.
+
+    `compression` is the Parquet compression codec, and `chunk` and
+    `prefetch` are as in print_data().
+    """
+    _columnar._ensure_pyarrow()
+    import pyarrow.parquet
+
+    schema, tables = _iter_arrow_tables(legend, stream, include_sample_times,
+                                        batch_rows, prefetch, chunk)
+    writer = pyarrow.parquet.ParquetWriter(filename, schema,
+                                           compression=compression)
+    try:
+        for table in tables:
+            writer.write_table(table)
+    finally:
+        writer.close()
+
+
+def write_arrow(filename, legend, stream, include_sample_times=True,
+                batch_rows=65536, prefetch=0, chunk=None):
+    """
+    Saves the data of a view output to an Arrow IPC file, the format of
+    Feather version 2 files.  This requires numpy and pyarrow.
 
-        ti = view.get_timeinfo()
+    The file can be memory mapped and read without copying, for
+    instance with `pyarrow.ipc.open_file(pyarrow.memory_map(filename))`.
+    The arguments and the columns are the same as in write_parquet().
+    """
+    _columnar._ensure_pyarrow()
+    import pyarrow
+
+    schema, tables = _iter_arrow_tables(legend, stream, include_sample_times,
+                                        batch_rows, prefetch, chunk)
+    sink = pyarrow.OSFile(filename, 'wb')
+    try:
+        writer = pyarrow.RecordBatchFileWriter(sink, schema)
+        try:
+            for table in tables:
+                writer.write_table(table)
+        finally:
+            writer.close()
+    finally:
+        sink.close()
 
-        start = self._last_end
 
-        data = self.output.get_data(start=start, end=ti.end)
+class Cursor(object):
+    """Given a live view returns only new samples for each get_data call
 
-        self._last_end = ti.end
+    Each call returns the samples completed since the previous one,
+    every sample exactly once, with a single get_stats request and at
+    most one get_data request.  See `Output4.follow` for an iterator
+    that polls the view on its own, and for the meaning of the
+    arguments.
+    """
+    def __init__(self, output, start=None, delta=None, max_lag=None):
+        self.output = output
+        self._follower = _Follower(output, start, delta, max_lag)
+
+    def get_data(self, compact=False, time_format='datetime',
+                 avg_pairs=False):
+        samples = self._follower.poll()
+        return list(self.output._convert_samples(samples, time_format,
+                                                 compact, avg_pairs))
+
+
+# how each calculation is folded into a running aggregate
+_RUNNING_OPS = {Operation.sum: 'sum', Operation.max: 'max',
+                Operation.min: 'min', Operation.avg: 'avg',
+                Operation.timeavg: 'timeavg'}
+
+
+class _Window(object):
+    """ The buckets and running totals of one sliding window """
+    __slots__ = ('duration', 'size', 'nbuckets', 'buckets', 'totals', 'refs')
+
+    def __init__(self, duration, nbuckets):
+        self.duration = duration
+        self.size = -(-duration // nbuckets)
+        self.nbuckets = -(-duration // self.size)
+        # [bucket index, {key: aggregates}], oldest first
+        self.buckets = deque()
+        # key -> aggregates over all the buckets
+        self.totals = {}
+        # key -> number of buckets with the key
+        self.refs = {}
+
+
+class RunningAggregator(object):
+    """ Keeps running aggregates of the samples of an output, per key,
+    since it was created and over sliding windows of time, so that
+    totals and top-N queries on live views are answered from memory.
+
+    `legend` is the legend of the output.  The key of a row is made of
+    its values in the columns that are dimensions or have no
+    calculation, and the other columns are combined according to their
+    `calculation`, as in `ColumnarData.rollup`: sums for SUM, the
+    smallest and largest values for MIN and MAX, exact averages for AVG,
+    which requires the samples to be requested with `avg_pairs`, and
+    averages over time for TIME_AVG, which requires the sample duration
+    `delta` (a timedelta or a number of nanoseconds).
+
+    `windows` are the durations of the sliding windows, as timedeltas or
+    numbers of nanoseconds.  Each window is divided in `buckets` buckets
+    of time, and covers the buckets of its duration up to the last
+    sample added: whole buckets are expired as newer samples arrive,
+    by subtracting their aggregates from the totals of the window.
+
+    Samples are added with add() or update(), typically as they are
+    yielded by `Output4.follow`::
+
+        aggregator = RunningAggregator(output.get_legend())
+        for sample in output.follow(avg_pairs=True):
+            aggregator.add(sample)
+            print aggregator.top(10, 'bytes', timedelta(minutes=5))
+    """
 
-        return data
+    def __init__(self, legend, windows=(timedelta(minutes=1),
+                                        timedelta(minutes=5),
+                                        timedelta(hours=1)),
+                 buckets=60, delta=None):
+        self.legend = legend
+        self.delta = None if delta is None else _columnar._to_ns(delta)
+        if buckets < 1:
+            raise ValueError('buckets must be at least 1')
+
+        self._keys = []
+        # (index in the aggregates, index in the row, operation)
+        self._ops = []
+        for i, entry in enumerate(legend):
+            calculation = entry['calculation']
+            if entry.get('dimension') or calculation == Operation.none:
+                self._keys.append(i)
+            elif calculation not in _RUNNING_OPS:
+                raise ValueError('cannot aggregate column %s with '
+                                 'calculation %s' %
+                                 (entry['name'], calculation))
+            elif calculation == Operation.timeavg and self.delta is None:
+                raise ValueError('TIME_AVG column %s can only be aggregated '
+                                 'when the sample duration is known' %
+                                 entry['name'])
+            else:
+                self._ops.append((len(self._ops), i,
+                                  _RUNNING_OPS[calculation]))
+
+        self._windows = OrderedDict()
+        for duration in windows:
+            duration = _columnar._to_ns(duration)
+            if duration <= 0:
+                raise ValueError('window durations must be positive')
+            self._windows[duration] = _Window(duration, buckets)
+
+        self.totals = {}
+        self.first = None
+        self.last = None
+        self.samples = 0
+
+    def __repr__(self):
+        return '<RunningAggregator %d keys, %d samples>' % (len(self.totals),
+                                                            self.samples)
+
+    def _new(self, row):
+        """ Return the aggregates of the single `row` """
+        acc = [row[i] for _, i, _ in self._ops]
+        for j, i, op in self._ops:
+            if op == 'avg' and acc[j] is not None:
+                self._check_pair(acc[j], i)
+        return acc
+
+    def _check_pair(self, value, i):
+        if not isinstance(value, AvgPair):
+            raise ValueError('AVG column %s can only be aggregated when '
+                             'requested with avg_pairs' %
+                             self.legend[i]['name'])
+
+    def _fold(self, acc, row):
+        """ Combine the values of `row` into the aggregates `acc` """
+        for j, i, op in self._ops:
+            value = row[i]
+            if value is None:
+                continue
+            current = acc[j]
+            if op == 'avg':
+                self._check_pair(value, i)
+            if current is None:
+                acc[j] = value
+            elif op == 'sum' or op == 'timeavg':
+                acc[j] = current + value
+            elif op == 'max':
+                if value > current:
+                    acc[j] = value
+            elif op == 'min':
+                if value < current:
+                    acc[j] = value
+            else:
+                acc[j] = current.merge(value)
+
+    def _fold_into(self, aggregates, key, row):
+        """ Fold `row` into the aggregates of `key` in the dict
+        `aggregates`, and return True if the key is new """
+        acc = aggregates.get(key)
+        if acc is None:
+            aggregates[key] = self._new(row)
+            return True
+        self._fold(acc, row)
+        return False
+
+    def _expire(self, window, bucket):
+        """ Remove the aggregates of `bucket` from the totals of `window` """
+        totals = window.totals
+        for key, acc in bucket[1].iteritems():
+            window.refs[key] -= 1
+            if not window.refs[key]:
+                del window.refs[key]
+                del totals[key]
+                continue
+
+            total = totals[key]
+            for j, i, op in self._ops:
+                value = acc[j]
+                if value is None:
+                    continue
+                if op == 'sum' or op == 'timeavg':
+                    total[j] -= value
+                elif op == 'avg':
+                    total[j] = AvgPair(total[j].sum - value.sum,
+                                       total[j].count - value.count)
+                elif value == total[j]:
+                    # the extreme may have been in this bucket only
+                    values = [b[1][key][j] for b in window.buckets
+                              if key in b[1] and b[1][key][j] is not None]
+                    if not values:
+                        total[j] = None
+                    elif op == 'max':
+                        total[j] = max(values)
+                    else:
+                        total[j] = min(values)
+
+    def add(self, sample):
+        """ Fold the rows of `sample`, as returned by `Output4.follow` or
+        `Output4.get_iterdata` in any `time_format`, into the aggregates.
+
+        Samples are expected in time order.  Samples older than the
+        buckets of a window are only counted in the totals since the
+        start.  Gap markers have no rows and only advance the time.
+        """
+        t = _columnar._to_ns(sample['t'])
+        rows = sample.get('vals') or ()
+        if self.first is None or t < self.first:
+            self.first = t
+        if self.last is None or t > self.last:
+            self.last = t
+        self.samples += 1
+
+        keys = self._keys
+        keyed = [(tuple(row[i] for i in keys), row) for row in rows]
+        for key, row in keyed:
+            self._fold_into(self.totals, key, row)
+
+        for window in self._windows.itervalues():
+            index = t // window.size
+            buckets = window.buckets
+            bucket = None
+            if buckets and buckets[-1][0] >= index:
+                # a late sample, in the matching bucket if still there
+                for b in reversed(buckets):
+                    if b[0] == index:
+                        bucket = b
+                        break
+            else:
+                bucket = [index, {}]
+                buckets.append(bucket)
+                # expire the buckets that left the window
+                while buckets[0][0] <= index - window.nbuckets:
+                    self._expire(window, buckets.popleft())
+            if bucket is None:
+                continue
+
+            for key, row in keyed:
+                if self._fold_into(bucket[1], key, row):
+                    window.refs[key] = window.refs.get(key, 0) + 1
+                    if key in window.totals:
+                        self._fold(window.totals[key], row)
+                    else:
+                        window.totals[key] = self._new(row)
+                else:
+                    self._fold(window.totals[key], row)
+
+    def update(self, samples):
+        """ Fold all `samples` into the aggregates, see add() """
+        for sample in samples:
+            self.add(sample)
+
+    def _span(self, window):
+        """ Return the time covered by `window`, or by all the samples if
+        `window` is None, in nanoseconds """
+        if self.last is None:
+            return 0
+        end = self.last + (self.delta or 0)
+        span = end - self.first
+        if window is not None:
+            start = (window.buckets[0][0] * window.size
+                     if window.buckets else end)
+            span = min(span, end - max(start, self.first))
+        return span
+
+    def get_windows(self):
+        """ Return the list of the window durations, in nanoseconds """
+        return list(self._windows)
+
+    def get_rows(self, window=None):
+        """ Return the list of the aggregated rows over `window`, one of
+        the window durations given to the constructor, or since the
+        start if `window` is None.
+
+        Rows have the columns of the legend, with the key values and the
+        aggregates: averages are returned as numbers, and are None if no
+        values were averaged.
+        """
+        if window is None:
+            totals = self.totals
+            span = self._span(None)
+        else:
+            try:
+                duration = _columnar._to_ns(window)
+                win = self._windows[duration]
+            except KeyError:
+                raise ValueError('no window of %s' % window)
+            totals = win.totals
+            span = self._span(win)
+
+        ncolumns = len(self.legend)
+        rows = []
+        for key, acc in totals.iteritems():
+            row = [None] * ncolumns
+            for i, value in izip(self._keys, key):
+                row[i] = value
+            for j, i, op in self._ops:
+                value = acc[j]
+                if value is not None:
+                    if op == 'avg':
+                        value = value.value
+                    elif op == 'timeavg':
+                        value = (float(value) * self.delta / span
+                                 if span else None)
+                row[i] = value
+            rows.append(row)
+        return rows
+
+    def top(self, n, column, window=None, smallest=False):
+        """ Return the `n` rows with the largest values in `column`, a
+        legend name or index, over `window` as in get_rows(), in
+        decreasing order.  If `smallest` is True, the rows with the
+        smallest values are returned instead, in increasing order.
+        Rows without a value in `column` come last. """
+        if isinstance(column, basestring):
+            names = [entry['name'] for entry in self.legend]
+            try:
+                column = names.index(column)
+            except ValueError:
+                raise ValueError('no column named %s' % column)
+
+        rows = self.get_rows(window)
+        if smallest:
+            return heapq.nsmallest(n, rows, key=lambda row: (
+                row[column] is None, row[column]))
+        return heapq.nlargest(n, rows, key=lambda row: (
+            row[column] is not None, row[column]))